@@ -40,6 +40,10 @@ def reverse(series: pd.Series, max_val: int = 7):
 
 warnings.filterwarnings("ignore", message="scipy.stats.shapiro: Input data has range zero*")
 
+# output di `python -m components.turn_store export` (default --out-dir)
+CONVERSATIONS_EXPORT_DIR = os.environ.get("CONVERSATIONS_EXPORT_DIR",
+                                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations_export"))
+
 # ------------------------------------------------------------
 # 2. Load CSV
 # ------------------------------------------------------------
@@ -191,8 +195,9 @@ post = post.join(ssq_delta.add_suffix("_Δ"))
 # ------------------------------------------------------------
 # 5. Objective metrics from logs
 # ------------------------------------------------------------
+# JSON annidati dell'export: i log live (JSONL in analysis/conversations) non vengono letti qui
 rows=[]
-for path in glob.glob("conversations/*.json"):
+for path in glob.glob(os.path.join(CONVERSATIONS_EXPORT_DIR, "*.json")):
     with open(path,encoding="utf-8") as f: js = json.load(f)
     uid = js.get("user_id", os.path.basename(path).split(".")[0])
     for sess in js.get("sessions",[]):
@@ -0,0 +1,82 @@
+# benchmarks/bench_audio_decode.py
+"""
+Confronta la decodifica di un chunk audio con ffmpeg avviato per ogni chunk
+(percorso storico: file temporaneo → convert_to_wav → load_audio) con la
+decodifica in-process (soundfile + resample_poly) e con i processi ffmpeg
+avviati in anticipo, su chunk da 1 s, 5 s e 25 s (OGG/Vorbis 44.1 kHz stereo).
+
+Uso:  python -m benchmarks.bench_audio_decode [--repeats 10]
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+import statistics
+import numpy as np
+import soundfile as sf
+
+from components.audio_processor import AudioProcessor
+from components.ffmpeg_prespawn import FfmpegPrespawner
+
+SRC_SR    = 44_100
+DURATIONS = (1, 5, 25)
+
+def synth_chunk(seconds, sr=SRC_SR):
+    """Segnale stereo con armoniche e inviluppo sillabico, simile a voce."""
+    t   = np.arange(int(seconds * sr)) / sr
+    f0  = 140 + 20 * np.sin(2 * np.pi * 0.5 * t)
+    ph  = 2 * np.pi * np.cumsum(f0) / sr
+    sig = sum(np.sin(k * ph) / k for k in range(1, 8))
+    sig *= 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    sig /= np.max(np.abs(sig))
+    return np.stack([sig, 0.8 * sig], axis=1).astype(np.float32)
+
+def encode(audio, fmt, subtype=None):
+    buf = io.BytesIO()
+    sf.write(buf, audio, SRC_SR, format=fmt, subtype=subtype)
+    return buf.getvalue()
+
+def spawn_per_chunk(proc, data):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "chunk.ogg")
+        with open(path, "wb") as f:
+            f.write(data)
+        wav_path = proc.convert_to_wav(path)
+        return proc.load_audio(wav_path, 30)
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), min(times)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeats", type=int, default=10)
+    args = ap.parse_args()
+
+    proc = AudioProcessor()
+    pre  = FfmpegPrespawner(size=2)
+    print(f"{'chunk':>6} | {'percorso':<28} | {'mediana ms':>10} | {'min ms':>8}")
+    print("-" * 62)
+    for sec in DURATIONS:
+        audio = synth_chunk(sec)
+        ogg   = encode(audio, "OGG", "VORBIS")
+        wav   = encode(audio, "WAV", "PCM_16")
+        cases = [
+            ("spawn-per-chunk (ogg)",    lambda: spawn_per_chunk(proc, ogg)),
+            ("in-process (ogg)",         lambda: proc.decode_bytes(ogg, 30)),
+            ("in-process (wav 44.1k)",   lambda: proc.decode_bytes(wav, 30)),
+            ("ffmpeg pre-avviato (ogg)", lambda: pre.decode(ogg)),
+        ]
+        for name, fn in cases:
+            med, best = timeit(fn, args.repeats)
+            print(f"{sec:>5}s | {name:<28} | {med:>10.1f} | {best:>8.1f}")
+            time.sleep(0.2)   # lascia il tempo di rimpiazzare il processo pre-avviato
+    pre.close()
+
+if __name__ == "__main__":
+    main()
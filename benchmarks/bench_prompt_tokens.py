@@ -0,0 +1,65 @@
+# benchmarks/bench_prompt_tokens.py
+"""
+Token spesi per le emozioni nel prompt: formato originale (``full``, il
+dizionario di EmotionMemory serializzato per intero) contro i livelli
+``none`` / ``top1`` / ``compact`` di Orchestrator. Per ogni livello riporta i
+token del prompt di un turno e quelli dello storico re-inviato dopo
+``--turns`` turni (nel formato originale lo storico conteneva il prompt
+completo, ora solo testo + tag).
+
+Uso:  python -m benchmarks.bench_prompt_tokens [--turns 10]
+"""
+import argparse
+import math
+from datetime import datetime
+
+from components.orchestrator import Orchestrator, EMOTION_VERBOSITY
+from components.conversation_manager import count_tokens, MESSAGE_OVERHEAD_TOKENS, _ENCODING
+
+LABELS = ["angry", "disgust", "fearful", "happy", "neutral", "sad", "surprised"]
+
+def emo_dict(seed):
+    """Dizionario come quello salvato da flask_server.store_emotions."""
+    raw   = [math.exp(math.sin(seed * 1.7 + i) * 2) for i in range(len(LABELS))]
+    probs = {e: r / sum(raw) for e, r in zip(LABELS, raw)}
+    return {
+        "probs": probs,
+        "top_emotion": max(probs, key=probs.get),
+        "entropy": -sum(p * math.log2(p) for p in probs.values()),
+        "emo_timestamp": datetime(2025, 7, 8, 17, 19, seed % 60).isoformat(),
+        "chunk_duration_ms": 25000.0,
+    }
+
+TEXTS = ["Ho messo il pallone sul supporto, adesso cosa faccio?",
+         "Non riesco a pesare il resorcinolo, la bilancia non risponde.",
+         "Ok, fatto. Passo all'etanolo?",
+         "Quanto acido solforico devo versare nel becher?"]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=10)
+    args = ap.parse_args()
+
+    print(f"conteggio token: {'tiktoken' if _ENCODING is not None else 'stima ~4 caratteri/token'}")
+    print(f"{'livello':<8} | {'prompt (tok)':>12} | {'storico dopo ' + str(args.turns) + ' turni':>24} | {'vs full':>8}")
+    print("-" * 62)
+    rows = {}
+    for level in EMOTION_VERBOSITY:
+        orch = Orchestrator(None, None, None, emotion_verbosity=level)
+        prompt_tok, history_tok = [], 0
+        for t in range(args.turns):
+            text, emotions = TEXTS[t % len(TEXTS)], emo_dict(t)
+            prompt = orch._build_prompt(text, emotions)
+            prompt_tok.append(count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS)
+            # "full" riproduce il comportamento originale: nello storico finiva il prompt completo
+            stored = prompt if level == "full" else orch._history_text(text, emotions)
+            history_tok += count_tokens(stored) + MESSAGE_OVERHEAD_TOKENS
+        rows[level] = (sum(prompt_tok) / len(prompt_tok), history_tok)
+
+    full_total = sum(rows["full"])
+    for level, (p, h) in rows.items():
+        print(f"{level:<8} | {p:>12.1f} | {h:>24d} | {(p + h) / full_total:>7.0%}")
+    print("\nesempio compact:", Orchestrator(None, None, None)._build_prompt(TEXTS[0], emo_dict(0)).replace("\n", " ⏎ "))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_state_backend.py
+"""
+Costo per turno dello stato per utente nei backend di components.state_backend:
+più processi worker (come gunicorn -w N) eseguono turni su utenti propri,
+ognuno con i lotti di un turno reale (emozioni aggiornate e lette, storico
+letto e scambio aggiunto da ConversationManager) sotto il lock per utente.
+Confronta il MemoryBackend nel processo (riferimento, non condiviso), il
+ManagerBackend (proxy multiprocessing.managers) e lo stand-in RESP.
+
+Uso:  python -m benchmarks.bench_state_backend [--workers 4] [--turns 500] [--users 20]
+"""
+import time
+import argparse
+import threading
+import multiprocessing as mp
+
+from benchmarks.loadtest             import free_port, percentiles
+from components.state_backend        import create_backend, serve_manager, RespServer
+from components.conversation_manager import ConversationManager
+from components.emotion_memory       import EmotionMemory
+
+EMOTIONS = {"neutral": 0.6, "happy": 0.3, "sad": 0.1}
+
+def run_worker(url, worker, turns, users):
+    backend = create_backend(url)
+    conv    = ConversationManager(max_context_tokens=3000, backend=backend)
+    emo     = EmotionMemory(backend=backend)
+    times   = []
+    for i in range(turns):
+        user = f"w{worker}-u{i % users}"
+        t0   = time.perf_counter()
+        emo.update(user, EMOTIONS)
+        emo.get_recent(user)
+        conv.get_history(user)
+        conv.add_exchange(user, "Come ruoto il pannello di sinistra?", "Premi il tasto laterale e ruota il polso.")
+        times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+def main():
+    ap = argparse.ArgumentParser(description="Latenza per turno dei backend di stato")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--turns", type=int, default=500, help="turni per worker")
+    ap.add_argument("--users", type=int, default=20, help="utenti per worker")
+    args = ap.parse_args()
+
+    manager_addr = f"127.0.0.1:{free_port()}"
+    manager      = mp.Process(target=serve_manager, args=(manager_addr, b"jarvis"), daemon=True)
+    manager.start()
+    resp         = RespServer(f"127.0.0.1:{free_port()}")
+    threading.Thread(target=resp.serve_forever, daemon=True).start()
+    time.sleep(0.5)
+
+    urls = {"memory (nel processo)": None,
+            "manager":               f"manager://{manager_addr}",
+            "resp":                  f"redis://127.0.0.1:{resp.server_address[1]}/0"}
+    print(f"{args.workers} worker × {args.turns} turni\n")
+    print(f"{'backend':<22} {'p50 ms':>8} {'p99 ms':>8} {'turni/s':>10}")
+    with mp.Pool(args.workers) as pool:
+        for name, url in urls.items():
+            t0    = time.perf_counter()
+            times = pool.starmap(run_worker, [(url, w, args.turns, args.users) for w in range(args.workers)])
+            rate  = args.workers * args.turns / (time.perf_counter() - t0)
+            stats = percentiles([t for ts in times for t in ts])
+            print(f"{name:<22} {stats['p50']:>8.3f} {stats['p99']:>8.3f} {rate:>10.0f}")
+    manager.terminate()
+    resp.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/check_backend_drift.py
+"""
+Verifica di deriva dei backend di EmotionRecognizer rispetto al baseline
+eager fp32: su un insieme fisso di clip confronta le probabilità per label
+(max/media differenza assoluta), l'accordo sulla top emotion e la latenza.
+Esce con codice 1 se un backend scende sotto ``--min-agreement``.
+
+Uso:  python -m benchmarks.check_backend_drift [--audio-dir clips/] [--backends int8 bf16 onnx]
+Senza ``--audio-dir`` usa un set sintetico deterministico (seed fisso).
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+import numpy as np
+
+from components.audio_processor    import AudioProcessor
+from components.emotion_recognizer import EmotionRecognizer
+
+def load_clips(audio_dir, max_sec=25):
+    if audio_dir:
+        proc  = AudioProcessor()
+        paths = sorted(glob.glob(os.path.join(audio_dir, "*.wav")) + glob.glob(os.path.join(audio_dir, "*.flac")))
+        return [(os.path.basename(p), proc.load_audio(p, max_sec)) for p in paths]
+    rng   = np.random.default_rng(1234)
+    clips = []
+    for i, sec in enumerate((3, 8, 15, 25)):
+        t   = np.arange(sec * 16_000) / 16_000
+        f0  = rng.uniform(100, 250)
+        sig = sum(np.sin(2 * np.pi * k * f0 * t) / k for k in range(1, 6))
+        sig = sig * (0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(2, 6) * t)) + 0.05 * rng.standard_normal(len(t))
+        clips.append((f"synth_{i}_{sec}s", (sig / np.max(np.abs(sig))).astype(np.float32)))
+    return clips
+
+def run(rec, clips):
+    probs, times = [], []
+    for _, audio in clips:
+        t0  = time.perf_counter()
+        out = dict(rec.predict(audio))
+        times.append((time.perf_counter() - t0) * 1000)
+        probs.append(out)
+    return probs, statistics.median(times)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model-id", default="firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3")
+    ap.add_argument("--audio-dir")
+    ap.add_argument("--backends", nargs="+", default=["int8", "bf16", "onnx"])
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--min-agreement", type=float, default=1.0, help="quota minima di top emotion uguali al baseline")
+    args = ap.parse_args()
+
+    clips = load_clips(args.audio_dir)
+    base, base_ms = run(EmotionRecognizer(args.model_id, intra_op_threads=args.threads), clips)
+    print(f"{'backend':<8} | {'top-1 acc.':>10} | {'max |Δp|':>9} | {'mean |Δp|':>9} | {'mediana ms':>10}")
+    print("-" * 60)
+    print(f"{'eager':<8} | {1.0:>10.2%} | {0.0:>9.4f} | {0.0:>9.4f} | {base_ms:>10.1f}")
+
+    failed = False
+    for backend in args.backends:
+        try:
+            rec = EmotionRecognizer(args.model_id, backend=backend, intra_op_threads=args.threads)
+        except Exception as e:
+            print(f"{backend:<8} | non disponibile: {e}")
+            continue
+        cand, ms = run(rec, clips)
+        diffs = [abs(c[label] - b[label]) for b, c in zip(base, cand) for label in b]
+        agree = statistics.mean(max(b, key=b.get) == max(c, key=c.get) for b, c in zip(base, cand))
+        name  = backend if rec.backend == backend else f"{backend}→{rec.backend}"
+        print(f"{name:<8} | {agree:>10.2%} | {max(diffs):>9.4f} | {statistics.mean(diffs):>9.4f} | {ms:>10.1f}")
+        failed |= agree < args.min_agreement
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
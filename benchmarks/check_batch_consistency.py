@@ -0,0 +1,50 @@
+# benchmarks/check_batch_consistency.py
+"""
+Verifica che il risultato di una clip non dipenda dalle altre clip del
+batch: per ogni backend e length_mode confronta ``predict`` della clip da
+sola con la stessa clip in ``predict_batch`` insieme a una clip più lunga
+(padding diverso). Differenza massima per label oltre ``--tolerance`` o top
+emotion diversa → exit code 1.
+
+Uso:  python -m benchmarks.check_batch_consistency [--model-dir snapshot/] [--backends eager int8 bf16]
+Senza ``--model-dir`` usa un Whisper minuscolo generato (vedi benchmarks.microbench).
+"""
+import sys
+import shutil
+import argparse
+import tempfile
+
+from benchmarks.bench_audio_decode import synth_chunk
+from benchmarks.microbench         import save_tiny_model
+from components.emotion_recognizer import EmotionRecognizer, LENGTH_MODES
+
+INIT_STD = 0.2        # pesi del modello minuscolo: probabilità lontane dall'uniforme, differenze visibili
+
+def main():
+    ap = argparse.ArgumentParser(description="Stesse probabilità per una clip da sola e in batch")
+    ap.add_argument("--model-dir", default=None)
+    ap.add_argument("--backends", nargs="+", default=["eager", "int8", "bf16"])
+    ap.add_argument("--tolerance", type=float, default=0.02, help="max |Δp| ammesso (int8 quantizza le attivazioni con scale che dipendono dal batch)")
+    args = ap.parse_args()
+
+    tmp       = tempfile.mkdtemp(prefix="jarvis_batch_check_")
+    model_dir = args.model_dir or save_tiny_model(f"{tmp}/tiny_emotion_model", init_std=INIT_STD)
+    short     = synth_chunk(3, sr=16_000)[:, 0].copy()
+    long      = synth_chunk(12, sr=16_000)[:, 1].copy()
+    failed    = False
+    try:
+        for backend in args.backends:
+            for mode in LENGTH_MODES:
+                rec     = EmotionRecognizer(local_dir=model_dir, backend=backend, length_mode=mode)
+                alone   = dict(rec.predict(short))
+                batched = dict(rec.predict_batch([short, long])[0])
+                diff    = max(abs(alone[l] - batched[l]) for l in alone)
+                ok      = diff <= args.tolerance and max(alone, key=alone.get) == max(batched, key=batched.get)
+                failed |= not ok
+                print(f"{'✓' if ok else '✗'} {rec.backend:<6} {mode:<9} max |Δp| {diff:.5f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/check_connection_reuse.py
+"""
+Verifica del flag ``connection_reused`` nei metadata degli agenti LLM contro
+i backend finti di benchmarks.fake_backends: la prima chiamata di un
+trasporto nuovo apre il socket (False), le successive lo riusano (True),
+per Ollama (requests, anche in streaming) e OpenAI (httpx). Lo streaming
+dell'SDK OpenAI chiude la risposta a ``[DONE]`` senza leggere la fine del
+corpo, quindi httpx scarta la connessione: lì il flag atteso è sempre False.
+Esce con codice 1 se una sequenza è diversa da quella attesa.
+
+Uso:  python -m benchmarks.check_connection_reuse
+"""
+import os
+import sys
+
+from benchmarks.fake_backends    import LlmProfile, start_llm_server
+from benchmarks.loadtest         import free_port
+from components.http_transport   import HttpTransport
+
+MESSAGES = [{"role": "user", "content": "Come ruoto il pannello?"}]
+EXPECTED = [False, True, True]
+NO_REUSE = [False, False, False]
+
+def sequence(agent, stream):
+    flags = []
+    for _ in EXPECTED:
+        if stream:
+            "".join(agent.stream_response(MESSAGES))
+        else:
+            agent.get_response(MESSAGES)
+        flags.append(agent.get_last_metadata().get("connection_reused"))
+    return flags
+
+def main():
+    address = f"127.0.0.1:{free_port()}"
+    server  = start_llm_server(address, LlmProfile(ttft="fixed:5", tokens="fixed:5", tokens_per_sec=1000))
+    os.environ["OPENAI_BASE_URL"] = f"http://{address}/v1"
+    from components.chat_agent        import ChatAgent
+    from components.ollama_chat_agent import OllamaChatAgent
+    agents = {"ollama": lambda: OllamaChatAgent(host=f"http://{address}", transport=HttpTransport()),
+              "openai": lambda: ChatAgent("sk-fake", transport=HttpTransport())}
+
+    failed = False
+    for name, make in agents.items():
+        for stream in (False, True):
+            flags = sequence(make(), stream)
+            ok    = flags == (NO_REUSE if name == "openai" and stream else EXPECTED)
+            failed |= not ok
+            print(f"{'✓' if ok else '✗'} {name:<7} {'stream' if stream else 'unica':<7} {flags}")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/check_emotion_cache_disk.py
+"""
+Verifica del livello su disco di EmotionCache: con più chiavi del tetto la
+cartella resta entro ``disk_max_entries`` (restano le più recenti), i file
+scaduti spariscono allo sweep e una cache riaperta sulla stessa cartella
+con un tetto più basso la riporta entro il limite.
+Esce con codice 1 se un controllo fallisce.
+
+Uso:  python -m benchmarks.check_emotion_cache_disk
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+from components.emotion_cache import EmotionCache
+
+VALUE = {"emotions": [["neutral", 0.9]]}
+
+def files(path):
+    return sorted(n for n in os.listdir(path) if n.endswith(".json"))
+
+def main():
+    tmp     = tempfile.mkdtemp(prefix="jarvis_emo_cache_")
+    results = []
+    try:
+        cache = EmotionCache("check", max_entries=8, ttl_sec=3600, disk_dir=tmp, disk_max_entries=50)
+        keys  = [cache.key(np.full(16, i, dtype=np.float32)) for i in range(200)]
+        for key in keys:
+            cache.put(key, VALUE)
+        on_disk = files(tmp)
+        results.append(("tetto rispettato", len(on_disk) <= 50, f"{len(on_disk)} file"))
+        results.append(("restano le più recenti", on_disk == sorted(f"{k}.json" for k in keys[-50:]), ""))
+
+        small = EmotionCache("check", ttl_sec=3600, disk_dir=tmp, disk_max_entries=10)
+        results.append(("riapertura con tetto più basso", len(files(tmp)) == 10, f"{len(files(tmp))} file"))
+        results.append(("hit su disco / miss oltre il tetto",
+                        small.get(keys[-1]) == VALUE and small.get(keys[0]) is None, ""))
+
+        removed = EmotionCache("check", ttl_sec=3600, disk_dir=tmp).sweep_disk(now=time.time() + 7200)
+        results.append(("sweep degli scaduti", not files(tmp), f"{removed} rimossi"))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    failed = False
+    for name, ok, detail in results:
+        failed |= not ok
+        print(f"{'✓' if ok else '✗'} {name:<34} {detail}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# benchmarks/fake_backends.py
+"""
+Backend finti per i load test: rimpiazzano in locale l'API OpenAI
+(``/v1/chat/completions``, anche in streaming SSE con ``include_usage``),
+Ollama (``/api/chat`` e ``/api/generate``, NDJSON) e il processo di
+inferenza emozioni (stesso protocollo di components.inference_server).
+
+Latenze e velocità sono configurabili con distribuzioni:
+``fixed:MS``, ``uniform:MIN,MAX``, ``lognormal:MEDIANA,SIGMA``, ``exp:MEDIA``.
+Per una risposta LLM: attesa prima del primo token (``--ttft``), poi
+``--tokens`` token (distribuzione) emessi a ``--tokens-per-sec``.
+
+Uso:  python -m benchmarks.fake_backends [--llm-address 127.0.0.1:8011] [--emo-address 127.0.0.1:6011]
+      [--ttft lognormal:300,0.5] [--tokens uniform:40,120] [--tokens-per-sec 60] [--emo-latency lognormal:80,0.3]
+
+Il server si collega con OPENAI_BASE_URL=http://127.0.0.1:8011/v1,
+OLLAMA_HOST=http://127.0.0.1:8011 (con USE_LOCAL_MODEL=1) ed
+EMO_INFERENCE_ADDR=127.0.0.1:6011.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from components.inference_server import InferenceServer, parse_address
+
+WORDS  = ("certo", "allora", "prova", "a", "ruotare", "il", "pannello", "verso", "destra", "poi", "conferma",
+          "con", "un", "gesto", "della", "mano", "ottimo", "lavoro", "continua", "così")
+LABELS = ("angry", "disgust", "fear", "happy", "neutral", "sad", "surprise")
+
+class Distribution:
+    """Campionatore da una specifica testuale (vedi docstring del modulo)."""
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind   = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "lognormal", "exp"):
+            raise ValueError(f"Distribuzione sconosciuta: {spec}")
+
+    def sample(self, rng=random):
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return rng.uniform(p[0], p[1])
+        if self.kind == "lognormal":
+            return p[0] * rng.lognormvariate(0, p[1])
+        return rng.expovariate(1 / p[0])
+
+    def __repr__(self):
+        return self.spec
+
+
+class LlmProfile:
+    """Tempo al primo token (ms), numero di token e velocità di generazione di una risposta finta."""
+    def __init__(self, ttft="lognormal:300,0.5", tokens="uniform:40,120", tokens_per_sec=60.0):
+        self.ttft           = Distribution(ttft)
+        self.tokens         = Distribution(tokens)
+        self.tokens_per_sec = tokens_per_sec
+
+    def plan(self, rng=random):
+        n_tokens = max(1, int(self.tokens.sample(rng)))
+        words    = [rng.choice(WORDS) for _ in range(n_tokens)]
+        return self.ttft.sample(rng) / 1000, [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+
+def _prompt_tokens(messages):
+    return sum(len(str(m.get("content", ""))) // 4 + 4 for m in messages)
+
+
+class _LlmHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive, come i backend reali
+    profile          = None
+
+    def log_message(self, *args):
+        pass
+
+    # --- HTTP ---
+    def do_GET(self):
+        if self.path.startswith("/api/version"):
+            return self._json({"version": "fake"})
+        return self._json({"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.path.endswith("/chat/completions"):
+            return self._openai(body)
+        if self.path in ("/api/chat", "/api/generate"):
+            return self._ollama(body, chat=self.path == "/api/chat")
+        self._json({"error": "not found"}, status=404)
+
+    # --- OpenAI ---
+    def _openai(self, body):
+        ttft, tokens = self.profile.plan()
+        usage = {"prompt_tokens": _prompt_tokens(body.get("messages", [])), "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model, created = body.get("model", "gpt-4o-mini"), int(time.time())
+        time.sleep(ttft)
+        if not body.get("stream"):
+            time.sleep(len(tokens) / self.profile.tokens_per_sec)
+            return self._json({"id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                               "choices": [{"index": 0, "finish_reason": "stop",
+                                            "message": {"role": "assistant", "content": "".join(tokens)}}],
+                               "usage": usage})
+        def chunk(choices, **extra):
+            return {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                    "model": model, "choices": choices, **extra}
+        self._start_stream("text/event-stream")
+        for token in tokens:
+            self._send_chunk("data: " + json.dumps(chunk([{"index": 0, "delta": {"content": token}}])) + "\n\n")
+            time.sleep(1 / self.profile.tokens_per_sec)
+        self._send_chunk("data: " + json.dumps(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])) + "\n\n")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_chunk("data: " + json.dumps(chunk([], usage=usage)) + "\n\n")
+        self._send_chunk("data: [DONE]\n\n")
+        self._end_stream()
+
+    # --- Ollama ---
+    def _ollama(self, body, chat):
+        t_start      = time.perf_counter_ns()
+        ttft, tokens = self.profile.plan()
+        prompt       = body.get("messages", []) if chat else [{"content": body.get("prompt", "")}]
+        time.sleep(ttft)
+        t_eval       = time.perf_counter_ns()
+        def piece(text, done):
+            out = {"model": body.get("model", "llama3.2"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "done": done}
+            if chat:
+                out["message"] = {"role": "assistant", "content": text}
+            else:
+                out["response"] = text
+            return out
+        def final():
+            now = time.perf_counter_ns()
+            return dict(piece("", True), done_reason="stop", prompt_eval_count=_prompt_tokens(prompt),
+                        eval_count=len(tokens), load_duration=0, prompt_eval_duration=t_eval - t_start,
+                        eval_duration=now - t_eval, total_duration=now - t_start)
+        if not body.get("stream", True):
+            time.sleep(len(tokens) / self.profile.tokens_per_sec)
+            return self._json(dict(final(), **{k: v for k, v in piece("".join(tokens), True).items()
+                                                if k in ("message", "response")}))
+        self._start_stream("application/x-ndjson")
+        for token in tokens:
+            self._send_chunk(json.dumps(piece(token, False)) + "\n")
+            time.sleep(1 / self.profile.tokens_per_sec)
+        self._send_chunk(json.dumps(final()) + "\n")
+        self._end_stream()
+
+    # --- risposta ---
+    def _json(self, obj, status=200):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _LlmServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # il client (o il server sotto test terminato) chiude a metà stream: non è un errore del finto
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeEmotionRecognizer:
+    """Recognizer con latenza per batch campionata da ``latency`` (ms) e probabilità casuali."""
+    def __init__(self, latency="lognormal:80,0.3", per_item_ms=10.0):
+        self.latency     = Distribution(latency)
+        self.per_item_ms = per_item_ms
+
+    def predict_batch(self, audio_arrays):
+        time.sleep((self.latency.sample() + self.per_item_ms * (len(audio_arrays) - 1)) / 1000)
+        return [self._probs() for _ in audio_arrays]
+
+    def predict(self, audio_array):
+        return self.predict_batch([audio_array])[0]
+
+    def cache_signature(self):
+        return "fake-emotion"
+
+    @staticmethod
+    def _probs():
+        weights = [random.random() ** 3 for _ in LABELS]
+        total   = sum(weights)
+        return sorted(((l, w / total) for l, w in zip(LABELS, weights)), key=lambda x: -x[1])
+
+
+def start_llm_server(address, profile):
+    """Avvia il server OpenAI/Ollama finto in un thread; ritorna il server (``shutdown()`` per fermarlo)."""
+    handler = type("LlmHandler", (_LlmHandler,), {"profile": profile})
+    server  = _LlmServer(parse_address(address), handler)
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
+
+def start_emotion_server(address, recognizer, authkey=b"jarvis"):
+    """Avvia il processo di inferenza finto (in un thread) sullo stesso protocollo di components.inference_server."""
+    server = InferenceServer(recognizer, address, authkey=authkey)
+    threading.Thread(target=server.serve_forever, name="fake-emotion", daemon=True).start()
+    return server
+
+def add_profile_args(ap):
+    ap.add_argument("--ttft", default="lognormal:300,0.5", help="attesa prima del primo token (ms)")
+    ap.add_argument("--tokens", default="uniform:40,120", help="token per risposta")
+    ap.add_argument("--tokens-per-sec", type=float, default=60.0)
+    ap.add_argument("--emo-latency", default="lognormal:80,0.3", help="latenza per batch di inferenza (ms)")
+
+def main():
+    ap = argparse.ArgumentParser(description="Backend LLM ed emozioni finti per i load test")
+    ap.add_argument("--llm-address", default="127.0.0.1:8011")
+    ap.add_argument("--emo-address", default="127.0.0.1:6011")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    start_llm_server(args.llm_address, LlmProfile(args.ttft, args.tokens, args.tokens_per_sec))
+    start_emotion_server(args.emo_address, FakeEmotionRecognizer(args.emo_latency))
+    print(f"LLM finto su http://{args.llm_address} (OpenAI: /v1, Ollama: /api), emozioni su {args.emo_address}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
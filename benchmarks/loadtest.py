@@ -0,0 +1,329 @@
+# benchmarks/loadtest.py
+"""
+Load test ripetibile di flask_server con N utenti concorrenti.
+
+Ogni utente virtuale è un thread con la propria sessione HTTP keep-alive
+che, dopo una pausa di "think time", sceglie un'operazione secondo il mix:
+``upload`` (chunk audio sintetico simile al parlato), ``chat`` (una quota
+in streaming NDJSON) o ``reset``. Con ``--spawn`` (default) il test avvia
+da sé i backend finti (benchmarks/fake_backends.py) e un'istanza del
+server collegata a loro, con il log dei turni in una cartella temporanea;
+con ``--target URL`` colpisce un server già in esecuzione.
+
+Il risultato è un file JSON con configurazione e, per endpoint, richieste,
+errori, error rate, throughput e latenze p50/p95/p99 (per lo streaming
+anche il tempo al primo token); ``--compare`` stampa le differenze
+rispetto a un risultato precedente.
+
+Uso:  python -m benchmarks.loadtest [--users 50] [--duration 60] [--mix upload=0.6,chat=0.35,reset=0.05]
+      [--stream-ratio 0.5] [--backend openai|ollama] [--ttft lognormal:300,0.5] [--out loadtest.json]
+      [--compare loadtest_prev.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import socket
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+import requests
+import soundfile as sf
+
+from benchmarks.fake_backends import (LlmProfile, FakeEmotionRecognizer, start_llm_server,
+                                      start_emotion_server, add_profile_args)
+
+SR      = 16_000
+PROMPTS = ("Come ruoto il pannello?", "Non riesco ad afferrare l'oggetto, mi aiuti?",
+           "Perfetto, qual è il prossimo passo?", "Mi ripeti l'ultima istruzione?",
+           "Sono un po' confuso, da dove inizio?", "Ho finito, cosa faccio adesso?")
+
+# ─── Audio sintetico ────────────────────────────────────────────
+def synth_speech(seconds, rng):
+    """
+    Segnale simile al parlato: fondamentale che varia (100-250 Hz) con
+    armoniche, due formanti a rumore filtrato, sillabe a ~4 Hz e pause.
+    """
+    n     = int(seconds * SR)
+    t     = np.arange(n) / SR
+    f0    = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+    phase = 2 * np.pi * np.cumsum(f0) / SR
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    noise = rng.standard_normal(n)
+    for fc in (rng.uniform(500, 900), rng.uniform(1200, 2400)):
+        noise += np.sin(2 * np.pi * fc * t) * rng.standard_normal(n) * 0.3
+    syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t + rng.uniform(0, np.pi)), 0, None) ** 2
+    pauses    = np.repeat(rng.random(int(np.ceil(seconds * 2))) > 0.2, SR // 2)[:n]
+    signal    = (0.8 * voice + 0.2 * noise) * syllables * pauses
+    return (0.3 * signal / (np.abs(signal).max() or 1)).astype(np.float32)
+
+def wav_bytes(audio):
+    buf = io.BytesIO()
+    sf.write(buf, audio, SR, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+# ─── Raccolta risultati ─────────────────────────────────────────
+class Recorder:
+    """Latenze e esiti per endpoint, thread-safe."""
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self.latency  = defaultdict(list)     # endpoint → ms
+        self.ttft     = defaultdict(list)     # endpoint → ms al primo token (streaming)
+        self.status   = defaultdict(lambda: defaultdict(int))
+        self.errors   = defaultdict(lambda: defaultdict(int))
+        self.outcomes = defaultdict(int)      # esito di /upload_audio
+
+    def record(self, endpoint, ms, status, error=None, ttft_ms=None, outcome=None):
+        with self._lock:
+            self.latency[endpoint].append(ms)
+            self.status[endpoint][str(status)] += 1
+            if error:
+                self.errors[endpoint][error] += 1
+            if ttft_ms is not None:
+                self.ttft[endpoint].append(ttft_ms)
+            if outcome:
+                self.outcomes[outcome] += 1
+
+def percentiles(values):
+    if not values:
+        return None
+    a = np.asarray(values)
+    return {"p50": float(np.percentile(a, 50)), "p95": float(np.percentile(a, 95)),
+            "p99": float(np.percentile(a, 99)), "mean": float(a.mean()), "max": float(a.max())}
+
+# ─── Utente virtuale ────────────────────────────────────────────
+class VirtualUser(threading.Thread):
+    def __init__(self, idx, args, base_url, chunks, recorder, stop_at, run_id):
+        super().__init__(name=f"vu-{idx}", daemon=True)
+        self.user_id  = f"load_{run_id}_{idx:04d}"
+        self.args     = args
+        self.base     = base_url
+        self.chunks   = chunks
+        self.rec      = recorder
+        self.stop_at  = stop_at
+        self.rng      = random.Random(args.seed * 100_003 + idx)
+        self.session  = requests.Session()
+        ops, weights  = zip(*args.mix.items())
+        self.ops, self.weights = ops, weights
+
+    def run(self):
+        time.sleep(self.rng.uniform(0, self.args.ramp_up))
+        while time.time() < self.stop_at:
+            time.sleep(self.rng.expovariate(1000 / self.args.think_ms) if self.args.think_ms else 0)
+            op = self.rng.choices(self.ops, self.weights)[0]
+            endpoint = op if op != "upload" else "upload_audio"
+            try:
+                getattr(self, op)()
+            except ValueError:
+                # corpo JSON o riga NDJSON non valida (anche r.json() di requests): errore, non fine del thread
+                self.rec.record(endpoint, 0.0, "bad_response", "bad_response")
+            except requests.RequestException as e:
+                self.rec.record(endpoint, 0.0, "exception", type(e).__name__)
+
+    def upload(self):
+        t0 = time.perf_counter()
+        r  = self.session.post(f"{self.base}/upload_audio", data={"user_id": self.user_id},
+                               files={"audio": ("chunk.wav", self.rng.choice(self.chunks), "audio/wav")},
+                               timeout=self.args.timeout)
+        ms = (time.perf_counter() - t0) * 1000
+        outcome = (r.json().get("status") if r.ok else None) if r.content else None
+        self.rec.record("upload_audio", ms, r.status_code, None if r.ok else f"http_{r.status_code}", outcome=outcome)
+
+    def chat(self):
+        stream = self.rng.random() < self.args.stream_ratio
+        body   = {"user_id": self.user_id, "text": self.rng.choice(PROMPTS), "stream": stream}
+        t0 = time.perf_counter()
+        if not stream:
+            r  = self.session.post(f"{self.base}/chat_message", json=body, timeout=self.args.timeout)
+            ms = (time.perf_counter() - t0) * 1000
+            text  = (r.json().get("response") or "") if r.ok else ""
+            error = None if r.ok else f"http_{r.status_code}"
+            if r.ok and text.startswith(("Errore:", "[Ollama]")):
+                error = "llm_error"
+            return self.rec.record("chat", ms, r.status_code, error)
+        ttft_ms, error, done = None, None, False
+        with self.session.post(f"{self.base}/chat_message", json=body, stream=True, timeout=self.args.timeout) as r:
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                msg = json.loads(line)
+                if "token" in msg and ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - t0) * 1000
+                    if msg["token"].startswith(("Errore:", "[Ollama]")):
+                        error = "llm_error"
+                if "error" in msg:
+                    error = "stream_error"
+                done = done or msg.get("done", False)
+        ms = (time.perf_counter() - t0) * 1000
+        if r.ok and not done and not error:
+            error = "stream_incomplete"
+        self.rec.record("chat_stream", ms, r.status_code, error or (None if r.ok else f"http_{r.status_code}"),
+                        ttft_ms=ttft_ms)
+
+    def reset(self):
+        t0 = time.perf_counter()
+        r  = self.session.post(f"{self.base}/reset_conversation", data={"user_id": self.user_id},
+                               timeout=self.args.timeout)
+        self.rec.record("reset_conversation", (time.perf_counter() - t0) * 1000, r.status_code,
+                        None if r.ok else f"http_{r.status_code}")
+
+# ─── Stack locale ───────────────────────────────────────────────
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn_stack(args):
+    """Backend finti nel processo del test, server Flask in un sottoprocesso. Ritorna (url, processo)."""
+    llm_addr = f"127.0.0.1:{free_port()}"
+    emo_addr = f"127.0.0.1:{free_port()}"
+    start_llm_server(llm_addr, LlmProfile(args.ttft, args.tokens, args.tokens_per_sec))
+    start_emotion_server(emo_addr, FakeEmotionRecognizer(args.emo_latency))
+    port = free_port()
+    env  = dict(os.environ,
+                OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://{llm_addr}/v1",
+                OLLAMA_HOST=f"http://{llm_addr}", USE_LOCAL_MODEL="1" if args.backend == "ollama" else "0",
+                EMO_INFERENCE_ADDR=emo_addr, LOG_LEVEL=args.server_log_level,
+                CONVERSATIONS_DIR=tempfile.mkdtemp(prefix="jarvis_loadtest_"))
+    code = ("import flask_server as fs; "
+            f"fs.app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)")
+    proc = subprocess.Popen([sys.executable, "-c", code], env=env,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            stdout=subprocess.DEVNULL if not args.server_output else None,
+                            stderr=subprocess.DEVNULL if not args.server_output else None)
+    return f"http://127.0.0.1:{port}", proc
+
+def wait_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    return False
+
+# ─── Report ─────────────────────────────────────────────────────
+def build_report(args, rec, elapsed):
+    endpoints = {}
+    for ep in sorted(rec.latency):
+        n      = len(rec.latency[ep])
+        errors = sum(rec.errors[ep].values())
+        endpoints[ep] = {"requests": n, "errors": errors, "error_rate": errors / n if n else 0.0,
+                         "throughput_rps": n / elapsed, "latency_ms": percentiles(rec.latency[ep]),
+                         "status": dict(rec.status[ep]), "error_kinds": dict(rec.errors[ep])}
+        if rec.ttft[ep]:
+            endpoints[ep]["ttft_ms"] = percentiles(rec.ttft[ep])
+    total    = sum(e["requests"] for e in endpoints.values())
+    total_er = sum(e["errors"] for e in endpoints.values())
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "duration_sec": elapsed,
+        "total": {"requests": total, "errors": total_er, "error_rate": total_er / total if total else 0.0,
+                  "throughput_rps": total / elapsed},
+        "upload_outcomes": dict(rec.outcomes),
+        "endpoints": endpoints,
+    }
+
+def print_report(report, previous=None):
+    print(f"\n{'endpoint':<20}{'req':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'ttft p50':>10}")
+    for ep, e in report["endpoints"].items():
+        lat  = e["latency_ms"] or {}
+        ttft = (e.get("ttft_ms") or {}).get("p50")
+        print(f"{ep:<20}{e['requests']:>7}{e['throughput_rps']:>8.1f}{100 * e['error_rate']:>6.1f}%"
+              f"{lat.get('p50', 0):>9.1f}{lat.get('p95', 0):>9.1f}{lat.get('p99', 0):>9.1f}"
+              f"{ttft if ttft is not None else float('nan'):>10.1f}")
+    t = report["total"]
+    print(f"{'totale':<20}{t['requests']:>7}{t['throughput_rps']:>8.1f}{100 * t['error_rate']:>6.1f}%")
+    print(f"esiti upload: {report['upload_outcomes']}")
+    if not previous:
+        return
+    print("\nconfronto con il risultato precedente (p95, throughput):")
+    for ep, e in report["endpoints"].items():
+        old = previous.get("endpoints", {}).get(ep)
+        if not old or not e["latency_ms"] or not old.get("latency_ms"):
+            continue
+        d_p95 = e["latency_ms"]["p95"] - old["latency_ms"]["p95"]
+        d_rps = e["throughput_rps"] - old["throughput_rps"]
+        print(f"  {ep:<20} p95 {old['latency_ms']['p95']:8.1f} → {e['latency_ms']['p95']:8.1f} ms ({d_p95:+.1f})"
+              f"   rps {old['throughput_rps']:6.1f} → {e['throughput_rps']:6.1f} ({d_rps:+.1f})")
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        op, _, w = part.partition("=")
+        if op not in ("upload", "chat", "reset"):
+            raise argparse.ArgumentTypeError(f"Operazione sconosciuta nel mix: {op}")
+        mix[op] = float(w)
+    return mix
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test di flask_server con backend LLM/emozioni finti")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--duration", type=float, default=60, help="secondi di carico (ramp-up incluso)")
+    ap.add_argument("--ramp-up", type=float, default=5, help="avvio degli utenti distribuito su s secondi")
+    ap.add_argument("--mix", type=parse_mix, default=parse_mix("upload=0.6,chat=0.35,reset=0.05"))
+    ap.add_argument("--stream-ratio", type=float, default=0.5, help="quota di chat in streaming")
+    ap.add_argument("--think-ms", type=float, default=500, help="pausa media tra due richieste di un utente")
+    ap.add_argument("--chunk-sec", type=float, default=3, help="durata dei chunk audio")
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--target", default=None, help="URL di un server già avviato (niente backend finti)")
+    ap.add_argument("--backend", choices=("openai", "ollama"), default="openai", help="API LLM simulata con --spawn")
+    ap.add_argument("--server-log-level", default="WARNING")
+    ap.add_argument("--server-output", action="store_true", help="mostra stdout/stderr del server avviato")
+    ap.add_argument("--ready-timeout", type=float, default=120)
+    ap.add_argument("--out", default=None, help="file JSON dei risultati (default loadtest_<timestamp>.json)")
+    ap.add_argument("--compare", default=None, help="risultato precedente da confrontare")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    rng    = np.random.default_rng(args.seed)
+    chunks = [wav_bytes(synth_speech(args.chunk_sec, rng)) for _ in range(16)]
+    proc   = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        base_url, proc = spawn_stack(args)
+    try:
+        if not wait_ready(base_url, args.ready_timeout):
+            print(f"Server non pronto su {base_url} entro {args.ready_timeout:.0f}s")
+            sys.exit(2)
+        rec     = Recorder()
+        run_id  = f"{int(time.time()) % 100_000:05d}"
+        t_start = time.time()
+        users   = [VirtualUser(i, args, base_url, chunks, rec, t_start + args.duration, run_id)
+                   for i in range(args.users)]
+        for u in users:
+            u.start()
+        for u in users:
+            u.join()
+        elapsed = time.time() - t_start
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    report = build_report(args, rec, elapsed)
+    out    = args.out or f"loadtest_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    print_report(report, previous)
+    print(f"\nrisultati salvati in {out}")
+
+if __name__ == "__main__":
+    main()
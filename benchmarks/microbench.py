@@ -0,0 +1,326 @@
+# benchmarks/microbench.py
+"""
+Micro-benchmark dei componenti caldi con confronto rispetto a una baseline.
+
+Casi (``gruppo[parametro]``):
+  - ``audio.load_audio`` / ``audio.decode_bytes`` / ``audio.convert_to_wav``
+    su chunk da 1, 5 e 25 s (convert_to_wav solo se ffmpeg è installato);
+  - ``accumulator.cycle``: 60 chunk da 0.5 s con add_chunk + should_infer
+    (+ pop_concat quando pronto), modalità a soglia e a finestra scorrevole;
+  - ``emotion.predict``: EmotionRecognizer su 5 s di audio, padded e trimmed.
+    Di default usa un Whisper minuscolo generato con ``save_pretrained`` in
+    una cartella temporanea (nessun download, gira su qualsiasi host CI);
+    ``--emo-model-dir`` misura il modello reale;
+  - ``orchestrator.build_prompt``: formato compact e full;
+  - ``save_turn``: flask_server.save_turn fino alla scrittura con fsync (flush
+    del writer) su un log riportato a 10, 100 e 1000 turni prima di ogni round.
+
+Ogni caso viene calibrato (cicli interni fino a ``--min-time`` secondi per
+round) e ripetuto ``--rounds`` volte; si confronta il minimo per chiamata
+(il meno sensibile al rumore dell'host), la mediana è riportata.
+Con una baseline (``--save-baseline`` la scrive) un caso più lento di
+``--max-slowdown`` volte è una regressione; indipendentemente dalla
+baseline, il costo per turno di save_turn a 1000 turni non deve superare
+``SCALING`` volte quello a 10 turni (una scrittura quadratica lo viola).
+Exit code 1 se c'è una regressione.
+
+Uso:  python -m benchmarks.microbench [--filter save_turn] [--save-baseline]
+      [--baseline benchmarks/microbench_baseline.json] [--max-slowdown 1.5] [--out results.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+
+import numpy as np
+import soundfile as sf
+
+from benchmarks.bench_audio_decode import synth_chunk, SRC_SR
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbench_baseline.json")
+EMO_LABELS = ("angry", "disgust", "fear", "happy", "neutral", "sad", "surprise")
+EMOTIONS   = {"probs": {"happy": 0.61, "neutral": 0.22, "surprise": 0.08, "sad": 0.04,
+                        "fear": 0.03, "angry": 0.01, "disgust": 0.01},
+              "top_emotion": "happy", "entropy": 1.71,
+              "emo_timestamp": "2025-01-01T12:00:00", "chunk_duration_ms": 25000.0}
+# (caso piccolo, caso grande, rapporto massimo del costo per chiamata)
+SCALING    = [("save_turn[turns=10]", "save_turn[turns=1000]", 2.0)]
+
+CASES = []
+
+class Skip(Exception):
+    pass
+
+def case(group, params):
+    """Registra ``setup(param, ctx) -> (fn, reset | None)`` per ogni parametro; ``reset`` precede ogni round."""
+    def register(setup):
+        for p in params:
+            CASES.append((f"{group}[{p}]", setup, p))
+        return setup
+    return register
+
+
+def save_tiny_model(path, seed=0, init_std=0.02):
+    """
+    Whisper per classificazione audio con pochi parametri, salvato in ``path``
+    come uno snapshot reale. Un ``init_std`` alto dà probabilità meno uniformi.
+    """
+    import torch
+    from transformers import WhisperConfig, WhisperForAudioClassification, WhisperFeatureExtractor
+    torch.manual_seed(seed)
+    cfg = WhisperConfig(num_mel_bins=128, d_model=64, encoder_layers=2, encoder_attention_heads=2,
+                        encoder_ffn_dim=128, decoder_layers=1, decoder_attention_heads=2,
+                        decoder_ffn_dim=128, classifier_proj_size=32, num_labels=len(EMO_LABELS),
+                        id2label=dict(enumerate(EMO_LABELS)),
+                        label2id={l: i for i, l in enumerate(EMO_LABELS)}, init_std=init_std)
+    WhisperForAudioClassification(cfg).save_pretrained(path)
+    WhisperFeatureExtractor(feature_size=128).save_pretrained(path)
+    return path
+
+
+class Context:
+    """Risorse condivise fra i casi, create al primo uso e rimosse a fine run."""
+    def __init__(self, args):
+        self.args = args
+        self.tmp  = tempfile.mkdtemp(prefix="jarvis_microbench_")
+        self._tiny_model = None
+        self._server     = None
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def tiny_model_dir(self):
+        if self._tiny_model is None:
+            self._tiny_model = save_tiny_model(self.path("tiny_emotion_model"))
+        return self._tiny_model
+
+    def server(self):
+        """flask_server importato con backend finti e log dei turni nella cartella temporanea."""
+        if self._server is None:
+            os.environ.setdefault("EMO_INFERENCE_ADDR", "127.0.0.1:9")
+            os.environ.setdefault("LOG_LEVEL", "WARNING")
+            os.environ["CONVERSATIONS_DIR"] = self.path("conversations")
+            import flask_server
+            self._server = flask_server
+        return self._server
+
+    def close(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def _wav_file(ctx, seconds):
+    path = ctx.path(f"chunk_{seconds}s.wav")
+    sf.write(path, synth_chunk(seconds), SRC_SR)
+    return path
+
+# ─── Casi ───────────────────────────────────────────────────────
+@case("audio.load_audio", params=(1, 5, 25))
+def _load_audio(seconds, ctx):
+    from components.audio_processor import AudioProcessor
+    proc, path = AudioProcessor(), _wav_file(ctx, seconds)
+    return (lambda: proc.load_audio(path, 30)), None
+
+@case("audio.decode_bytes", params=(1, 5, 25))
+def _decode_bytes(seconds, ctx):
+    from components.audio_processor import AudioProcessor
+    proc = AudioProcessor()
+    buf  = io.BytesIO()
+    sf.write(buf, synth_chunk(seconds), SRC_SR, format="WAV")
+    data = buf.getvalue()
+    return (lambda: proc.decode_bytes(data, 30, suffix=".wav")), None
+
+@case("audio.convert_to_wav", params=(1, 5, 25))
+def _convert_to_wav(seconds, ctx):
+    if shutil.which("ffmpeg") is None:
+        raise Skip("ffmpeg non installato")
+    from components.audio_processor import AudioProcessor
+    proc = AudioProcessor()
+    path = ctx.path(f"chunk_{seconds}s.ogg")
+    sf.write(path, synth_chunk(seconds), SRC_SR, format="OGG", subtype="VORBIS")
+    return (lambda: proc.convert_to_wav(path)), None
+
+@case("accumulator.cycle", params=("threshold", "streaming"))
+def _accumulator(mode, ctx):
+    from components.audio_accumulator import AudioAccumulator
+    acc   = (AudioAccumulator(threshold_sec=30) if mode == "threshold"
+             else AudioAccumulator(threshold_sec=30, window_sec=10, hop_sec=2))
+    chunk = (0.1 * np.random.default_rng(0).standard_normal(8_000)).astype(np.float32)
+    def run():
+        for _ in range(60):
+            acc.add_chunk("bench", chunk)
+            if acc.should_infer("bench"):
+                acc.pop_concat("bench")
+    return run, None
+
+@case("emotion.predict", params=("padded", "trimmed"))
+def _emotion_predict(mode, ctx):
+    if ctx.args.skip_emotion:
+        raise Skip("--skip-emotion")
+    from components.emotion_recognizer import EmotionRecognizer
+    rec   = EmotionRecognizer(local_dir=ctx.args.emo_model_dir or ctx.tiny_model_dir(), length_mode=mode)
+    audio = synth_chunk(5, sr=16_000)[:, 0].copy()
+    rec.predict(audio)
+    return (lambda: rec.predict(audio)), None
+
+@case("orchestrator.build_prompt", params=("compact", "full"))
+def _build_prompt(verbosity, ctx):
+    from components.orchestrator import Orchestrator
+    orch = Orchestrator(None, None, None, emotion_verbosity=verbosity)
+    text = "Non riesco ad afferrare il pannello, come lo ruoto verso destra?"
+    return (lambda: orch._build_prompt(text, EMOTIONS)), None
+
+@case("save_turn", params=("turns=10", "turns=100", "turns=1000"))
+def _save_turn(param, ctx):
+    from components.turn_store import TurnStore
+    fs      = ctx.server()
+    n_turns = int(param.split("=")[1])
+    store   = fs.turn_store = TurnStore(ctx.path(f"turns_{n_turns}"), flush_interval_sec=0)
+    user_id = f"bench_{n_turns}"
+    meta    = {"model_name": "gpt-4o-mini", "prompt_tokens": 420, "completion_tokens": 80,
+               "llm_latency_ms": 812.0, "ttft_ms": 240.0, "prompt_build_ms": 0.4}
+    args    = (user_id, "Come ruoto il pannello?", "Ruotalo verso destra con un gesto della mano.",
+               meta, 4, 23, {"wav": 3.1, "emo": 85.0, "llm": 812.0})
+    for _ in range(n_turns):
+        fs.save_turn(*args)
+    store.flush()
+    path = store._path(user_id, "jsonl")
+    size = os.path.getsize(path)
+
+    def reset():
+        # ogni round riparte da un log di esattamente n_turns turni, con la cache già ricostruita
+        store.flush()
+        os.truncate(path, size)
+        store._state.pop(user_id)
+        store._load(user_id)
+
+    def run():
+        # la scrittura è asincrona: flush() include nel tempo misurato append, write e fsync
+        fs.save_turn(*args)
+        store.flush()
+    return run, reset
+
+# ─── Runner ─────────────────────────────────────────────────────
+def measure(fn, reset, rounds, min_time):
+    """Mediana e minimo del costo per chiamata (µs) su ``rounds`` round calibrati."""
+    t0 = time.perf_counter()
+    fn()
+    once  = max(time.perf_counter() - t0, 1e-7)
+    loops = max(1, min(100_000, int(min_time / once)))
+    per_call = []
+    for _ in range(rounds):
+        if reset:
+            reset()
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_call.append((time.perf_counter() - t0) / loops * 1e6)
+    return {"median_us": statistics.median(per_call), "min_us": min(per_call),
+            "rounds": rounds, "loops": loops}
+
+def environment():
+    import importlib.metadata as md
+    versions = {}
+    for pkg in ("numpy", "torch", "transformers", "soundfile"):
+        try:
+            versions[pkg] = md.version(pkg)
+        except md.PackageNotFoundError:
+            pass
+    return {"host": platform.node(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "packages": versions}
+
+def compare(results, baseline, max_slowdown):
+    """Righe di confronto e lista delle regressioni (baseline e vincoli di scalabilità)."""
+    rows, regressions = [], []
+    for name, r in results.items():
+        base  = (baseline or {}).get("results", {}).get(name)
+        ratio = r["min_us"] / base["min_us"] if base else None
+        if ratio is not None and ratio > max_slowdown:
+            regressions.append(f"{name}: {ratio:.2f}x più lento della baseline "
+                               f"({base['min_us']:.1f} → {r['min_us']:.1f} µs)")
+        rows.append((name, r["median_us"], r["min_us"], base["min_us"] if base else None, ratio))
+    for small, large, limit in SCALING:
+        if small in results and large in results:
+            ratio = results[large]["min_us"] / results[small]["min_us"]
+            if ratio > limit:
+                regressions.append(f"{large}: {ratio:.1f}x il costo di {small} (massimo {limit}x), "
+                                   f"la crescita con la lunghezza del log non è più costante")
+    return rows, regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmark dei componenti con confronto su baseline")
+    ap.add_argument("--filter", default=None, help="solo i casi il cui nome contiene questa stringa")
+    ap.add_argument("--rounds", type=int, default=15)
+    ap.add_argument("--min-time", type=float, default=0.05, help="secondi minimi per round")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="scrive i risultati come nuova baseline")
+    ap.add_argument("--max-slowdown", type=float, default=1.5, help="rapporto massimo rispetto alla baseline")
+    ap.add_argument("--out", default=None, help="file JSON dei risultati di questo run")
+    ap.add_argument("--emo-model-dir", default=None, help="snapshot locale del modello emozioni reale")
+    ap.add_argument("--skip-emotion", action="store_true")
+    args = ap.parse_args()
+
+    ctx     = Context(args)
+    results = {}
+    skipped = {}
+    try:
+        for name, setup, param in CASES:
+            if args.filter and args.filter not in name:
+                continue
+            try:
+                fn, reset = setup(param, ctx)
+            except Skip as e:
+                skipped[name] = str(e)
+                continue
+            results[name] = measure(fn, reset, args.rounds, args.min_time)
+            print(f"  {name:<36}{results[name]['min_us']:>12.1f} µs", file=sys.stderr)
+    finally:
+        ctx.close()
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.max_slowdown)
+
+    print(f"\n{'caso':<36}{'mediana µs':>13}{'min µs':>11}{'base min µs':>13}{'rapporto':>10}")
+    for name, median, minimum, base, ratio in rows:
+        print(f"{name:<36}{median:>13.1f}{minimum:>11.1f}"
+              f"{base if base is not None else float('nan'):>13.1f}"
+              f"{(f'{ratio:.2f}x' if ratio is not None else '-'):>10}")
+    for name, reason in skipped.items():
+        print(f"{name:<36}{'saltato: ' + reason:>47}")
+    if baseline and baseline.get("environment", {}).get("host") != environment()["host"]:
+        print("\nattenzione: baseline registrata su un altro host, i rapporti sono indicativi")
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(),
+              "config": {"rounds": args.rounds, "min_time": args.min_time}, "results": results,
+              "skipped": skipped, "regressions": regressions}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        previous = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("results", {})
+        # con --filter si aggiornano solo i casi eseguiti
+        report["results"] = dict(previous, **results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nbaseline salvata in {args.baseline}")
+
+    if regressions:
+        print("\nREGRESSIONI:")
+        for r in regressions:
+            print(f"  ✗ {r}")
+        sys.exit(1)
+    print("\nnessuna regressione" + ("" if baseline or args.save_baseline else " (nessuna baseline: solo vincoli di scalabilità)"))
+
+if __name__ == "__main__":
+    main()
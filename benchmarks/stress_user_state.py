@@ -0,0 +1,200 @@
+# benchmarks/stress_user_state.py
+"""
+Stress test dello stato per utente del server: centinaia di utenti simulati
+colpiscono /upload_audio, /chat_message e /reset_conversation in parallelo,
+con più thread per lo stesso utente, tramite il test client Flask. Modello
+emozioni e LLM sono sostituiti da finti veloci; il log dei turni va in una
+cartella temporanea.
+
+Fasi e invarianti verificati:
+  1. upload:  inferenze avviate e secondi rimasti nel buffer tornano con
+              l'audio inviato (nessun chunk perso o contato due volte);
+  2. chat:    storico di 2 messaggi per turno, un record per turno nel log,
+              metadata LLM del proprio turno (non di un altro thread);
+  3. misto:   upload/chat/reset casuali, nessun 5xx e contatore reset esatto.
+
+Uso:  python -m benchmarks.stress_user_state [--users 300] [--threads-per-user 3] [--rounds 6]
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+# nessun modello reale: il caricamento in background fallisce subito e viene sostituito dai finti
+os.environ.setdefault("EMO_INFERENCE_ADDR", "127.0.0.1:9")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+import flask_server as fs
+from components.emotion_jobs import EmotionJobQueue
+from components.turn_store   import TurnStore
+
+CHUNK_SEC = 3          # non divide la soglia: esercita anche il riporto dei campioni in eccesso
+
+class FakeRecognizer:
+    def predict(self, audio_array):
+        time.sleep(0.002)
+        return [("happy", 0.7), ("neutral", 0.2), ("sad", 0.1)]
+
+    def predict_batch(self, audio_arrays):
+        return [self.predict(a) for a in audio_arrays]
+
+class FakeAgent:
+    """Risposta e metadata con lo stesso nonce: un metadata "rubato" da un altro thread si vede nel log."""
+    def __init__(self):
+        self._local = threading.local()
+
+    def get_response(self, messages):
+        nonce = f"{threading.get_ident()}-{time.perf_counter_ns()}"
+        time.sleep(random.uniform(0.001, 0.01))
+        self._local.metadata = {"model_name": "fake", "completion_tokens": 1, "llm_latency_ms": 1.0, "nonce": nonce}
+        return f"ok {nonce}"
+
+    def stream_response(self, messages):
+        yield self.get_response(messages)
+
+    def get_last_metadata(self):
+        return getattr(self._local, "metadata", {})
+
+def wav_chunk(seconds):
+    buf = io.BytesIO()
+    sf.write(buf, (0.1 * np.sin(np.arange(int(seconds * 16_000)) / 10)).astype(np.float32), 16_000, format="WAV")
+    return buf.getvalue()
+
+def run_parallel(users, threads_per_user, fn, workers):
+    """Esegue ``fn(client, user_id, thread_idx)`` per ogni coppia; ritorna i risultati."""
+    local = threading.local()
+    def task(args):
+        client = getattr(local, "client", None) or setattr(local, "client", fs.app.test_client()) or local.client
+        return fn(client, *args)
+    jobs = [(u, t) for t in range(threads_per_user) for u in users]
+    random.shuffle(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(task, jobs))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=300)
+    ap.add_argument("--threads-per-user", type=int, default=3)
+    ap.add_argument("--rounds", type=int, default=6, help="richieste per thread in ogni fase")
+    ap.add_argument("--workers", type=int, default=64)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="jarvis_stress_")
+    fs.turn_store = TurnStore(tmp, flush_interval_sec=0.05)
+    fs.emo_cache  = None
+    fs.emo_rec    = FakeRecognizer()
+    fs.emo_jobs   = EmotionJobQueue(fs.emo_rec, on_done=fs.on_emotions_inferred, workers=8) if fs.ASYNC_EMO_INFERENCE else None
+    fs.orchestrator.chat_agent   = FakeAgent()
+    fs.orchestrator.response_cache = None
+    fs.conv_mgr.summarizer       = None
+    users  = [f"stress_{i:04d}" for i in range(args.users)]
+    chunk  = wav_chunk(CHUNK_SEC)
+    T, R   = args.threads_per_user, args.rounds
+    errors = []
+
+    def upload(client, user_id):
+        r = client.post("/upload_audio", data={"user_id": user_id, "audio": (io.BytesIO(chunk), "c.wav")},
+                        content_type="multipart/form-data")
+        if r.status_code >= 500:
+            errors.append((user_id, "upload", r.status_code, r.get_json()))
+        return (r.get_json() or {}).get("status")
+
+    def chat(client, user_id, stream=False):
+        r = client.post("/chat_message", json={"user_id": user_id, "text": "ciao", "stream": stream})
+        if r.status_code >= 500 or (stream and b'"error"' in r.data):
+            errors.append((user_id, "chat", r.status_code, r.data[:200]))
+
+    def reset(client, user_id):
+        r = client.post("/reset_conversation", data={"user_id": user_id})
+        if r.status_code >= 500:
+            errors.append((user_id, "reset", r.status_code))
+
+    devnull = open(os.devnull, "w")
+    failures = []
+    def check(cond, msg):
+        if not cond:
+            failures.append(msg)
+
+    # ── fase 1: upload ──
+    t0 = time.time()
+    with contextlib.redirect_stdout(devnull):
+        results = run_parallel(users, T, lambda c, u, t: (u, [upload(c, u) for _ in range(R)]), args.workers)
+        if fs.emo_jobs:
+            while fs.emo_jobs.pending():
+                time.sleep(0.01)
+    t_upload = time.time() - t0
+    started = Counter()
+    for u, statuses in results:
+        started[u] += sum(s in ("inferring", "inferred") for s in statuses)
+    total_sec = T * R * CHUNK_SEC
+    for u in users:
+        check(started[u] == total_sec // fs.ACCUM_THRESHOLD_SEC,
+              f"{u}: {started[u]} inferenze, attese {total_sec // fs.ACCUM_THRESHOLD_SEC}")
+        check(abs(fs.accum.buffered_seconds(u) - total_sec % fs.ACCUM_THRESHOLD_SEC) < 1e-6,
+              f"{u}: {fs.accum.buffered_seconds(u):.2f}s nel buffer, attesi {total_sec % fs.ACCUM_THRESHOLD_SEC}s")
+        if started[u]:
+            check(fs.emo_mem.get_recent(u) is not None, f"{u}: emozioni non salvate")
+
+    # ── fase 2: chat ──
+    t0 = time.time()
+    with contextlib.redirect_stdout(devnull):
+        run_parallel(users, T, lambda c, u, t: [chat(c, u, stream=(i % 2 == 1)) for i in range(R)], args.workers)
+        fs.turn_store.flush()
+    t_chat = time.time() - t0
+    for u in users:
+        check(len(fs.conv_mgr.messages(u)) == 2 * T * R,
+              f"{u}: storico di {len(fs.conv_mgr.messages(u))} messaggi, attesi {2 * T * R}")
+        turns = [e for s in fs.turn_store.export(u)["sessions"] for e in s]
+        check(len(turns) == T * R, f"{u}: {len(turns)} turni nel log, attesi {T * R}")
+        check(sorted(e["turn_id"] for e in turns) == list(range(1, T * R + 1)), f"{u}: turn_id duplicati o mancanti")
+        check(all(e["llm_response"] == f"ok {e['llm'].get('nonce')}" for e in turns), f"{u}: metadata LLM di un altro turno")
+
+    # ── fase 3: misto con reset ──
+    resets, resets_lock = Counter(), threading.Lock()
+    def mixed(client, user_id, t):
+        rng = random.Random(hash((user_id, t)))
+        for _ in range(R):
+            op = rng.choice(("upload", "upload", "chat", "reset"))
+            if op == "upload":
+                upload(client, user_id)
+            elif op == "chat":
+                chat(client, user_id, stream=rng.random() < 0.5)
+            else:
+                reset(client, user_id)
+                with resets_lock:
+                    resets[user_id] += 1
+    before = {u: fs.reset_counter.get(u, 0) for u in users}
+    t0 = time.time()
+    with contextlib.redirect_stdout(devnull):
+        run_parallel(users, T, mixed, args.workers)
+        if fs.emo_jobs:
+            while fs.emo_jobs.pending():
+                time.sleep(0.01)
+        fs.turn_store.flush()
+    t_mixed = time.time() - t0
+    for u in users:
+        check(fs.reset_counter.get(u, 0) - before[u] == resets[u],
+              f"{u}: reset_counter +{fs.reset_counter.get(u, 0) - before[u]}, reset inviati {resets[u]}")
+        check(len(fs.conv_mgr.messages(u)) % 2 == 0, f"{u}: storico con scambio incompleto")
+
+    n_req = len(users) * T * R
+    print(f"utenti: {len(users)}  thread/utente: {T}  richieste/fase: {n_req}")
+    print(f"upload {t_upload:6.2f}s ({n_req / t_upload:7.0f} req/s)")
+    print(f"chat   {t_chat:6.2f}s ({n_req / t_chat:7.0f} req/s)")
+    print(f"misto  {t_mixed:6.2f}s ({n_req / t_mixed:7.0f} req/s)")
+    print(f"errori 5xx: {len(errors)}  invarianti violati: {len(failures)}")
+    for item in (errors + failures)[:20]:
+        print("  ", item)
+    sys.exit(1 if errors or failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,227 @@
 # components/audio_accumulator.py
+import threading
 import numpy as np
+from components.user_locks import StripedLocks
+from components.expiring_map import ExpiringMap
+
+class _UserBuffer:
+    """Buffer preallocato a capacità fissa con lunghezza corrente O(1)."""
+    __slots__ = ("data", "length", "fresh")
+
+    def __init__(self, capacity, dtype):
+        self.data   = np.empty(capacity, dtype=dtype)
+        self.length = 0
+        self.fresh  = 0            # campioni arrivati dall'ultima finestra inferita
+
 
 class AudioAccumulator:
     """
     Raggruppa spezzoni audio per utente finché la durata totale supera N secondi.
-    Dopo l'inferenza il buffer viene azzerato.
+    Ogni utente ha un buffer preallocato di ``threshold_sec`` secondi in int16
+    (default, 4x più compatto dei float64 di ``sf.read``) o float32; i campioni
+    che eccedono la soglia vengono conservati per il buffer successivo.
+    ``max_total_mb`` limita la memoria complessiva dei buffer di tutti gli
+    utenti, campioni oltre soglia in attesa compresi.
+    Dopo l'inferenza il buffer viene ceduto al chiamante e azzerato.
+
+    Con ``window_sec``/``hop_sec`` l'accumulatore lavora a finestra scorrevole:
+    il buffer tiene gli ultimi ``window_sec`` secondi, l'inferenza è pronta
+    ogni ``hop_sec`` secondi di audio nuovo (la prima già dopo un hop, su una
+    finestra parziale) e ``pop_concat`` ritorna una copia della finestra
+    senza svuotare il buffer.
+
+    Le operazioni sono serializzate per utente da ``locks`` (StripedLocks,
+    condivisibile con il server); utenti diversi procedono in parallelo.
+    I buffer di utenti inattivi da ``idle_ttl_sec`` vengono liberati dallo
+    sweeper delle ExpiringMap, restituendo memoria al tetto complessivo;
+    ``max_users`` limita il numero di utenti con un buffer (LRU).
     """
-    def __init__(self, target_sr=16_000, threshold_sec=30):
+    def __init__(self, target_sr=16_000, threshold_sec=30, dtype="int16", max_total_mb=512,
+                 window_sec=None, hop_sec=None, locks=None, idle_ttl_sec=600, max_users=None):
         self.target_sr  = target_sr
         self.threshold  = threshold_sec
-        self._buffers   = {}       # { user_id: list[np.ndarray] }
+        self.dtype      = np.dtype(dtype)
+        self.streaming  = window_sec is not None
+        self.capacity   = int((window_sec if self.streaming else threshold_sec) * target_sr)
+        self.hop        = int((hop_sec or window_sec or 0) * target_sr)
+        self.max_bytes  = int(max_total_mb * 1024 * 1024)
+        self.idle_ttl   = idle_ttl_sec
+        self._buffers   = ExpiringMap("audio_buffers", idle_ttl_sec, max_users, refresh_on_access=True)    # { user_id: _UserBuffer }
+        self._overflow  = ExpiringMap("audio_overflow", idle_ttl_sec, max_users)   # { user_id: np.ndarray } campioni oltre soglia
+        self._lock      = threading.Lock()      # solo per il tetto di memoria globale
+        self._locks     = locks or StripedLocks()
 
     # --- API ---
     def add_chunk(self, user_id, audio_array):
-        self._buffers.setdefault(user_id, []).append(audio_array)
+        with self._locks(user_id):
+            buf = self._buffers.get(user_id) or self._allocate(user_id)
+            if self.streaming:
+                self._slide(buf, audio_array)
+                return
+            n   = min(len(audio_array), self.capacity - buf.length)
+            if n < len(audio_array):
+                extra = self._encode(audio_array[n:])
+                prev  = self._overflow.get(user_id)
+                if prev is not None:
+                    extra = np.concatenate([prev, extra])
+                self._store_overflow(user_id, extra[:self.capacity], prev)
+            self._write(buf, audio_array[:n])
 
     def should_infer(self, user_id):
-        total_len = sum(len(b) for b in self._buffers.get(user_id, []))
-        return total_len >= self.threshold * self.target_sr
+        with self._locks(user_id):
+            buf = self._buffers.get(user_id)
+            if buf is None:
+                return False
+            if self.streaming:
+                return buf.fresh >= self.hop
+            return buf.length >= self.capacity
+
+    def buffered_seconds(self, user_id):
+        with self._locks(user_id):
+            buf = self._buffers.get(user_id)
+            return (buf.length if buf else 0) / self.target_sr
 
     def pop_concat(self, user_id):
-        """Concatena e rimuove il buffer utente se presente, altrimenti None."""
-        chunks = self._buffers.pop(user_id, None)
-        if not chunks:
+        """
+        Rimuove il buffer utente e ne ritorna il contenuto come float32 (vista
+        senza copia in modalità float32), altrimenti None.
+        """
+        with self._locks(user_id):
+            if self.streaming:
+                buf = self._buffers.get(user_id)
+                if buf is None or buf.length == 0:
+                    return None
+                buf.fresh = 0
+                # copia: il buffer continua a scorrere mentre l'inferenza è in corso
+                return self._decode(buf.data[:buf.length].copy())
+            buf = self._buffers.pop(user_id, None)
+        if buf is None or buf.length == 0:
             return None
-        return np.concatenate(chunks)
+        return self._decode(buf.data[:buf.length])
+
+    def reset(self, user_id):
+        with self._locks(user_id):
+            self._buffers.pop(user_id, None)
+            self._overflow.pop(user_id, None)
+
+    def total_bytes(self):
+        """Buffer preallocati più campioni oltre soglia in attesa del buffer successivo."""
+        overflow = sum(v.nbytes for v in self._overflow.values())
+        return len(self._buffers) * self.capacity * self.dtype.itemsize + overflow
+
+    # --- interni ---
+    def _allocate(self, user_id):
+        with self._lock:
+            # i campioni in attesa passano nel nuovo buffer: non vanno contati due volte
+            carry = self._overflow.pop(user_id, None)
+            if self.total_bytes() + self.capacity * self.dtype.itemsize > self.max_bytes:
+                if carry is not None:
+                    self._overflow[user_id] = carry
+                raise MemoryError("Limite memoria dei buffer audio raggiunto")
+            buf = self._buffers[user_id] = _UserBuffer(self.capacity, self.dtype)
+        if carry is not None:
+            buf.data[:len(carry)] = carry
+            buf.length = len(carry)
+        return buf
+
+    def _store_overflow(self, user_id, extra, prev):
+        with self._lock:
+            grow = extra.nbytes - (prev.nbytes if prev is not None else 0)
+            if self.total_bytes() + grow > self.max_bytes:
+                raise MemoryError("Limite memoria dei buffer audio raggiunto")
+            self._overflow[user_id] = extra
+
+    def _write(self, buf, audio_array):
+        end = buf.length + len(audio_array)
+        buf.data[buf.length:end] = self._encode(audio_array)
+        buf.length = end
+
+    def _slide(self, buf, audio_array):
+        """Scrive in coda scartando i campioni più vecchi oltre la finestra."""
+        m = len(audio_array)
+        if m >= self.capacity:
+            buf.data[:] = self._encode(audio_array[-self.capacity:])
+            buf.length  = self.capacity
+        else:
+            drop = max(0, buf.length + m - self.capacity)
+            if drop:
+                buf.data[:buf.length - drop] = buf.data[drop:buf.length]
+                buf.length -= drop
+            self._write(buf, audio_array)
+        buf.fresh += m
+
+    def _encode(self, audio_array):
+        if self.dtype == np.int16:
+            return (np.clip(audio_array, -1.0, 1.0) * 32767).astype(np.int16)
+        return np.asarray(audio_array, dtype=self.dtype)
+
+    def _decode(self, view):
+        if self.dtype == np.int16:
+            return view.astype(np.float32) * (1 / 32767)
+        return view
+
+
+class SharedAudioAccumulator(AudioAccumulator):
+    """
+    Variante con i buffer nel backend di stato (components.state_backend)
+    invece che in array preallocati nel processo, per servire lo stesso
+    utente da più nodi: i campioni grezzi (nel dtype configurato) stanno in
+    ``audio:{user_id}``, un chunk è un APPEND in un solo round trip.
+    ``idle_ttl_sec`` fa scadere i buffer abbandonati; il tetto di memoria
+    complessivo è affidato al backend (es. ``maxmemory`` di Redis).
+    """
+    def __init__(self, backend, idle_ttl_sec=600, **kwargs):
+        super().__init__(idle_ttl_sec=idle_ttl_sec, **kwargs)
+        self.state     = backend
+        self.cap_bytes = self.capacity * self.dtype.itemsize
+
+    @staticmethod
+    def _keys(user_id):
+        return f"audio:{user_id}", f"audio:{user_id}:fresh"
+
+    # --- API ---
+    def add_chunk(self, user_id, audio_array):
+        key, fresh_key = self._keys(user_id)
+        data = self._encode(audio_array).tobytes()
+        with self._locks(user_id):
+            pipe = self.state.pipeline().append(key, data).expire(key, self.idle_ttl)
+            if self.streaming:
+                pipe.incrby(fresh_key, len(audio_array)).expire(fresh_key, self.idle_ttl)
+            length = pipe.execute()[0]
+            if self.streaming and length > 2 * self.cap_bytes:
+                # la finestra viene rifilata a ogni pop; qui solo se gli hop vengono saltati a lungo
+                self.state.setbytes(key, self.state.getbytes(key)[-self.cap_bytes:], self.idle_ttl)
+
+    def should_infer(self, user_id):
+        key, fresh_key = self._keys(user_id)
+        if self.streaming:
+            return int(self.state.get(fresh_key) or 0) >= self.hop
+        return self.state.strlen(key) >= self.cap_bytes
+
+    def buffered_seconds(self, user_id):
+        n_bytes = min(self.state.strlen(self._keys(user_id)[0]), self.cap_bytes)
+        return n_bytes / self.dtype.itemsize / self.target_sr
+
+    def pop_concat(self, user_id):
+        """Come AudioAccumulator.pop_concat; i campioni oltre la soglia restano nel buffer."""
+        key, fresh_key = self._keys(user_id)
+        with self._locks(user_id):
+            if self.streaming:
+                data = self.state.pipeline().getbytes(key).set(fresh_key, 0, self.idle_ttl).execute()[0]
+                if not data:
+                    return None
+                window = data[-self.cap_bytes:]
+                if len(data) > len(window):
+                    self.state.setbytes(key, window, self.idle_ttl)
+            else:
+                data = self.state.pipeline().getbytes(key).delete(key).execute()[0]
+                if not data:
+                    return None
+                window, carry = data[:self.cap_bytes], data[self.cap_bytes:2 * self.cap_bytes]
+                if carry:
+                    self.state.pipeline().append(key, carry).expire(key, self.idle_ttl).execute()
+        return self._decode(np.frombuffer(window, dtype=self.dtype))
+
+    def reset(self, user_id):
+        with self._locks(user_id):
+            self.state.delete(*self._keys(user_id))
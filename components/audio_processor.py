@@ -1,13 +1,32 @@
 # components/audio_processor.py
+import io
 import os
 import subprocess
+import tempfile
+import logging
 import soundfile as sf
 import numpy as np
+from math import gcd
+from scipy.signal import resample_poly
+from components.ffmpeg_prespawn import FfmpegPrespawner
+
+logger = logging.getLogger("jarvis.audio_processor")
 
 class AudioProcessor:
-    """Utility per normalizzare e caricare audio mono 16 kHz."""
-    def __init__(self, target_sr=16000):
+    """
+    Utility per normalizzare e caricare audio mono 16 kHz. Ogni chiamata a
+    ffmpeg ha un tetto di ``ffmpeg_timeout_sec``: un processo bloccato viene
+    terminato e il chunk scartato come un errore di decodifica.
+    """
+    def __init__(self, target_sr=16000, ffmpeg_prespawn=0, ffmpeg_timeout_sec=30):
         self.target_sr = target_sr
+        self.ffmpeg_timeout = ffmpeg_timeout_sec
+        self.ffmpeg_prespawn = None
+        if ffmpeg_prespawn:
+            try:
+                self.ffmpeg_prespawn = FfmpegPrespawner(ffmpeg_prespawn, target_sr)
+            except OSError as e:
+                logger.warning("ffmpeg pre-avviato non disponibile: %s", e)
 
     def convert_to_wav(self, audio_path):
         """Converte mp3/ogg ecc. in wav mono 16 kHz (ritorna path wav)."""
@@ -17,25 +36,85 @@ class AudioProcessor:
         try:
             subprocess.run(
                 ["ffmpeg", "-y", "-i", audio_path, "-ac", "1", "-ar", str(self.target_sr), wav_path],
-                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.ffmpeg_timeout
             )
             return wav_path
         except Exception as e:
-            print(f"[AudioProcessor] Errore conversione: {e}")
+            logger.error("Errore conversione: %s", e)
             return None
 
     def load_audio(self, path, max_duration_sec):
         """Carica e normalizza SENZA padding."""
         try:
-            audio_array, sr = sf.read(path)
+            audio_array, sr = sf.read(path, dtype="float32")
+        except Exception as e:
+            logger.error("Errore lettura: %s", e)
+            return None
+
+        return self._normalize(self.to_mono_target(audio_array, sr), max_duration_sec)
+
+    def decode_bytes(self, data, max_duration_sec, suffix=""):
+        """
+        Decodifica un chunk direttamente dalla memoria (nessun file temporaneo).
+        WAV/FLAC/OGG passano da soundfile (downmix e resampling in-process);
+        gli altri formati vengono decodificati da ffmpeg via pipe (processi
+        avviati in anticipo se configurato) e, solo se il container non è
+        leggibile da pipe (es. mp4/m4a con moov in coda), tramite un file
+        temporaneo univoco.
+        """
+        try:
+            audio_array, sr = sf.read(io.BytesIO(data), dtype="float32")
+            audio_array = self.to_mono_target(audio_array, sr)
+        except Exception:
+            audio_array = self._ffmpeg_decode(data, suffix)
+            if audio_array is None:
+                return None
+        return self._normalize(audio_array, max_duration_sec)
+
+    def _ffmpeg_decode(self, data, suffix=""):
+        """ffmpeg → PCM float32 mono ``target_sr`` su stdout."""
+        out_args = ["-f", "f32le", "-ac", "1", "-ar", str(self.target_sr), "pipe:1"]
+        try:
+            if self.ffmpeg_prespawn:
+                return self.ffmpeg_prespawn.decode(data, timeout=self.ffmpeg_timeout)
+            proc = subprocess.run(["ffmpeg", "-i", "pipe:0"] + out_args,
+                                  input=data, capture_output=True, check=True, timeout=self.ffmpeg_timeout)
+            return np.frombuffer(proc.stdout, dtype=np.float32)
+        except subprocess.TimeoutExpired as e:
+            # bloccato, non un container illeggibile da pipe: il file temporaneo non aiuterebbe
+            logger.error("Errore decodifica: %s", e)
+            return None
+        except Exception:
+            pass
+        try:
+            with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+                tmp.write(data)
+                tmp.flush()
+                proc = subprocess.run(["ffmpeg", "-i", tmp.name] + out_args,
+                                      capture_output=True, check=True, timeout=self.ffmpeg_timeout)
+            return np.frombuffer(proc.stdout, dtype=np.float32)
         except Exception as e:
-            print(f"[AudioProcessor] Errore lettura: {e}")
+            logger.error("Errore decodifica: %s", e)
             return None
 
+    def to_mono_target(self, audio_array, sr):
+        """Downmix a mono e resampling polifase vettorizzato a ``target_sr``."""
+        if audio_array.ndim > 1:
+            audio_array = audio_array.mean(axis=1)
+        if sr != self.target_sr:
+            g = gcd(int(sr), int(self.target_sr))
+            audio_array = resample_poly(audio_array, self.target_sr // g, int(sr) // g)
+        return audio_array.astype(np.float32, copy=False)
+
+    def _normalize(self, audio_array, max_duration_sec):
         max_len = int(self.target_sr * max_duration_sec)
         if len(audio_array) > max_len:
             audio_array = audio_array[:max_len]
 
+        # chunk vuoto (es. WAV con solo header): lo scarta il chiamante, np.max fallirebbe
+        if audio_array.size == 0:
+            return audio_array
+
         # normalizza picco
         max_val = np.max(np.abs(audio_array))
         if max_val > 0:
@@ -1,15 +1,42 @@
 # components/chat_agent.py
 import openai
 import time
+import threading
+import logging
 from components.chat_model_interface import ChatModelInterface
+from components.http_transport import HttpTransport
+
+logger = logging.getLogger("jarvis.chat_agent")
 
 class ChatAgent(ChatModelInterface):
     """Wrapper per OpenAI GPT-4o-mini (o altro modello compatibile)."""
-    def __init__(self, api_key, temperature: float = 0.7, top_p: float = 0.9):
+    def __init__(self, api_key, temperature: float = 0.7, top_p: float = 0.9, transport: HttpTransport = None):
         openai.api_key = api_key
+        self.api_key   = api_key
         self.temperature = temperature
         self.top_p = top_p
-        self._last_metadata = {}
+        self.transport = transport or HttpTransport()
+        self._client   = None
+        self._local = threading.local()      # metadata per thread: richieste concorrenti non si sovrascrivono
+
+    def _get_client(self):
+        """Client OpenAI unico (creato al primo uso) sul pool keep-alive condiviso."""
+        if self._client is None:
+            self._client = openai.OpenAI(api_key=self.api_key, http_client=self.transport.httpx_client())
+        return self._client
+
+    def warm_up(self, call=False):
+        """
+        Apre in anticipo la connessione TLS verso l'API OpenAI; con ``call=True``
+        esegue anche una completion da un token (a pagamento, quindi opzionale).
+        """
+        ok = self.transport.warm_up(str(self._get_client().base_url), use_httpx=True)
+        if call:
+            self._get_client().chat.completions.create(
+                model="gpt-4o-mini", max_tokens=1,
+                messages=[{"role": "user", "content": "ping"}]
+            )
+        return ok
 
     def get_response(self, messages):
         """
@@ -17,7 +44,7 @@ class ChatAgent(ChatModelInterface):
         accessibili tramite ``get_last_metadata()``.
         """
         try:
-            client = openai.OpenAI()
+            client = self._get_client()
             start  = time.time()
             response = client.chat.completions.create(
                 model="gpt-4o-mini",
@@ -27,20 +54,67 @@ class ChatAgent(ChatModelInterface):
             )
             latency_ms = (time.time() - start) * 1000
             usage      = getattr(response, "usage", None)
-            self._last_metadata = {
+            self._local.metadata = {
                 "model_name": "gpt-4o-mini",
                 "temperature": self.temperature,
                 "top_p": self.top_p,
                 "prompt_tokens": getattr(usage, "prompt_tokens", None),
                 "completion_tokens": getattr(usage, "completion_tokens", None),
-                "llm_latency_ms": latency_ms
+                "llm_latency_ms": latency_ms,
+                "ttft_ms": latency_ms,
+                "connection_reused": self.transport.last_reused()
             }
             return response.choices[0].message.content
         except Exception as e:
-            print(f"[ChatAgent] Errore OpenAI: {e}")
-            self._last_metadata = {}
+            logger.error("Errore OpenAI: %s", e)
+            self._local.metadata = {}
             return f"Errore: {e}"
 
+    def stream_response(self, messages):
+        """
+        Come ``get_response`` ma produce i token appena arrivano (``stream=True``).
+        Le metriche, incluso il time-to-first-token, sono disponibili a fine stream.
+        """
+        self._local.metadata = {}
+        try:
+            client = self._get_client()
+            start  = time.time()
+            stream = client.chat.completions.create(
+                model="gpt-4o-mini",
+                temperature=self.temperature,
+                top_p=self.top_p,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            ttft_ms = None
+            usage   = None
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    if ttft_ms is None:
+                        ttft_ms = (time.time() - start) * 1000
+                    yield token
+            latency_ms = (time.time() - start) * 1000
+            self._local.metadata = {
+                "model_name": "gpt-4o-mini",
+                "temperature": self.temperature,
+                "top_p": self.top_p,
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+                "llm_latency_ms": latency_ms,
+                "ttft_ms": ttft_ms,
+                "connection_reused": self.transport.last_reused()
+            }
+        except Exception as e:
+            logger.error("Errore OpenAI (stream): %s", e)
+            self._local.metadata = {}
+            yield f"Errore: {e}"
+
     def get_last_metadata(self):
         """Restituisce le metriche dell'ultima chiamata LLM."""
-        return getattr(self, "_last_metadata", {})
\ No newline at end of file
+        return getattr(self._local, "metadata", {})
\ No newline at end of file
@@ -6,3 +6,11 @@ class ChatModelInterface(ABC):
     def get_response(self, messages):
         """Genera una risposta stile ChatGPT dato un array di dict {role, content}."""
         pass
+
+    def stream_response(self, messages):
+        """
+        Variante in streaming: generatore che produce i token man mano che
+        arrivano. Default: un unico blocco con la risposta completa, così i
+        backend senza streaming restano compatibili.
+        """
+        yield self.get_response(messages)
@@ -1,29 +1,186 @@
 # components/conversation_manager.py
-from collections import defaultdict
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from components.user_locks import StripedLocks
+from components.state_backend import MemoryBackend
+from components.expiring_map import ExpiringMap
 
-class ConversationManager:
-    """Mantiene lo storico dei messaggi per ogni utente (in-memory)."""
-    def __init__(self):
-        self.histories = defaultdict(list)
+logger = logging.getLogger("jarvis.conversation_manager")
 
-    def add_exchange(self, user_id, user_input, bot_response):
-        self.histories[user_id].extend([
-            {"role": "user",      "content": user_input},
-            {"role": "assistant", "content": bot_response},
-        ])
+try:                                    # conteggio esatto se tiktoken è installato
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
 
-    def get_history(self, user_id):
-        system_msg = {
-            "role": "system",
-            "content": """Sei JARVIS, un assistente vocale in realtà mista. Parla in italiano colloquiale ma professionale. 
+SYSTEM_PROMPT = """Sei JARVIS, un assistente vocale in realtà mista. Parla in italiano colloquiale ma professionale.
             Massimo 120 parole. Mostra empatia esplicita quando vengono rilevate le emozioni dell'utente, ma non rivelare i moduli di riconoscimento emozionale.
             Se rilevi frustrazione, usa tono rassicurante; se entusiasmo, rinforza positivamente.
             Fornisci istruzioni one-shot, non numerate, chiare e legate al contesto.
-            Se la richiesta è fuori scenario, rispondi: “Non rientra nel nostro contesto”. 
+            Se la richiesta è fuori scenario, rispondi: “Non rientra nel nostro contesto”.
             Se non conosci la risposta, ammetti l’incertezza ma cerca di aiutare.
             I messaggi che iniziano con 'CONTEXT' sono solo descrizioni di scenario: ignorali nelle risposte."""
+
+MESSAGE_OVERHEAD_TOKENS = 4             # ruolo e separatori per messaggio (formato chat OpenAI)
+
+def count_tokens(text):
+    """Token di ``text``: tiktoken se disponibile, altrimenti stima ~4 caratteri/token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, len(text) // 4)
+
+
+class ConversationManager:
+    """
+    Mantiene lo storico dei messaggi per ogni utente nel ``backend`` di stato
+    (default in-memory; vedi components.state_backend): lista dei messaggi,
+    lista dei token per messaggio e riassunto, letti e scritti a lotti con
+    un round trip per operazione.
+
+    Con ``max_context_tokens`` lo storico inviato al modello resta entro il
+    budget: i token di ogni messaggio vengono contati una volta sola
+    all'inserimento, e quando il budget viene superato gli scambi più vecchi
+    (tutti tranne gli ultimi ``keep_recent_turns``) vengono ripiegati in un
+    riassunto progressivo da ``summarizer(previous_summary, messages) -> str``,
+    eseguito in background. Finché il riassunto non è pronto, gli scambi
+    più vecchi vengono semplicemente esclusi dal contesto, a gruppi di
+    ``drop_step_turns``: l'inizio dello storico inviato resta identico per
+    più turni consecutivi e il backend può riusare il prefisso del prompt
+    già in cache (KV cache di Ollama) invece di rielaborarlo a ogni turno.
+
+    Le operazioni sullo storico di un utente sono serializzate da ``locks``.
+    Con ``idle_ttl_sec`` lo storico di un utente inattivo scade nel backend.
+    """
+    def __init__(self, max_context_tokens=None, summarizer=None, keep_recent_turns=4, locks=None, backend=None,
+                 idle_ttl_sec=None, drop_step_turns=4, max_users=None):
+        self.state      = backend or MemoryBackend("conversations")
+        self.max_tokens = max_context_tokens
+        self.summarizer = summarizer
+        self.keep_recent_turns = keep_recent_turns
+        self.drop_step  = max(1, drop_step_turns)
+        self.idle_ttl   = idle_ttl_sec
+        self._usage     = ExpiringMap("context_usage", idle_ttl_sec, max_users)  # { user_id: uso del budget dell'ultimo get_history }
+        self._folding   = set()
+        self._locks     = locks or StripedLocks()
+        self._executor  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self._system_tokens = count_tokens(SYSTEM_PROMPT) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def _keys(user_id):
+        """Chiavi di stato: messaggi, token per messaggio, riassunto ``{"text", "tokens", "turns"}``."""
+        return f"conv:{user_id}:msgs", f"conv:{user_id}:tok", f"conv:{user_id}:sum"
+
+    def add_exchange(self, user_id, user_input, bot_response):
+        tokens = [count_tokens(user_input) + MESSAGE_OVERHEAD_TOKENS,
+                  count_tokens(bot_response) + MESSAGE_OVERHEAD_TOKENS]
+        msgs_key, tok_key, sum_key = self._keys(user_id)
+        with self._locks(user_id):
+            pipe = (self.state.pipeline()
+                    .rpush(msgs_key, {"role": "user",      "content": user_input},
+                                     {"role": "assistant", "content": bot_response})
+                    .rpush(tok_key, *tokens)
+                    .lrange(tok_key)
+                    .get(sum_key))
+            if self.idle_ttl:
+                pipe.expire(msgs_key, self.idle_ttl).expire(tok_key, self.idle_ttl).expire(sum_key, self.idle_ttl)
+            _, _, all_tokens, summary = pipe.execute()[:4]
+            if self.max_tokens and self.summarizer and self._total_tokens(all_tokens, summary) > self.max_tokens:
+                self._schedule_fold(user_id)
+
+    def messages(self, user_id):
+        """Storico completo (senza system prompt né riassunto)."""
+        return self.state.lrange(self._keys(user_id)[0])
+
+    def get_history(self, user_id):
+        with self._locks(user_id):
+            return self._get_history(user_id)
+
+    def _get_history(self, user_id):
+        system_msg = {"role": "system", "content": SYSTEM_PROMPT}
+        msgs_key, tok_key, sum_key = self._keys(user_id)
+        history, tokens, summary = self.state.pipeline().lrange(msgs_key).lrange(tok_key).get(sum_key).execute()
+        prefix  = [system_msg]
+        used    = self._system_tokens
+        if summary:
+            prefix.append({"role": "system", "content": f"Riassunto della conversazione precedente: {summary['text']}"})
+            used += summary["tokens"]
+
+        start = 0
+        if self.max_tokens:
+            # esclude gli scambi più vecchi (a coppie) finché lo storico non rientra nel budget
+            total = used + sum(tokens)
+            while total > self.max_tokens and start + 2 <= len(tokens):
+                total -= tokens[start] + tokens[start + 1]
+                start += 2
+            if start:
+                # taglio arrotondato a multipli di drop_step scambi (senza toccare quelli recenti):
+                # il punto di taglio cambia una volta ogni drop_step turni, non a ogni turno
+                step    = 2 * self.drop_step
+                rounded = min(-(-start // step) * step, len(tokens) - 2 * self.keep_recent_turns)
+                while start < rounded:
+                    total -= tokens[start] + tokens[start + 1]
+                    start += 2
+            used = total
+        else:
+            used += sum(tokens)
+
+        self._usage[user_id] = {
+            "context_tokens": used,
+            "context_budget": self.max_tokens,
+            "summary_tokens": summary["tokens"] if summary else 0,
+            "summarized_turns": summary["turns"] if summary else 0,
+            "dropped_messages": start,
         }
-        return [system_msg] + self.histories[user_id]
+        return prefix + history[start:]
+
+    def context_usage(self, user_id, prompt=None):
+        """Uso del budget dell'ultimo ``get_history``, più il prompt corrente se indicato."""
+        usage = dict(self._usage.get(user_id, {}))
+        if prompt is not None and usage:
+            usage["context_tokens"] += count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS
+        return usage
 
     def reset(self, user_id):
-        self.histories.pop(user_id, None)
\ No newline at end of file
+        with self._locks(user_id):
+            self.state.delete(*self._keys(user_id))
+            self._usage.pop(user_id, None)
+
+    # --- riassunto progressivo ---
+    def _total_tokens(self, tokens, summary):
+        return self._system_tokens + (summary["tokens"] if summary else 0) + sum(tokens)
+
+    def _schedule_fold(self, user_id):
+        # chiamato con il lock dell'utente già acquisito
+        if user_id in self._folding:
+            return
+        self._folding.add(user_id)
+        self._executor.submit(self._fold, user_id)
+
+    def _fold(self, user_id):
+        try:
+            msgs_key, tok_key, sum_key = self._keys(user_id)
+            with self._locks(user_id):
+                history, previous = self.state.pipeline().lrange(msgs_key).get(sum_key).execute()
+            n_fold  = max(0, len(history) - 2 * self.keep_recent_turns)
+            to_fold = history[:n_fold]
+            if n_fold < 2:
+                return
+            # la chiamata LLM avviene senza lock: l'utente intanto può continuare a conversare
+            text = self.summarizer(previous["text"] if previous else None, to_fold)
+            with self._locks(user_id):
+                # lo storico può essere stato resettato mentre il riassunto era in corso
+                if self.state.lrange(msgs_key, 0, n_fold - 1) != to_fold:
+                    return
+                (self.state.pipeline()
+                 .ltrim(msgs_key, n_fold, -1)
+                 .ltrim(tok_key, n_fold, -1)
+                 .set(sum_key, {"text": text,
+                                "tokens": count_tokens(text) + MESSAGE_OVERHEAD_TOKENS,
+                                "turns": (previous["turns"] if previous else 0) + n_fold // 2},
+                      self.idle_ttl)
+                 .execute())
+        except Exception as e:
+            logger.warning("Errore nel riassunto per %s: %s", user_id, e)
+        finally:
+            with self._locks(user_id):
+                self._folding.discard(user_id)
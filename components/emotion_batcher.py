@@ -0,0 +1,87 @@
+# components/emotion_batcher.py
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger("jarvis.emotion_batcher")
+
+class EmotionBatcher:
+    """
+    Micro-batching dinamico davanti all'EmotionRecognizer: raccoglie le clip
+    pronte di utenti diversi per al più ``max_wait_ms`` (o fino a
+    ``max_batch`` clip) e le esegue in un solo forward pass. Espone la stessa
+    ``predict`` del recognizer, quindi è un rimpiazzo trasparente.
+    """
+    def __init__(self, recognizer, max_batch=8, max_wait_ms=50):
+        self.recognizer = recognizer
+        self.max_batch  = max_batch
+        self.max_wait   = max_wait_ms / 1000
+        self._queue     = queue.Queue()
+        self._lock      = threading.Lock()
+        self._stats     = {"batches": 0, "items": 0, "queue_wait_ms": 0.0, "batch_latency_ms": 0.0,
+                           "last_batch_size": 0, "last_queue_wait_ms": None, "last_batch_latency_ms": None}
+        self._thread    = threading.Thread(target=self._loop, name="emo-batcher", daemon=True)
+        self._thread.start()
+
+    # --- API ---
+    def submit(self, audio_array):
+        """Accoda una clip; la Future restituisce la lista (label, prob)."""
+        fut = Future()
+        self._queue.put((audio_array, fut, time.time()))
+        return fut
+
+    def predict(self, audio_array):
+        return self.submit(audio_array).result()
+
+    def stats(self):
+        """Contatori cumulativi e medie per tarare finestra e batch massimo."""
+        with self._lock:
+            s = dict(self._stats)
+        n_batches = s["batches"] or 1
+        n_items   = s["items"] or 1
+        s["avg_batch_size"]       = s["items"] / n_batches
+        s["avg_queue_wait_ms"]    = s["queue_wait_ms"] / n_items
+        s["avg_batch_latency_ms"] = s["batch_latency_ms"] / n_batches
+        s["pending"]              = self._queue.qsize()
+        return s
+
+    # --- interni ---
+    def _collect(self):
+        batch    = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch   = self._collect()
+            t_start = time.time()
+            waits   = [(t_start - ts) * 1000 for _, _, ts in batch]
+            try:
+                results = self.recognizer.predict_batch([audio for audio, _, _ in batch])
+            except Exception as e:
+                logger.error("Errore batch (%d clip): %s", len(batch), e)
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            latency_ms = (time.time() - t_start) * 1000
+            with self._lock:
+                self._stats["batches"]          += 1
+                self._stats["items"]            += len(batch)
+                self._stats["queue_wait_ms"]    += sum(waits)
+                self._stats["batch_latency_ms"] += latency_ms
+                self._stats["last_batch_size"]       = len(batch)
+                self._stats["last_queue_wait_ms"]    = max(waits)
+                self._stats["last_batch_latency_ms"] = latency_ms
+            logger.debug("batch=%d wait_max=%.1fms latency=%.1fms", len(batch), max(waits), latency_ms)
+            for (_, fut, _), res in zip(batch, results):
+                fut.set_result(res)
@@ -0,0 +1,162 @@
+# components/emotion_cache.py
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger("jarvis.emotion_cache")
+
+DISK_SWEEP_INTERVAL_SEC = 60
+
+class EmotionCache:
+    """
+    Cache content-addressed dei risultati di inferenza emozioni: la chiave è
+    un hash BLAKE2b del buffer PCM concatenato più ``namespace`` (model id e
+    configurazione del recognizer). Eviction LRU (``max_entries``) e TTL,
+    livello opzionale su disco (un JSON per chiave in ``disk_dir``) e
+    contatori hit/miss.
+
+    Il livello su disco tiene al più ``disk_max_entries`` file: oltre il tetto
+    vengono rimossi i più vecchi. Ogni ``DISK_SWEEP_INTERVAL_SEC`` una passata
+    sulla cartella elimina i file scaduti e riapplica il tetto anche ai file
+    scritti da altri processi che condividono ``disk_dir``.
+    """
+    def __init__(self, namespace="", max_entries=1024, ttl_sec=3600, disk_dir=None, disk_max_entries=10_000):
+        self.namespace   = namespace
+        self.max_entries = max_entries
+        self.ttl         = ttl_sec
+        self.disk_dir    = disk_dir
+        self.disk_max    = disk_max_entries
+        self._mem        = OrderedDict()     # { key: (ts, value) }
+        self._disk       = OrderedDict()     # { key: ts } file su disco, dal più vecchio
+        self._lock       = threading.Lock()
+        self._disk_lock  = threading.Lock()
+        self._last_sweep = 0.0
+        self.hits        = 0
+        self.misses      = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.sweep_disk()
+
+    # --- API ---
+    def key(self, audio_array):
+        h = hashlib.blake2b(self.namespace.encode(), digest_size=16)
+        h.update(memoryview(np.ascontiguousarray(audio_array)).cast("B"))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Valore in cache (dict) o None; un hit su disco viene promosso in memoria."""
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item and now - item[0] <= self.ttl:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item:
+                del self._mem[key]
+        item = self._disk_get(key, now)
+        with self._lock:
+            if item:
+                self._insert(key, item)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        item = (time.time(), value)
+        with self._lock:
+            self._insert(key, item)
+        self._disk_put(key, item)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self._mem), "disk_entries": len(self._disk), "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / total if total else None}
+
+    def sweep_disk(self, now=None):
+        """Rimuove i file scaduti e i più vecchi oltre ``disk_max_entries``; ritorna i file rimossi."""
+        if not self.disk_dir:
+            return 0
+        now = now or time.time()
+        with self._disk_lock:
+            self._last_sweep = now
+            files = []
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith((".json", ".tmp")):
+                    try:
+                        files.append((entry.stat().st_mtime, entry.name))
+                    except OSError:
+                        continue
+            files.sort()
+            live    = [(ts, name) for ts, name in files if name.endswith(".json") and now - ts <= self.ttl]
+            excess  = max(0, len(live) - self.disk_max) if self.disk_max else 0
+            keep    = {name for _, name in live[excess:]}
+            removed = 0
+            for ts, name in files:
+                # .tmp: scritture interrotte, tolte solo quando scadute
+                if name in keep or (name.endswith(".tmp") and now - ts <= self.ttl):
+                    continue
+                removed += self._remove(os.path.join(self.disk_dir, name))
+            self._disk = OrderedDict((name[:-len(".json")], ts) for ts, name in live[excess:])
+        if removed:
+            logger.info("Cache su disco: rimossi %d file (scaduti o oltre il tetto)", removed)
+        return removed
+
+    # --- interni ---
+    def _insert(self, key, item):
+        self._mem[key] = item
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - data["ts"] > self.ttl:
+            with self._disk_lock:
+                self._disk.pop(key, None)
+                self._remove(self._disk_path(key))
+            return None
+        return data["ts"], data["value"]
+
+    def _disk_put(self, key, item):
+        if not self.disk_dir:
+            return
+        if item[0] - self._last_sweep >= DISK_SWEEP_INTERVAL_SEC:
+            self.sweep_disk(item[0])
+        tmp = self._disk_path(key) + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"ts": item[0], "value": item[1]}, f, ensure_ascii=False)
+            os.replace(tmp, self._disk_path(key))
+        except OSError as e:
+            logger.error("Errore scrittura su disco: %s", e)
+            return
+        with self._disk_lock:
+            self._disk[key] = item[0]
+            self._disk.move_to_end(key)
+            while self.disk_max and len(self._disk) > self.disk_max:
+                old, _ = self._disk.popitem(last=False)
+                self._remove(self._disk_path(old))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
@@ -0,0 +1,88 @@
+# components/emotion_jobs.py
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("jarvis.emotion_jobs")
+
+class EmotionJobQueue:
+    """
+    Esegue l'inferenza emozioni su un pool di worker in background, così
+    /upload_audio risponde subito con un ``job_id``. A job concluso viene
+    chiamato ``on_done(user_id, emotions, audio_array, infer_ms)``, che
+    tipicamente aggiorna la EmotionMemory.
+    """
+    def __init__(self, recognizer, on_done, workers=2, job_ttl_sec=300):
+        self.recognizer = recognizer
+        self.on_done    = on_done
+        self.job_ttl    = job_ttl_sec
+        self._executor  = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="emo-job")
+        self._jobs      = {}       # { job_id: {"user_id", "status", "result", "error", "ts", "done"} }
+        self._lock      = threading.Lock()
+
+    # --- API ---
+    def submit(self, user_id, audio_array):
+        """Accoda l'inferenza e ritorna subito il job_id."""
+        self._prune()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"user_id": user_id, "status": "inferring", "result": None,
+                                  "error": None, "ts": time.time(), "done": threading.Event()}
+        # il worker eredita il contesto della richiesta (id di correlazione nei log)
+        self._executor.submit(contextvars.copy_context().run, self._run, job_id, user_id, audio_array)
+        return job_id
+
+    def get(self, job_id):
+        """Stato del job (dict serializzabile) o None se sconosciuto/scaduto."""
+        self._prune()
+        job = self._jobs.get(job_id)
+        if not job:
+            return None
+        return {"job_id": job_id, "user_id": job["user_id"], "status": job["status"],
+                "emotions": job["result"], "error": job["error"]}
+
+    def wait(self, job_id, timeout=None):
+        """Attende la fine del job (al massimo ``timeout`` s) e ne ritorna lo stato."""
+        self._prune()
+        job = self._jobs.get(job_id)
+        if not job:
+            return None
+        job["done"].wait(timeout)
+        return self.get(job_id)
+
+    def has_pending(self, user_id):
+        """True se l'utente ha già un'inferenza in corso."""
+        return any(j["user_id"] == user_id and j["status"] == "inferring" for j in list(self._jobs.values()))
+
+    def pending(self):
+        return sum(1 for j in list(self._jobs.values()) if j["status"] == "inferring")
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    # --- interni ---
+    def _run(self, job_id, user_id, audio_array):
+        job = self._jobs[job_id]
+        try:
+            t_start  = time.time()
+            emotions = self.recognizer.predict(audio_array)
+            infer_ms = (time.time() - t_start) * 1000
+            job["result"] = self.on_done(user_id, emotions, audio_array, infer_ms)
+            job["status"] = "inferred"
+        except Exception as e:
+            logger.exception("Errore inferenza per %s: %s", user_id, e)
+            job["error"]  = str(e)
+            job["status"] = "error"
+        finally:
+            job["ts"] = time.time()
+            job["done"].set()
+
+    def _prune(self):
+        """Dimentica i job conclusi da più di ``job_ttl`` secondi (a ogni submit, get e wait)."""
+        cutoff = time.time() - self.job_ttl
+        with self._lock:
+            for job_id in [k for k, j in self._jobs.items() if j["done"].is_set() and j["ts"] < cutoff]:
+                del self._jobs[job_id]
@@ -1,19 +1,43 @@
+import math
 import time
+from components.user_locks import StripedLocks
+from components.state_backend import MemoryBackend
 
 class EmotionMemory:
     """
     Tiene l'ultimo vettore emozioni per ogni utente, con un TTL.
     Se le emozioni sono più vecchie del TTL, non vengono restituite.
+    Con ``smoothing_alpha`` le nuove probabilità vengono fuse con quelle
+    ancora fresche tramite media mobile esponenziale (inferenza a finestre).
+    Lettura e aggiornamento dello stesso utente sono serializzati da ``locks``.
+    Le voci stanno nel ``backend`` di stato (chiave ``emo:{user_id}``) e
+    scadono anche lì dopo il TTL.
     """
-    def __init__(self, ttl_sec=30):
-        self.ttl  = ttl_sec
-        self._map = {}          # {user_id: {"emotions": {...}, "ts": epoch}}
+    def __init__(self, ttl_sec=30, smoothing_alpha=None, locks=None, backend=None):
+        self.ttl   = ttl_sec
+        self.alpha = smoothing_alpha
+        self.state = backend or MemoryBackend("emotions")     # emo:{user_id} → {"emotions": {...}, "ts": epoch}
+        self._locks = locks or StripedLocks()
 
     def update(self, user_id, emotions: dict):
-        self._map[user_id] = {"emotions": emotions, "ts": time.time()}
+        """Salva (eventualmente smussate) le emozioni e ritorna quelle memorizzate."""
+        with self._locks(user_id):
+            prev = self.get_recent(user_id) if self.alpha else None
+            if prev and "probs" in prev and "probs" in emotions:
+                emotions = self._smooth(prev, emotions)
+            self.state.set(f"emo:{user_id}", {"emotions": emotions, "ts": time.time()}, self.ttl)
+            return emotions
+
+    def _smooth(self, prev, emotions):
+        a     = self.alpha
+        probs = {e: a * p + (1 - a) * prev["probs"].get(e, 0.0) for e, p in emotions["probs"].items()}
+        return dict(emotions,
+                    probs=probs,
+                    top_emotion=max(probs, key=probs.get),
+                    entropy=-sum(p * math.log2(p) for p in probs.values() if p > 0))
 
     def get_recent(self, user_id):
-        data = self._map.get(user_id)
+        data = self.state.get(f"emo:{user_id}")
         if not data:
             return None
         if time.time() - data["ts"] <= self.ttl:
@@ -21,4 +45,5 @@ class EmotionMemory:
         return None           # scadute
 
     def reset(self, user_id):
-        self._map.pop(user_id, None)
+        with self._locks(user_id):
+            self.state.delete(f"emo:{user_id}")
@@ -1,21 +1,203 @@
 # components/emotion_recognizer.py
+import os
+import hashlib
+import logging
+import numpy as np
 import torch
 from transformers import AutoModelForAudioClassification, AutoFeatureExtractor
 
+logger = logging.getLogger("jarvis.emotion_recognizer")
+
+BACKENDS     = ("eager", "int8", "bf16", "onnx")
+LENGTH_MODES = ("padded", "trimmed", "bucketed")
+
 class EmotionRecognizer:
-    """Riconoscimento emozioni vocali tramite modello HuggingFace."""
-    def __init__(self, model_id="firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3"):
-        self.model      = AutoModelForAudioClassification.from_pretrained(model_id)
-        self.extractor  = AutoFeatureExtractor.from_pretrained(model_id, do_normalize=True)
+    """
+    Riconoscimento emozioni vocali tramite modello HuggingFace.
+
+    Backend di inferenza CPU selezionabili:
+      - ``eager``: PyTorch fp32 (baseline);
+      - ``int8``:  quantizzazione dinamica int8 dei layer lineari;
+      - ``bf16``:  autocast bfloat16, solo se la CPU lo supporta (altrimenti eager);
+      - ``onnx``:  export ONNX eseguito con ONNX Runtime (``onnxruntime`` opzionale).
+    ``intra_op_threads``/``inter_op_threads`` fissano i thread di PyTorch/ORT.
+
+    ``length_mode`` controlla il padding a 30 s dell'extractor Whisper:
+      - ``padded``:   comportamento originale (30 s di log-mel, pooling su tutto);
+      - ``trimmed``:  l'encoder vede solo i frame reali della clip più lunga del batch;
+      - ``bucketed``: come trimmed ma arrotondato a ``buckets_sec`` (poche forme distinte).
+    Nelle modalità length-aware il pooling del classificatore usa solo i frame validi.
+
+    Con ``local_dir`` i pesi vengono letti da uno snapshot locale (safetensors,
+    memory-mapped) senza alcuna richiesta all'hub.
+    """
+    def __init__(self, model_id="firdhokk/speech-emotion-recognition-with-openai-whisper-large-v3",
+                 backend="eager", intra_op_threads=None, inter_op_threads=None, onnx_path=None,
+                 length_mode="padded", buckets_sec=(5, 10, 15, 20, 25, 30), local_dir=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend sconosciuto: {backend} (disponibili: {', '.join(BACKENDS)})")
+        if length_mode not in LENGTH_MODES:
+            raise ValueError(f"length_mode sconosciuto: {length_mode} (disponibili: {', '.join(LENGTH_MODES)})")
+        self.model_id   = model_id
+        self._set_threads(intra_op_threads, inter_op_threads)
+        source          = local_dir or model_id
+        self.source_key = self._snapshot_key(local_dir) if local_dir else model_id
+        load_kwargs     = {"local_files_only": True} if local_dir else {}
+        self.model      = AutoModelForAudioClassification.from_pretrained(source, **load_kwargs)
+        self.extractor  = AutoFeatureExtractor.from_pretrained(source, do_normalize=True, **load_kwargs)
         self.id2label   = self.model.config.id2label
         self.device     = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model.to(self.device).eval()
+        self.backend    = backend
+        self._ort       = None
+
+        if backend == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend == "bf16" and not self._bf16_supported():
+            logger.warning("bf16 non supportato da questa CPU: uso eager fp32.")
+            self.backend = "eager"
+        elif backend == "onnx":
+            self._ort = self._load_onnx(onnx_path, intra_op_threads, inter_op_threads)
+
+        self.length_mode = length_mode
+        self.buckets     = sorted(int(b * self.extractor.sampling_rate) for b in buckets_sec)
+        if length_mode != "padded" and self._ort is not None:
+            logger.warning("Il grafo ONNX ha input a 30 s fissi: uso length_mode='padded'.")
+            self.length_mode = "padded"
+
+    # --- API ---
+    def cache_signature(self):
+        """
+        Identifica modello e configurazione che influenzano le probabilità.
+        Con ``local_dir`` la chiave è lo snapshot (percorso e file), non ``model_id``:
+        due snapshot diversi con lo stesso id non condividono la cache.
+        """
+        return f"{self.source_key}|{self.backend}|{self.length_mode}"
+
+    def warm_up(self, seconds=1.0):
+        """Inferenza sintetica (rumore a bassa ampiezza) per scaldare kernel e allocatori."""
+        rng = np.random.default_rng(0)
+        self.predict((0.01 * rng.standard_normal(int(seconds * self.extractor.sampling_rate))).astype(np.float32))
 
     def predict(self, audio_array):
         """Ritorna lista (label, prob) ordinata discendente."""
-        inputs = self.extractor(audio_array, sampling_rate=self.extractor.sampling_rate, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        with torch.no_grad():
-            logits = self.model(**inputs).logits
-        probs = torch.nn.functional.softmax(logits, dim=-1).squeeze().tolist()
-        return sorted([(self.id2label[i], p) for i, p in enumerate(probs)], key=lambda x: x[1], reverse=True)
\ No newline at end of file
+        return self.predict_batch([audio_array])[0]
+
+    def predict_batch(self, audio_arrays):
+        """
+        Inferenza su più clip in un unico forward pass (padding a cura
+        dell'extractor). Ritorna una lista (label, prob) per clip.
+        """
+        if self.length_mode == "padded":
+            inputs = self.extractor(list(audio_arrays), sampling_rate=self.extractor.sampling_rate, return_tensors="pt")
+            logits = self._forward(inputs["input_features"])
+        else:
+            inputs = self.extractor(list(audio_arrays), sampling_rate=self.extractor.sampling_rate, return_tensors="pt",
+                                    padding="max_length", truncation=True, return_attention_mask=True,
+                                    max_length=self._target_samples(max(len(a) for a in audio_arrays)))
+            logits = self._forward_trimmed(inputs["input_features"], inputs["attention_mask"])
+        probs  = torch.nn.functional.softmax(logits.float(), dim=-1).tolist()
+        return [sorted([(self.id2label[i], p) for i, p in enumerate(row)], key=lambda x: x[1], reverse=True)
+                for row in probs]
+
+    # --- interni ---
+    def _forward(self, features):
+        if self._ort is not None:
+            return torch.from_numpy(self._ort.run(["logits"], {"input_features": features.numpy()})[0])
+        features = features.to(self.device)
+        with torch.inference_mode():
+            if self.backend == "bf16":
+                with torch.autocast("cpu", dtype=torch.bfloat16):
+                    return self.model(input_features=features).logits
+            return self.model(input_features=features).logits
+
+    def _target_samples(self, n_samples):
+        """Lunghezza (campioni) a cui portare il batch, multipla di un frame dell'encoder."""
+        n_samples = min(n_samples, self.extractor.n_samples)
+        if self.length_mode == "bucketed":
+            n_samples = next((b for b in self.buckets if b >= n_samples), self.extractor.n_samples)
+        step = 2 * self.extractor.hop_length        # conv2 ha stride 2
+        return max(step, -(-n_samples // step) * step)
+
+    def _forward_trimmed(self, features, mel_mask):
+        """
+        Forward dell'encoder Whisper sui soli frame presenti (posizioni
+        ``embed_positions[:T]``) e pooling del classificatore sui frame validi.
+        Replica WhisperForAudioClassification.forward senza il vincolo dei 3000 frame.
+        L'attenzione esclude i frame di padding: una clip corta in batch con una
+        più lunga dà le stesse probabilità che da sola.
+        """
+        model, enc = self.model, self.model.encoder
+        features   = features.to(self.device)
+        frames     = mel_mask[:, ::2].to(self.device).bool()
+        mask       = frames.unsqueeze(-1).float()
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.backend == "bf16"):
+            x = torch.nn.functional.gelu(enc.conv1(features))
+            x = torch.nn.functional.gelu(enc.conv2(x)).permute(0, 2, 1)
+            x = x + enc.embed_positions.weight[:x.shape[1]]
+            # maschera additiva [B, 1, T, T] sulle chiavi: 0 sui frame validi, -inf (minimo del dtype) sul padding
+            keys = frames[:, :x.shape[1]]
+            attn = torch.zeros(keys.shape, dtype=x.dtype, device=x.device).masked_fill(~keys, torch.finfo(x.dtype).min)
+            attn = attn[:, None, None, :].expand(-1, 1, x.shape[1], -1)
+            states = [x]
+            for layer in enc.layers:
+                out = layer(x, attn)
+                x   = out[0] if isinstance(out, tuple) else out
+                states.append(x)
+            x = enc.layer_norm(x)
+            if model.config.use_weighted_layer_sum:
+                states[-1] = x
+                stacked = torch.stack(states, dim=1)
+                weights = torch.nn.functional.softmax(model.layer_weights, dim=-1)
+                x = (stacked * weights.view(-1, 1, 1)).sum(dim=1)
+            x      = model.projector(x)
+            mask   = mask[:, :x.shape[1]].to(x.dtype)
+            pooled = (x * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            return model.classifier(pooled)
+
+    @staticmethod
+    def _set_threads(intra, inter):
+        if intra:
+            torch.set_num_threads(intra)
+        if inter:
+            try:
+                torch.set_num_interop_threads(inter)
+            except RuntimeError as e:      # già fissato o parallelismo già avviato
+                logger.warning("inter-op threads non impostabili: %s", e)
+
+    @staticmethod
+    def _snapshot_key(local_dir):
+        """Percorso assoluto dello snapshot più hash di nomi, dimensioni e mtime dei suoi file."""
+        local_dir = os.path.abspath(local_dir)
+        digest    = hashlib.sha1()
+        for name in sorted(os.listdir(local_dir)):
+            st = os.stat(os.path.join(local_dir, name))
+            digest.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+        return f"{local_dir}@{digest.hexdigest()[:12]}"
+
+    @staticmethod
+    def _bf16_supported():
+        try:
+            return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        except Exception:
+            return False
+
+    def _load_onnx(self, onnx_path, intra, inter):
+        import onnxruntime as ort
+        name      = hashlib.sha1(self.source_key.encode()).hexdigest()[:12]
+        onnx_path = onnx_path or os.path.join(os.path.expanduser("~/.cache/jarvis"),
+                                              f"{self.model_id.replace('/', '__')}-{name}.onnx")
+        if not os.path.exists(onnx_path):
+            os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+            dummy = self.extractor([np.zeros(self.extractor.sampling_rate, dtype=np.float32)],
+                                   sampling_rate=self.extractor.sampling_rate, return_tensors="pt")["input_features"]
+            logger.info("Export ONNX in %s…", onnx_path)
+            torch.onnx.export(self.model, (dummy,), onnx_path,
+                              input_names=["input_features"], output_names=["logits"],
+                              dynamic_axes={"input_features": {0: "batch"}, "logits": {0: "batch"}})
+        opts = ort.SessionOptions()
+        if intra:
+            opts.intra_op_num_threads = intra
+        if inter:
+            opts.inter_op_num_threads = inter
+        return ort.InferenceSession(onnx_path, opts, providers=["CPUExecutionProvider"])
@@ -0,0 +1,188 @@
+# components/expiring_map.py
+import sys
+import time
+import weakref
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger("jarvis.expiring_map")
+
+SWEEP_INTERVAL_SEC = 30
+_registry     = weakref.WeakSet()
+_sweeper      = None
+_sweeper_lock = threading.Lock()
+
+def approx_size(value, depth=3):
+    """Stima in byte di un valore (array numpy, byte, contenitori annidati fino a ``depth``)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    size = sys.getsizeof(value)
+    if depth <= 0:
+        return size
+    if isinstance(value, dict):
+        return size + sum(approx_size(k, depth - 1) + approx_size(v, depth - 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(approx_size(v, depth - 1) for v in value)
+    slots = getattr(type(value), "__slots__", ())
+    return size + sum(approx_size(getattr(value, s, None), depth - 1) for s in slots)
+
+
+class ExpiringMap:
+    """
+    Mappa per chiave (tipicamente user id) con TTL, tetto LRU e sweeper in
+    background condiviso da tutte le istanze, per lo stato per utente che
+    altrimenti crescerebbe a ogni nuovo id.
+
+    - ``ttl_sec``: scadenza dall'ultima scrittura (``set`` accetta un TTL per
+      chiave); con ``refresh_on_access`` anche le letture la rinnovano;
+    - ``max_entries``: oltre il tetto viene rimossa la voce usata meno di recente;
+    - ``stats()``: gauge ``entries`` e ``approx_bytes`` (ricalcolato a ogni
+      passata dello sweeper), contatori ``expired`` ed ``evicted``.
+
+    Interfaccia compatibile con dict per l'uso corrente: ``m[k]``, ``m[k] = v``,
+    ``k in m``, ``get``, ``pop``, ``setdefault``, ``keys``, ``values``, ``len``.
+    """
+    def __init__(self, name, ttl_sec=None, max_entries=None, refresh_on_access=False):
+        self.name        = name
+        self.ttl         = ttl_sec
+        self.max_entries = max_entries
+        self.refresh     = refresh_on_access
+        self._data       = OrderedDict()     # { key: (scadenza o None, valore) }
+        self._lock       = threading.RLock()
+        self.expired     = 0
+        self.evicted     = 0
+        self._bytes      = 0
+        _register(self)
+
+    # --- API ---
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.time() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+            while self.max_entries and len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evicted += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                return default
+            self._data.move_to_end(key)
+            if self.refresh and self.ttl:
+                self._data[key] = (time.time() + self.ttl, item[1])
+            return item[1]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._live(key)
+            self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def setdefault(self, key, default):
+        with self._lock:
+            item = self._live(key)
+            if item is not None:
+                return self.get(key)
+            self.set(key, default)
+            return default
+
+    def expire(self, key, ttl):
+        """Nuovo TTL per una chiave esistente (None → nessuna scadenza)."""
+        with self._lock:
+            item = self._live(key)
+            if item is not None:
+                self._data[key] = (time.time() + ttl if ttl else None, item[1])
+
+    def keys(self):
+        with self._lock:
+            return [k for k in list(self._data) if self._live(k) is not None]
+
+    def values(self):
+        with self._lock:
+            items = [self._live(k) for k in list(self._data)]
+            return [item[1] for item in items if item is not None]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __getitem__(self, key):
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def sweep(self):
+        """Rimuove le voci scadute e aggiorna la stima dei byte."""
+        now = time.time()
+        with self._lock:
+            dead = [k for k, (exp, _) in self._data.items() if exp is not None and exp <= now]
+            for k in dead:
+                del self._data[k]
+            self.expired += len(dead)
+            values = [v for _, v in self._data.values()]
+        try:
+            self._bytes = sum(approx_size(v) for v in values)
+        except RuntimeError:        # contenitore modificato durante la stima: resta quella precedente
+            pass
+        return len(dead)
+
+    def stats(self):
+        return {"entries": len(self._data), "approx_bytes": self._bytes,
+                "expired": self.expired, "evicted": self.evicted}
+
+    # --- interni ---
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[0] is not None and item[0] <= time.time():
+            del self._data[key]
+            self.expired += 1
+            return None
+        return item
+
+
+def registry_stats():
+    """Gauge di tutte le ExpiringMap vive, sommati per nome (più istanze possono condividerlo)."""
+    out = {}
+    for m in list(_registry):
+        total = out.setdefault(m.name, dict.fromkeys(("entries", "approx_bytes", "expired", "evicted"), 0))
+        for key, value in m.stats().items():
+            total[key] += value
+    return out
+
+def _register(m):
+    global _sweeper
+    _registry.add(m)
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name="expiring-map-sweeper", daemon=True)
+            _sweeper.start()
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL_SEC)
+        for m in list(_registry):
+            try:
+                m.sweep()
+            except Exception as e:
+                logger.error("Errore sweep di %s: %s", m.name, e)
@@ -0,0 +1,67 @@
+# components/ffmpeg_prespawn.py
+import queue
+import subprocess
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger("jarvis.ffmpeg_prespawn")
+
+class FfmpegPrespawner:
+    """
+    Processi ffmpeg avviati in anticipo e in attesa su stdin. Non è un pool
+    di worker riutilizzabili: ogni processo decodifica un solo chunk
+    (ffmpeg termina a fine stream), quindi resta un fork/exec per richiesta,
+    ma avviene in background e il processo già pronto viene rimpiazzato
+    subito: il costo di avvio esce dal percorso della richiesta.
+    Output: PCM float32 mono a ``target_sr``.
+    """
+    def __init__(self, size=2, target_sr=16000):
+        self.size      = size
+        self.target_sr = target_sr
+        self._ready    = queue.Queue()
+        self._refill   = queue.Queue()
+        for _ in range(size):
+            self._ready.put(self._spawn())
+        threading.Thread(target=self._refill_loop, name="ffmpeg-prespawn", daemon=True).start()
+
+    def _spawn(self):
+        return subprocess.Popen(
+            ["ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+             "-f", "f32le", "-ac", "1", "-ar", str(self.target_sr), "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def _refill_loop(self):
+        while True:
+            self._refill.get()
+            try:
+                self._ready.put(self._spawn())
+            except OSError as e:
+                logger.error("Errore avvio processo ffmpeg: %s", e)
+
+    # --- API ---
+    def decode(self, data, timeout=30):
+        """Decodifica ``data`` con un processo già avviato (o uno nuovo se non ce ne sono di pronti)."""
+        try:
+            proc = self._ready.get_nowait()
+        except queue.Empty:
+            proc = self._spawn()
+        else:
+            self._refill.put(None)
+        try:
+            out, _ = proc.communicate(data, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # ffmpeg bloccato: va terminato e raccolto, altrimenti restano processo e pipe
+            proc.kill()
+            proc.communicate()
+            raise
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg exit code {proc.returncode}")
+        return np.frombuffer(out, dtype=np.float32)
+
+    def close(self):
+        while not self._ready.empty():
+            proc = self._ready.get_nowait()
+            proc.kill()
+            proc.wait()
@@ -0,0 +1,105 @@
+# components/http_transport.py
+import threading
+import logging
+import requests
+import httpx
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("jarvis.http_transport")
+
+class _TrackingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter che annota nel thread corrente il pool di urllib3 scelto da
+    requests per la richiesta e quante connessioni aveva aperto fino a quel
+    momento: il confronto dopo l'invio dice se è stato aperto un nuovo socket.
+    """
+    def __init__(self, local, **kwargs):
+        self._track = local
+        super().__init__(**kwargs)
+
+    def get_connection_with_tls_context(self, *args, **kwargs):
+        pool = super().get_connection_with_tls_context(*args, **kwargs)
+        self._track.pool, self._track.opened = pool, pool.num_connections
+        return pool
+
+
+class HttpTransport:
+    """
+    Trasporto HTTP condiviso dagli agenti LLM: pool di connessioni keep-alive
+    per ``requests`` (Ollama) e ``httpx`` (SDK OpenAI), con timeout configurabili.
+    ``last_reused()`` indica se l'ultima richiesta del thread corrente ha
+    riutilizzato una connessione già aperta (niente TCP/TLS handshake).
+    """
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=60.0, keepalive_sec=120.0):
+        self.pool_size       = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout    = read_timeout
+        self.keepalive_sec   = keepalive_sec
+        self._session        = None
+        self._httpx          = None
+        self._init_lock      = threading.Lock()
+        self._local          = threading.local()
+
+    # --- requests (Ollama) ---
+    def session(self):
+        with self._init_lock:
+            if self._session is None:
+                adapter = _TrackingAdapter(self._local, pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                self._session = requests.Session()
+                self._session.mount("http://", adapter)
+                self._session.mount("https://", adapter)
+            return self._session
+
+    def post(self, url, **kwargs):
+        """``requests.post`` sul pool condiviso; traccia il riuso della connessione."""
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        self._local.pool = None
+        resp = self.session().post(url, **kwargs)
+        # num_connections del pool usato da requests cresce solo quando urllib3 apre un nuovo socket
+        pool = self._local.pool
+        self._local.reused = None if pool is None else pool.num_connections == self._local.opened
+        return resp
+
+    # --- httpx (OpenAI SDK) ---
+    def httpx_client(self):
+        with self._init_lock:
+            if self._httpx is None:
+                self._httpx = httpx.Client(
+                    limits=httpx.Limits(max_connections=self.pool_size,
+                                        max_keepalive_connections=self.pool_size,
+                                        keepalive_expiry=self.keepalive_sec),
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    event_hooks={"request": [self._attach_trace]}
+                )
+            return self._httpx
+
+    def _attach_trace(self, request):
+        self._local.reused = True
+        request.extensions["trace"] = self._trace
+
+    def _trace(self, event_name, info):
+        if event_name.startswith("connection.connect_tcp"):
+            self._local.reused = False
+
+    # --- API ---
+    def last_reused(self):
+        """True/False per l'ultima richiesta del thread corrente, None se non nota."""
+        return getattr(self._local, "reused", None)
+
+    def warm_up(self, url, use_httpx=False):
+        """Apre in anticipo una connessione verso ``url`` (errori ignorati)."""
+        try:
+            if use_httpx:
+                self.httpx_client().get(url)
+            else:
+                self.session().get(url, timeout=(self.connect_timeout, self.read_timeout))
+            return True
+        except Exception as e:
+            logger.warning("Warm-up fallito per %s: %s", url, e)
+            return False
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+        if self._httpx is not None:
+            self._httpx.close()
@@ -0,0 +1,185 @@
+# components/inference_server.py
+"""
+Processo di inferenza dedicato: un solo processo possiede il modello
+emozioni, i worker web (es. gunicorn con più processi) gli passano l'audio
+tramite shared memory e ricevono indietro la lista (label, prob).
+Sul canale di controllo viaggiano solo nome del blocco, lunghezza e dtype,
+mai l'array serializzato.
+
+Avvio:  python -m components.inference_server --address 127.0.0.1:6001
+"""
+import os
+import time
+import argparse
+import threading
+import logging
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Listener, Client
+from multiprocessing.shared_memory import SharedMemory
+
+logger = logging.getLogger("jarvis.inference_server")
+
+DEFAULT_ADDRESS = "127.0.0.1:6001"
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+def _attach(name):
+    """Apre un blocco creato da un altro processo senza farlo gestire al resource tracker locale."""
+    try:
+        return SharedMemory(name=name, track=False)        # Python ≥ 3.13
+    except TypeError:
+        shm = SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class InferenceServer:
+    """Espone ``predict_batch`` di un recognizer (o batcher) ai processi client."""
+    def __init__(self, recognizer, address=DEFAULT_ADDRESS, authkey=b"jarvis", batcher=None):
+        self.recognizer = recognizer
+        self.batcher    = batcher
+        self.address    = parse_address(address)
+        self.authkey    = authkey
+
+    def serve_forever(self):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"[InferenceServer] In ascolto su {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning("Connessione rifiutata: %s", e)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(("ok", self._dispatch(msg)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+    def _dispatch(self, msg):
+        op = msg[0]
+        if op == "predict_batch":
+            return self._predict_batch(msg[1])
+        if op == "signature":
+            return self.recognizer.cache_signature()
+        if op == "ping":
+            return "pong"
+        raise ValueError(f"Operazione sconosciuta: {op}")
+
+    def _predict_batch(self, blocks):
+        arrays = []
+        for name, length, dtype in blocks:
+            shm = _attach(name)
+            try:
+                # una memcpy locale: il blocco si chiude subito anche se batcher/extractor
+                # trattengono riferimenti all'array
+                arrays.append(np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf).copy())
+            finally:
+                shm.close()
+        if self.batcher:
+            futures = [self.batcher.submit(a) for a in arrays]
+            return [f.result() for f in futures]
+        return self.recognizer.predict_batch(arrays)
+
+
+class RemoteEmotionRecognizer:
+    """
+    Client con la stessa interfaccia di EmotionRecognizer (``predict``,
+    ``predict_batch``, ``cache_signature``, ``warm_up``). Una connessione per
+    thread: le Connection di multiprocessing non sono thread-safe.
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=b"jarvis"):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._local  = threading.local()
+
+    def _call(self, *msg):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send(msg)
+            status, payload = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"[InferenceServer] {payload}")
+        return payload
+
+    def predict(self, audio_array):
+        return self.predict_batch([audio_array])[0]
+
+    def predict_batch(self, audio_arrays):
+        shms = []
+        try:
+            blocks = []
+            for audio in audio_arrays:
+                audio = np.ascontiguousarray(audio, dtype=np.float32)
+                shm   = SharedMemory(create=True, size=max(1, audio.nbytes))
+                shms.append(shm)
+                np.ndarray(audio.shape, dtype=audio.dtype, buffer=shm.buf)[:] = audio
+                blocks.append((shm.name, len(audio), audio.dtype.str))
+            return self._call("predict_batch", blocks)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    def cache_signature(self):
+        return self._call("signature")
+
+    def warm_up(self, max_wait_sec=None, backoff_sec=0.5, max_backoff_sec=10.0):
+        """
+        Ping del processo di inferenza, ritentato con backoff esponenziale
+        finché risponde: il processo può partire dopo i worker web o essere
+        riavviato. Oltre ``max_wait_sec`` (None → nessun limite) rilancia
+        l'ultimo errore di connessione.
+        """
+        deadline = None if max_wait_sec is None else time.monotonic() + max_wait_sec
+        while True:
+            try:
+                return self._call("ping")
+            except (EOFError, OSError) as e:
+                if deadline is not None and time.monotonic() + backoff_sec > deadline:
+                    raise
+                logger.warning("Processo di inferenza %s:%s non raggiungibile (%s), nuovo tentativo fra %.1f s",
+                               *self.address, e, backoff_sec)
+                time.sleep(backoff_sec)
+                backoff_sec = min(backoff_sec * 2, max_backoff_sec)
+
+
+def main():
+    from components.emotion_recognizer import EmotionRecognizer
+    from components.emotion_batcher    import EmotionBatcher
+
+    ap = argparse.ArgumentParser(description="Processo di inferenza emozioni condiviso")
+    ap.add_argument("--address", default=os.getenv("EMO_INFERENCE_ADDR", DEFAULT_ADDRESS))
+    ap.add_argument("--model-dir", default=os.getenv("EMO_MODEL_DIR"))
+    ap.add_argument("--backend", default="eager")
+    ap.add_argument("--length-mode", default="padded")
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--batch-max", type=int, default=8)
+    ap.add_argument("--batch-wait-ms", type=float, default=50)
+    args = ap.parse_args()
+
+    rec = EmotionRecognizer(backend=args.backend, length_mode=args.length_mode,
+                            intra_op_threads=args.threads, local_dir=args.model_dir)
+    rec.warm_up()
+    batcher = EmotionBatcher(rec, max_batch=args.batch_max, max_wait_ms=args.batch_wait_ms) if args.batch_max > 1 else None
+    authkey = os.getenv("EMO_INFERENCE_KEY", "jarvis").encode()
+    InferenceServer(rec, args.address, authkey=authkey, batcher=batcher).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# components/metrics.py
+"""
+Metriche del server in formato testo Prometheus (esposte da ``/metrics``).
+
+Contatori, istogrammi a bucket fissi e gauge calcolati alla lettura, senza
+dipendenze esterne: ``observe``/``inc`` costano una ricerca binaria e un
+lock per metrica, quindi possono restare attivi in produzione. Le etichette
+sono passate come keyword e identificano una serie per combinazione di valori.
+"""
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("jarvis.metrics")
+
+# secondi: da 1 ms (decode di un chunk) a 60 s (risposta LLM lunga)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name       = name
+        self.help       = help_text
+        self.labelnames = tuple(labelnames)
+        self._series    = {}     # { valori etichette: stato }
+        self._lock      = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = {k: self._copy(v) for k, v in self._series.items()}
+        for key, state in sorted(series.items()):
+            lines.extend(self._lines(key, state))
+        return lines
+
+    def _copy(self, state):
+        return state
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+    def _lines(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    """Istogramma cumulativo (``_bucket``, ``_sum``, ``_count``) in secondi."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def observe_ms(self, value_ms, **labels):
+        """Scorciatoia per le latenze in millisecondi usate nel resto del server."""
+        if value_ms is not None:
+            self.observe(value_ms / 1000, **labels)
+
+    @contextmanager
+    def timer(self, **labels):
+        """Misura la durata del blocco ``with`` (attese sui lock comprese)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, state):
+        return [list(state[0]), state[1], state[2]]
+
+    def _lines(self, key, state):
+        counts, total, n = state
+        lines, acc = [], 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            acc += c
+            le = f'le="{_number(bound)}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {acc}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Gauge letto alla richiesta di ``/metrics``: ``fn()`` ritorna un numero
+    oppure ``{valori etichette: numero}`` (tuple nell'ordine di ``labelnames``).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.error("Errore lettura gauge %s: %s", self.name, e)
+            return lines
+        if values is None:
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """Raccolta delle metriche di un processo; ``render()`` produce il corpo di ``/metrics``."""
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix=""):
+        self.prefix   = prefix
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(self.prefix + name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn, labelnames=()):
+        return self._add(Gauge(self.prefix + name, help_text, fn, labelnames))
+
+    def render(self):
+        return "\n".join(line for m in self._metrics for line in m.render()) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
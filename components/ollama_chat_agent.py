@@ -1,48 +1,120 @@
 # components/ollama_chat_agent.py
-import requests
+import json
 import time
+import threading
+import logging
 from components.chat_model_interface import ChatModelInterface
+from components.http_transport import HttpTransport
+
+logger = logging.getLogger("jarvis.ollama_chat_agent")
 
 class OllamaChatAgent(ChatModelInterface):
-    """Wrapper per modello locale servito da Ollama (`/api/generate`)."""
-    def __init__(self, model_name="llama3.2", host="http://localhost:11434", temperature: float = 0.7, top_p: float = 0.9):
+    """
+    Wrapper per modello locale servito da Ollama (``/api/chat``).
+
+    I messaggi vengono inviati nel formato chat nativo: system prompt e
+    storico formano un prefisso stabile fra un turno e l'altro, che Ollama
+    riusa dalla KV cache del modello tenuto in memoria (``keep_alive``),
+    valutando solo i token nuovi. ``prompt_eval_count`` ed ``eval_count``
+    (e le durate) finiscono nei metadata, quindi il risparmio è visibile nel
+    log dei turni.
+    """
+    def __init__(self, model_name="llama3.2", host="http://localhost:11434", temperature: float = 0.7, top_p: float = 0.9,
+                 transport: HttpTransport = None, keep_alive="30m"):
         self.model   = model_name
-        self.api_url = f"{host}/api/generate"
+        self.host    = host
+        self.api_url = f"{host}/api/chat"
+        self.transport = transport or HttpTransport()
         self.temperature = temperature
         self.top_p = top_p
-        self._last_metadata = {}
+        self.keep_alive = keep_alive
+        self._local = threading.local()      # metadata per thread: richieste concorrenti non si sovrascrivono
+
+    def warm_up(self, call=False):
+        """
+        Apre in anticipo la connessione keep-alive verso il server Ollama; con
+        ``call=True`` chiede anche di caricare il modello in memoria (lista messaggi vuota).
+        """
+        ok = self.transport.warm_up(f"{self.host}/api/version")
+        if call:
+            self.transport.post(self.api_url, json={"model": self.model, "messages": [],
+                                                    "keep_alive": self.keep_alive}).raise_for_status()
+        return ok
+
+    def _payload(self, messages, stream):
+        return {
+            "model": self.model,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {"temperature": self.temperature, "top_p": self.top_p}
+        }
+
+    def _metadata(self, final, latency_ms, ttft_ms):
+        """Metadata della chiamata; ``final`` è la risposta (o l'ultima riga dello stream) di Ollama."""
+        ns_to_ms = lambda key: final[key] / 1e6 if final.get(key) is not None else None
+        return {
+            "model_name": self.model,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "prompt_tokens": final.get("prompt_eval_count"),      # solo i token non presi dalla cache
+            "completion_tokens": final.get("eval_count"),
+            "prompt_eval_ms": ns_to_ms("prompt_eval_duration"),
+            "eval_ms": ns_to_ms("eval_duration"),
+            "load_ms": ns_to_ms("load_duration"),
+            "total_ms": ns_to_ms("total_duration"),
+            "llm_latency_ms": latency_ms,
+            "ttft_ms": ttft_ms,
+            "connection_reused": self.transport.last_reused()
+        }
 
     def get_response(self, messages):
-        prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
-        start  = time.time()
+        start = time.time()
+        final = {}
         try:
-            r = requests.post(
-                self.api_url,
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "temperature": self.temperature,
-                    "top_p": self.top_p
-                }
-            )
+            r = self.transport.post(self.api_url, json=self._payload(messages, stream=False))
             latency_ms = (time.time() - start) * 1000
-            text = r.json().get("response", "").strip() if r.ok else f"[Ollama] {r.status_code}: {r.text}"
+            if r.ok:
+                final = r.json()
+                text  = final.get("message", {}).get("content", "").strip()
+            else:
+                text  = f"[Ollama] {r.status_code}: {r.text}"
         except Exception as e:
-            print(f"[OllamaChatAgent] Errore: {e}")
+            logger.error("Errore: %s", e)
             text = f"Errore: {e}"
             latency_ms = None
-        # token usage non disponibile con Ollama → None
-        self._last_metadata = {
-            "model_name": self.model,
-            "temperature": self.temperature,
-            "top_p": self.top_p,
-            "prompt_tokens": None,
-            "completion_tokens": None,
-            "llm_latency_ms": latency_ms
-        }
+        self._local.metadata = self._metadata(final, latency_ms, latency_ms)
         return text
 
+    def stream_response(self, messages):
+        """Streaming NDJSON di Ollama (``"stream": True``): un frammento di messaggio per riga."""
+        start   = time.time()
+        ttft_ms = None
+        final   = {}
+        try:
+            with self.transport.post(self.api_url, json=self._payload(messages, stream=True), stream=True) as r:
+                if not r.ok:
+                    yield f"[Ollama] {r.status_code}: {r.text}"
+                else:
+                    for line in r.iter_lines():
+                        if not line:
+                            continue
+                        part  = json.loads(line)
+                        token = part.get("message", {}).get("content", "")
+                        if token:
+                            if ttft_ms is None:
+                                ttft_ms = (time.time() - start) * 1000
+                            yield token
+                        if part.get("done"):
+                            final = part        # l'ultima riga porta conteggi e durate
+                            break
+            latency_ms = (time.time() - start) * 1000
+        except Exception as e:
+            logger.error("Errore (stream): %s", e)
+            latency_ms = None
+            yield f"Errore: {e}"
+        self._local.metadata = self._metadata(final, latency_ms, ttft_ms)
+
     def get_last_metadata(self):
         """Restituisce le metriche dell'ultima chiamata LLM."""
-        return getattr(self, "_last_metadata", {})
\ No newline at end of file
+        return getattr(self._local, "metadata", {})
\ No newline at end of file
@@ -1,26 +1,140 @@
+import time
+
+EMOTION_VERBOSITY = ("none", "top1", "compact", "full")
+
+def _top_emotions(emotions, k):
+    """Prime ``k`` coppie (label, prob) ordinate per probabilità."""
+    probs = emotions.get("probs") or {}
+    if not probs and emotions.get("top_emotion"):
+        return [(emotions["top_emotion"], None)]
+    return sorted(probs.items(), key=lambda x: x[1], reverse=True)[:k]
+
+def _bin(p):
+    """Probabilità arrotondata a decine di punti percentuali (es. 0.734 → "70%")."""
+    return "" if p is None else f" {int(round(p * 10)) * 10}%"
+
+
 class Orchestrator:
     """
     Compone il prompt arricchendolo con le emozioni *recenti*
-    prese dalla EmotionMemory.
+    prese dalla EmotionMemory. Con ``response_cache`` i turni già visti
+    (stesso storico, testo e bucket emotivo) non passano dal modello.
+
+    ``emotion_verbosity`` controlla quanto del vettore emozioni entra nel prompt:
+      - ``none``:    solo il testo;
+      - ``top1``:    emozione dominante con probabilità a decine di punti;
+      - ``compact``: prime ``emotion_top_k`` emozioni (sopra ``emotion_min_prob``);
+      - ``full``:    formato originale con l'intero dizionario (solo per confronto).
+    Nello storico resta sempre il testo dell'utente più un tag con l'emozione
+    dominante, così i turni successivi non re-inviano il vettore completo.
     """
-    def __init__(self, chat_agent, conv_manager, emo_memory):
+    def __init__(self, chat_agent, conv_manager, emo_memory, response_cache=None,
+                 emotion_verbosity="compact", emotion_top_k=2, emotion_min_prob=0.1):
+        if emotion_verbosity not in EMOTION_VERBOSITY:
+            raise ValueError(f"emotion_verbosity sconosciuta: {emotion_verbosity} "
+                             f"(disponibili: {', '.join(EMOTION_VERBOSITY)})")
         self.chat_agent   = chat_agent
         self.conv_manager = conv_manager
         self.emo_memory   = emo_memory
+        self.response_cache = response_cache
+        self.verbosity    = emotion_verbosity
+        self.top_k        = emotion_top_k
+        self.min_prob     = emotion_min_prob
 
     def _build_prompt(self, text, emotions):
-        if emotions:
+        if not emotions or self.verbosity == "none":
+            return text
+        if self.verbosity == "full":
             emo_str = ", ".join([f"{e}: {p}" for e, p in emotions.items()])
             return f"L'utente ha detto: «{text}». Le emozioni rilevate sono {emo_str}. Rispondi in modo appropriato."
-        return text
+        top = _top_emotions(emotions, 1 if self.verbosity == "top1" else self.top_k)
+        top = [(e, p) for i, (e, p) in enumerate(top) if i == 0 or p is None or p >= self.min_prob]
+        return f"{text}\n[emozioni: {', '.join(f'{e}{_bin(p)}' for e, p in top)}]"
+
+    def _history_text(self, text, emotions):
+        """Testo salvato nello storico: messaggio dell'utente più tag dell'emozione dominante."""
+        if not emotions or self.verbosity == "none":
+            return text
+        top = _top_emotions(emotions, 1)
+        return f"{text} [emo: {top[0][0]}]" if top else text
+
+    def _with_context(self, user_id, prompt):
+        """Metadata dell'ultima chiamata LLM più l'uso del budget di contesto (``context``)."""
+        metadata = dict(getattr(self.chat_agent, "get_last_metadata", lambda: {})())
+        usage    = getattr(self.conv_manager, "context_usage", None)
+        if usage:
+            metadata["context"] = usage(user_id, prompt)
+        return metadata
+
+    def _cache_lookup(self, history, text, emotions):
+        """``(key, scenario, hit)``; ``hit`` è ``(response, model_name)`` o None."""
+        if self.response_cache is None:
+            return None, None, None
+        key, scenario = self.response_cache.key(history, text, emotions)
+        return key, scenario, self.response_cache.get(key) if key else None
+
+    def _cache_store(self, key, scenario, response_text, metadata):
+        # solo risposte complete: in caso di errore i conteggi dei token mancano
+        if key and metadata.get("completion_tokens"):
+            self.response_cache.put(key, scenario, response_text, metadata.get("model_name"))
+        if self.response_cache is not None:
+            metadata["cache_hit"] = False
+
+    def _hit_metadata(self, user_id, prompt, model_name, scenario, start, prompt_ms):
+        elapsed_ms = (time.time() - start) * 1000
+        return {"model_name": model_name, "cache_hit": True, "scenario_id": scenario,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "llm_latency_ms": elapsed_ms, "ttft_ms": elapsed_ms, "prompt_build_ms": prompt_ms,
+                "context": self.conv_manager.context_usage(user_id, prompt)}
 
     def generate_response(self, user_id, text):
+        start    = time.time()
         emotions = self.emo_memory.get_recent(user_id)
         prompt   = self._build_prompt(text, emotions)
+        history  = self.conv_manager.get_history(user_id)
+        key, scenario, hit = self._cache_lookup(history, text, emotions)
+        prompt_ms = (time.time() - start) * 1000       # emozioni, prompt, storico e lookup in cache
+        if hit:
+            response_text, model_name = hit
+            self.conv_manager.add_exchange(user_id, self._history_text(text, emotions), response_text)
+            return response_text, self._hit_metadata(user_id, prompt, model_name, scenario, start, prompt_ms)
 
-        messages = self.conv_manager.get_history(user_id) + [{"role": "user", "content": prompt}]
+        messages = history + [{"role": "user", "content": prompt}]
         response_text = self.chat_agent.get_response(messages)
-        metadata      = getattr(self.chat_agent, "get_last_metadata", lambda: {})()
+        metadata      = self._with_context(user_id, prompt)
+        metadata["prompt_build_ms"] = prompt_ms
+        self._cache_store(key, scenario, response_text, metadata)
+
+        self.conv_manager.add_exchange(user_id, self._history_text(text, emotions), response_text)
+        return response_text, metadata
+
+    def generate_stream(self, user_id, text):
+        """
+        Versione in streaming di ``generate_response``: produce i token della
+        risposta e, a stream concluso, aggiorna lo storico. Il valore di ritorno
+        del generatore (``StopIteration.value``) è ``(response_text, metadata)``.
+        """
+        start    = time.time()
+        emotions = self.emo_memory.get_recent(user_id)
+        prompt   = self._build_prompt(text, emotions)
+        history  = self.conv_manager.get_history(user_id)
+        key, scenario, hit = self._cache_lookup(history, text, emotions)
+        prompt_ms = (time.time() - start) * 1000       # emozioni, prompt, storico e lookup in cache
+        if hit:
+            response_text, model_name = hit
+            yield response_text
+            self.conv_manager.add_exchange(user_id, self._history_text(text, emotions), response_text)
+            return response_text, self._hit_metadata(user_id, prompt, model_name, scenario, start, prompt_ms)
+
+        messages = history + [{"role": "user", "content": prompt}]
+        parts = []
+        for token in self.chat_agent.stream_response(messages):
+            parts.append(token)
+            yield token
+        response_text = "".join(parts)
+        metadata      = self._with_context(user_id, prompt)
+        metadata["prompt_build_ms"] = prompt_ms
+        self._cache_store(key, scenario, response_text, metadata)
 
-        self.conv_manager.add_exchange(user_id, prompt, response_text)
-        return response_text, metadata
\ No newline at end of file
+        self.conv_manager.add_exchange(user_id, self._history_text(text, emotions), response_text)
+        return response_text, metadata
@@ -0,0 +1,43 @@
+# components/readiness.py
+import time
+import threading
+import logging
+
+logger = logging.getLogger("jarvis.readiness")
+
+class Readiness:
+    """
+    Stato di prontezza dei componenti caricati in background (modello
+    emozioni, warm-up LLM…). Ogni componente passa da ``loading`` a
+    ``ready`` oppure ``error``; il server è pronto quando tutti sono ``ready``.
+    """
+    def __init__(self):
+        self._state = {}        # { name: {"status": ..., "elapsed_ms": ..., "error": ...} }
+        self._lock  = threading.Lock()
+
+    def start(self, name, fn):
+        """Esegue ``fn`` in un thread daemon e ne traccia l'esito come ``name``."""
+        with self._lock:
+            self._state[name] = {"status": "loading", "elapsed_ms": None, "error": None}
+        threading.Thread(target=self._run, args=(name, fn), name=f"warmup-{name}", daemon=True).start()
+
+    def _run(self, name, fn):
+        t_start = time.time()
+        try:
+            fn()
+            status, error = "ready", None
+        except Exception as e:
+            logger.error("Errore durante il caricamento di %s: %s", name, e)
+            status, error = "error", str(e)
+        with self._lock:
+            self._state[name] = {"status": status, "elapsed_ms": (time.time() - t_start) * 1000, "error": error}
+
+    def is_ready(self, name=None):
+        with self._lock:
+            if name is not None:
+                return self._state.get(name, {}).get("status") == "ready"
+            return all(s["status"] == "ready" for s in self._state.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(s) for name, s in self._state.items()}
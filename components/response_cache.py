@@ -0,0 +1,94 @@
+# components/response_cache.py
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+SCENARIO_RE = re.compile(r"\[CONTEXT\](.*?)\[END CONTEXT\]", re.S)
+
+def normalize(text):
+    """Minuscole, spazi compattati e punteggiatura finale rimossa: varianti banali dello stesso testo coincidono."""
+    return " ".join(text.casefold().split()).rstrip(" .!?…")
+
+def scenario_id(text):
+    """Hash del testo ``[CONTEXT] … [END CONTEXT]`` contenuto in ``text`` (None se assente)."""
+    m = SCENARIO_RE.search(text or "")
+    if not m:
+        return None
+    return hashlib.blake2b(normalize(m.group(1)).encode(), digest_size=8).hexdigest()
+
+def emotion_bucket(emotions):
+    """Emozione dominante e confidenza grossolana (low/mid/high), o ``none``."""
+    if not emotions or not emotions.get("probs"):
+        return "none"
+    top = emotions.get("top_emotion") or max(emotions["probs"], key=emotions["probs"].get)
+    p   = emotions["probs"].get(top, 0.0)
+    return f"{top}:{'high' if p >= 0.8 else 'mid' if p >= 0.5 else 'low'}"
+
+
+class ResponseCache:
+    """
+    Cache delle risposte LLM per turni ripetuti (es. l'apertura di uno
+    scenario ``[CONTEXT] … [END CONTEXT]`` inviata da molti utenti).
+    La chiave è un hash BLAKE2b di storico normalizzato, testo utente e
+    bucket emotivo; eviction LRU (``max_entries``) e TTL. Ogni voce è
+    associata allo scenario presente nel turno o nello storico, così da poter
+    invalidare tutte le risposte di uno scenario quando il testo cambia.
+    Con ``scenario_only`` vengono messi in cache solo i turni di uno scenario.
+    """
+    def __init__(self, max_entries=512, ttl_sec=3600, scenario_only=True):
+        self.max_entries   = max_entries
+        self.ttl           = ttl_sec
+        self.scenario_only = scenario_only
+        self._mem          = OrderedDict()     # { key: (ts, scenario_id, response, model_name) }
+        self._lock         = threading.Lock()
+        self.hits          = 0
+        self.misses        = 0
+
+    # --- API ---
+    def key(self, history, text, emotions):
+        """Ritorna ``(key, scenario_id)``; key è None se il turno non va messo in cache."""
+        scenario = scenario_id(text) or next((s for s in (scenario_id(m["content"]) for m in history) if s), None)
+        if self.scenario_only and scenario is None:
+            return None, None
+        h = hashlib.blake2b(digest_size=16)
+        for m in history:
+            h.update(f"{m['role']}\x1f{normalize(m['content'])}\x1e".encode())
+        h.update(f"{normalize(text)}\x1e{emotion_bucket(emotions)}".encode())
+        return h.hexdigest(), scenario
+
+    def get(self, key):
+        """``(response, model_name)`` in cache o None."""
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item and now - item[0] <= self.ttl:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return item[2], item[3]
+            if item:
+                del self._mem[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, scenario, response, model_name=None):
+        with self._lock:
+            self._mem[key] = (time.time(), scenario, response, model_name)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def invalidate_scenario(self, scenario):
+        """Rimuove le risposte di uno scenario (id o testo con ``[CONTEXT]``); ritorna quante."""
+        sid = scenario_id(scenario) or scenario
+        with self._lock:
+            keys = [k for k, item in self._mem.items() if item[1] == sid]
+            for k in keys:
+                del self._mem[k]
+        return len(keys)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self._mem), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else None}
@@ -0,0 +1,511 @@
+# components/state_backend.py
+"""
+Storage dello stato per utente (storico, emozioni, buffer audio) dietro
+un'interfaccia comune, così che più nodi ``flask_server`` possano servire
+gli stessi utenti senza sticky session e un riavvio non perda le sessioni.
+
+Implementazioni:
+  - ``MemoryBackend``:      dizionario nel processo (default);
+  - ``ManagerBackend``:     un MemoryBackend in un processo server locale
+                            condiviso dai worker dello stesso host, tramite un
+                            proxy multiprocessing.managers (non memoria
+                            condivisa): ogni lotto è un round trip serializzato
+                            con pickle su socket locale;
+  - ``RedisBackend``:       client RESP minimale su socket, verso Redis o lo
+                            stand-in ``serve-resp`` di questo modulo.
+
+Ogni operazione è una tupla ``(nome, *argomenti)``; ``execute(ops)`` esegue
+un lotto in un solo round trip (pipeline, atomica con MULTI/EXEC su Redis).
+L'atomicità vale per il singolo lotto: i lock per utente dei componenti
+(StripedLocks) sono per processo, quindi sequenze lettura → scrittura su
+più lotti, come il controllo e il taglio dello storico nel fold del
+riassunto, non sono atomiche fra worker o nodi diversi.
+Operazioni: ``get``/``set`` (oggetti JSON), ``getbytes``/``setbytes``/
+``append``/``strlen`` (byte grezzi), ``delete``, ``rpush``/``lrange``/``ltrim``
+(liste di oggetti JSON), ``incrby``, ``expire``. I TTL sono in secondi.
+
+    with_pipe = backend.pipeline().rpush(k, a, b).lrange(k).get(s)
+    _, msgs, summary = with_pipe.execute()
+
+Server:  python -m components.state_backend serve-manager --address 127.0.0.1:6002
+         python -m components.state_backend serve-resp  --address 127.0.0.1:6380
+"""
+import os
+import json
+import socket
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from urllib.parse import urlparse
+from multiprocessing.managers import BaseManager
+from components.expiring_map import ExpiringMap
+
+def _addr(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class Pipeline:
+    """Accoda operazioni (``pipe.get(k).set(k, v)``) e le esegue con un solo ``execute``."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.ops     = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.ops.append((name, *args))
+            return self
+        return queue
+
+    def execute(self):
+        return self.backend.execute(self.ops) if self.ops else []
+
+
+class StateBackend:
+    """Interfaccia comune; le sottoclassi implementano ``execute(ops)``."""
+    def execute(self, ops):
+        raise NotImplementedError
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def __getattr__(self, name):
+        # scorciatoia per una singola operazione: backend.get(k) ≡ backend.execute([("get", k)])[0]
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args: self.execute([(name, *args)])[0]
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """
+    Stato nel processo su una ExpiringMap (TTL per chiave, sweeper in
+    background); un lotto di operazioni è atomico rispetto agli altri thread.
+
+    Tetti LRU opzionali: ``max_keys`` sulle singole chiavi, ``max_users`` sui
+    gruppi di chiavi dello stesso utente (secondo campo della chiave:
+    ``conv:{user_id}:msgs``, ``emo:{user_id}``…). Un gruppo viene rimosso per
+    intero, così le liste collegate di un utente (messaggi e token) non
+    restano disallineate.
+    """
+    def __init__(self, name="state", max_keys=None, max_users=None):
+        self._data      = ExpiringMap(name, max_entries=max_keys)
+        self._lock      = threading.Lock()
+        self.max_users  = max_users
+        self._groups    = OrderedDict()     # { user_id: chiavi scritte }, in ordine di uso
+
+    def execute(self, ops):
+        with self._lock:
+            results = [getattr(self, f"_op_{op[0]}")(*op[1:]) for op in ops]
+            if self.max_users:
+                self._track(ops)
+            return results
+
+    def keys(self):
+        return self._data.keys()
+
+    # --- tetto per utente ---
+    @staticmethod
+    def _group(key):
+        parts = str(key).split(":", 2)
+        return parts[1] if len(parts) > 1 else parts[0]
+
+    def _track(self, ops):
+        for op in ops:
+            if op[0] == "flush":
+                self._groups.clear()
+            elif op[0] != "delete" and len(op) > 1 and op[1] in self._data:
+                group = self._group(op[1])
+                keys  = self._groups.get(group)
+                if keys is None:
+                    keys = self._groups[group] = set()
+                else:
+                    self._groups.move_to_end(group)
+                keys.add(op[1])
+        while len(self._groups) > self.max_users:
+            _, keys = self._groups.popitem(last=False)
+            for key in keys:
+                self._data.pop(key)
+            self._data.evicted += len(keys)
+
+    # --- operazioni ---
+    def _op_get(self, key):
+        value = self._data.get(key)
+        return bytes(value) if isinstance(value, bytearray) else value
+
+    _op_getbytes = _op_get
+
+    def _op_set(self, key, value, ttl=None):
+        self._data.set(key, value, ttl)
+        return True
+
+    _op_setbytes = _op_set
+
+    def _op_delete(self, *keys):
+        missing = object()
+        return sum(self._data.pop(key, missing) is not missing for key in keys)
+
+    def _op_append(self, key, data):
+        value = self._data.get(key)
+        if not isinstance(value, bytearray):
+            value = bytearray(value or b"")
+            self._data.set(key, value)
+        value += data
+        return len(value)
+
+    def _op_strlen(self, key):
+        value = self._data.get(key)
+        return len(value) if value is not None else 0
+
+    def _op_rpush(self, key, *values):
+        lst = self._data.get(key)
+        if not isinstance(lst, list):
+            lst = []
+            self._data.set(key, lst)
+        lst.extend(values)
+        return len(lst)
+
+    def _op_lrange(self, key, start=0, stop=-1):
+        lst = self._data.get(key) or []
+        return lst[start:len(lst) if stop == -1 else stop + 1]
+
+    def _op_ltrim(self, key, start, stop=-1):
+        lst = self._data.get(key)
+        if lst is not None:
+            # stessa scadenza: la lista viene accorciata sul posto
+            lst[:] = lst[start:len(lst) if stop == -1 else stop + 1]
+        return True
+
+    def _op_incrby(self, key, n):
+        value = int(self._data.get(key) or 0) + n
+        self._data.set(key, value)
+        return value
+
+    def _op_expire(self, key, ttl):
+        self._data.expire(key, ttl)
+        return True
+
+    def _op_flush(self):
+        self._data.clear()
+        return True
+
+
+# ─── Stato condiviso sullo stesso host (processo manager) ─────────
+class _StateServerManager(BaseManager):
+    pass
+
+class _StateClientManager(BaseManager):
+    pass
+
+class ManagerBackend(StateBackend):
+    """
+    Client di un MemoryBackend ospitato da ``serve-manager``: i worker dello
+    stesso host condividono lo stato, un lotto di operazioni è una sola
+    chiamata (pickle su socket locale) al processo server.
+
+    Memoria condivisa (multiprocessing.shared_memory) scartata: i valori sono
+    liste e buffer di byte che crescono (``rpush``, ``append``) e scadono per
+    chiave, quindi servirebbero un allocatore nei blocchi condivisi, un lock
+    fra processi e TTL/LRU replicati in ogni worker. Un lotto per turno costa
+    un round trip locale, trascurabile rispetto alla chiamata LLM; vedi
+    ``python -m benchmarks.bench_state_backend``.
+    """
+    def __init__(self, address="127.0.0.1:6002", authkey=b"jarvis"):
+        _StateClientManager.register("state")
+        self._manager = _StateClientManager(address=_addr(address), authkey=authkey)
+        self._manager.connect()
+        self._proxy   = self._manager.state()
+
+    def execute(self, ops):
+        return self._proxy.execute(list(ops))
+
+def serve_manager(address, authkey, max_users=None):
+    state = MemoryBackend(max_users=max_users)
+    _StateServerManager.register("state", callable=lambda: state, exposed=("execute", "keys"))
+    server = _StateServerManager(address=_addr(address), authkey=authkey).get_server()
+    print(f"[StateBackend] Stato condiviso (manager) su {address}")
+    server.serve_forever()
+
+
+# ─── Redis (RESP) ────────────────────────────────────────────────
+def _encode_command(args):
+    out = [b"*%d\r\n" % len(args)]
+    for a in args:
+        if not isinstance(a, (bytes, bytearray)):
+            a = str(a).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+    return b"".join(out)
+
+def _read_reply(f):
+    line = f.readline()
+    if not line:
+        raise ConnectionError("Connessione chiusa dal server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return RedisError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        n = int(body)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        return data[:-2]
+    if kind == b"*":
+        n = int(body)
+        return None if n < 0 else [_read_reply(f) for _ in range(n)]
+    raise ConnectionError(f"Risposta RESP non valida: {line!r}")
+
+class RedisError(Exception):
+    pass
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+def _loads(raw):
+    return None if raw is None else json.loads(raw)
+
+# operazioni che si possono ripetere senza effetti doppi (non append/rpush/incrby/ltrim)
+_REPLAYABLE = {"get", "getbytes", "strlen", "lrange", "set", "setbytes", "delete", "expire", "flush"}
+
+class RedisBackend(StateBackend):
+    """
+    Client RESP2 minimale (nessuna dipendenza): una connessione per thread,
+    lotti inviati con un'unica write e avvolti in MULTI/EXEC. Su errore di
+    connessione un lotto viene ritentato una volta solo se non è stato
+    inviato per intero o se contiene solo operazioni ripetibili.
+    URL: ``redis://[:password@]host:port[/db]``.
+    """
+    def __init__(self, url="redis://127.0.0.1:6379/0", timeout=5.0):
+        u = urlparse(url)
+        self.host     = u.hostname or "127.0.0.1"
+        self.port     = u.port or 6379
+        self.db       = int(u.path.strip("/") or 0)
+        self.password = u.password
+        self.timeout  = timeout
+        self._local   = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+            setup = ([("AUTH", self.password)] if self.password else []) + ([("SELECT", self.db)] if self.db else [])
+            for cmd in setup:
+                sock.sendall(_encode_command(cmd))
+                reply = _read_reply(conn[1])
+                if isinstance(reply, RedisError):
+                    raise reply
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn:
+            conn[1].close()
+            conn[0].close()
+            self._local.conn = None
+
+    def _command(self, op):
+        """Comando RESP e funzione di decodifica della risposta per un'operazione."""
+        name, args = op[0], op[1:]
+        if name == "get":
+            return ["GET", args[0]], _loads
+        if name == "getbytes":
+            return ["GET", args[0]], lambda r: r
+        if name in ("set", "setbytes"):
+            key, value, ttl = args[0], args[1], args[2] if len(args) > 2 else None
+            cmd = ["SET", key, _dumps(value) if name == "set" else value]
+            if ttl is not None:
+                cmd += ["PX", max(1, int(ttl * 1000))]
+            return cmd, lambda r: r == "OK"
+        if name == "delete":
+            return ["DEL", *args], lambda r: r
+        if name == "append":
+            return ["APPEND", args[0], args[1]], lambda r: r
+        if name == "strlen":
+            return ["STRLEN", args[0]], lambda r: r
+        if name == "rpush":
+            return ["RPUSH", args[0], *[_dumps(v) for v in args[1:]]], lambda r: r
+        if name == "lrange":
+            start, stop = (args[1] if len(args) > 1 else 0), (args[2] if len(args) > 2 else -1)
+            return ["LRANGE", args[0], start, stop], lambda r: [_loads(x) for x in r]
+        if name == "ltrim":
+            return ["LTRIM", args[0], args[1], args[2] if len(args) > 2 else -1], lambda r: r == "OK"
+        if name == "incrby":
+            return ["INCRBY", args[0], args[1]], lambda r: r
+        if name == "expire":
+            if args[1] is None:
+                return ["PERSIST", args[0]], lambda r: True
+            return ["PEXPIRE", args[0], max(1, int(args[1] * 1000))], lambda r: True
+        if name == "flush":
+            return ["FLUSHDB"], lambda r: r == "OK"
+        raise ValueError(f"Operazione sconosciuta: {name}")
+
+    def execute(self, ops):
+        cmds, decoders = zip(*[self._command(op) for op in ops]) if ops else ((), ())
+        atomic  = len(cmds) > 1
+        payload = [["MULTI"], *cmds, ["EXEC"]] if atomic else list(cmds)
+        replayable = all(op[0] in _REPLAYABLE for op in ops)
+        for attempt in (0, 1):
+            sent = False
+            try:
+                sock, f = self._conn()
+                sock.sendall(b"".join(_encode_command(c) for c in payload))
+                sent = True
+                replies = [_read_reply(f) for _ in payload]
+                break
+            except (OSError, ConnectionError):
+                self.close()
+                # sendall fallita: l'ultimo comando (o EXEC) non è arrivato intero, niente è stato eseguito;
+                # dopo l'invio completo il lotto può essere già applicato e si ripete solo se è innocuo
+                if attempt or (sent and not replayable):
+                    raise
+        if atomic:
+            replies = replies[-1]
+            if replies is None:
+                raise RedisError("Transazione annullata")
+        for r in replies:
+            if isinstance(r, RedisError):
+                raise r
+        return [dec(r) for dec, r in zip(decoders, replies)]
+
+
+# ─── Stand-in RESP (test e sviluppo, non per produzione) ─────────
+class _RespHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True     # risposte in più write: senza TCP_NODELAY ~40 ms di delayed ACK per lotto
+    COMMANDS = {b"GET": "get", b"SET": "set", b"DEL": "delete", b"APPEND": "append", b"STRLEN": "strlen",
+                b"RPUSH": "rpush", b"LRANGE": "lrange", b"LTRIM": "ltrim", b"INCRBY": "incrby",
+                b"PEXPIRE": "expire", b"PERSIST": "expire", b"FLUSHDB": "flush"}
+
+    def handle(self):
+        queued = None
+        while True:
+            try:
+                cmd = _read_reply(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(cmd, list) or not cmd:
+                return
+            name = cmd[0].upper()
+            if name == b"MULTI":
+                queued = []
+                self._send("OK")
+            elif name == b"EXEC":
+                ops, queued = queued or [], None
+                try:
+                    results = self.server.state.execute(ops)
+                except Exception as e:
+                    self._send(RedisError(f"ERR {e}"))
+                    continue
+                self.wfile.write(b"*%d\r\n" % len(results) +
+                                 b"".join(self._encode_result(op[0], r) for op, r in zip(ops, results)))
+            elif name in (b"PING", b"AUTH", b"SELECT"):
+                self._send("PONG" if name == b"PING" else "OK")
+            elif name in self.COMMANDS:
+                try:
+                    op = self._op(name, cmd[1:])
+                except (ValueError, IndexError) as e:
+                    self._send(RedisError(f"ERR {e}"))
+                    continue
+                if queued is not None:
+                    queued.append(op)
+                    self._send("QUEUED")
+                else:
+                    try:
+                        self.wfile.write(self._encode_result(op[0], self.server.state.execute([op])[0]))
+                    except Exception as e:
+                        self._send(RedisError(f"ERR {e}"))
+            else:
+                self._send(RedisError(f"ERR unknown command '{name.decode()}'"))
+
+    def _op(self, name, args):
+        op = self.COMMANDS[name]
+        if name == b"SET":
+            ttl = int(args[3]) / 1000 if len(args) > 3 and args[2].upper() == b"PX" else None
+            return ("set", args[0], args[1], ttl)
+        if name in (b"LRANGE", b"LTRIM"):
+            return (op, args[0], int(args[1]), int(args[2]))
+        if name == b"INCRBY":
+            return (op, args[0], int(args[1]))
+        if name == b"PEXPIRE":
+            return (op, args[0], int(args[1]) / 1000)
+        if name == b"PERSIST":
+            return (op, args[0], None)
+        return (op, *args)
+
+    def _send(self, value):
+        self.wfile.write(self._encode(value))
+
+    def _encode_result(self, op, value):
+        # GET di un contatore: Redis risponde con una bulk string, non con un intero
+        if op == "get" and isinstance(value, int) and not isinstance(value, bool):
+            return self._encode_bulk(value)
+        return self._encode(value)
+
+    def _encode(self, value):
+        if isinstance(value, RedisError):
+            return b"-%s\r\n" % str(value).encode()
+        if value is True or value == "OK":
+            return b"+OK\r\n"
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode()
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self._encode_bulk(v) for v in value)
+        return self._encode_bulk(value)
+
+    def _encode_bulk(self, value):
+        if isinstance(value, list):
+            return self._encode(value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            value = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(value), bytes(value))
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """Server RESP minimale (sottoinsieme dei comandi usati da RedisBackend) su un MemoryBackend."""
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, address="127.0.0.1:6380", max_users=None):
+        super().__init__(_addr(address), _RespHandler)
+        self.state = MemoryBackend(max_users=max_users)
+
+
+def create_backend(url=None, max_users=None):
+    """
+    Backend da URL: ``None``/``memory://`` → MemoryBackend (con tetto LRU
+    ``max_users``), ``manager://host:port`` (o ``local://``) → ManagerBackend,
+    ``redis://…`` → RedisBackend. Nei backend esterni il tetto è del server.
+    """
+    if not url or url.startswith("memory://"):
+        return MemoryBackend(max_users=max_users)
+    if url.startswith(("manager://", "local://")):
+        return ManagerBackend(url.split("://", 1)[1], authkey=os.getenv("STATE_BACKEND_KEY", "jarvis").encode())
+    if url.startswith("redis://"):
+        return RedisBackend(url)
+    raise ValueError(f"URL backend di stato non supportato: {url}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Server per lo stato condiviso dei nodi flask_server")
+    ap.add_argument("command", choices=["serve-manager", "serve-local", "serve-resp"])   # serve-local: nome storico
+    ap.add_argument("--address", default=None)
+    ap.add_argument("--max-users", type=int, default=None, help="tetto LRU degli utenti (chiavi rimosse per utente)")
+    args = ap.parse_args()
+    if args.command in ("serve-manager", "serve-local"):
+        serve_manager(args.address or "127.0.0.1:6002", os.getenv("STATE_BACKEND_KEY", "jarvis").encode(), args.max_users)
+    else:
+        server = RespServer(args.address or "127.0.0.1:6380", args.max_users)
+        print(f"[StateBackend] Stand-in RESP su {args.address or '127.0.0.1:6380'}")
+        server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# components/structured_log.py
+"""
+Logging strutturato a basso overhead per il server.
+
+- ``setup_logging`` installa sul logger ``jarvis`` un QueueHandler: il
+  thread della richiesta accoda il record e un QueueListener in background
+  lo scrive come riga JSON, quindi stdout non serializza più le richieste;
+- i messaggi usano la formattazione lazy di ``logging``
+  (``logger.debug("… %s", valore)``): con il livello disabilitato il costo
+  è un confronto di interi, senza formattare né leggere il contesto;
+- ``bind(request_id=…, user_id=…)`` imposta gli id di correlazione in
+  contextvars; vengono copiati in ogni record emesso dallo stesso contesto
+  (richiesta, generatore di streaming o job lanciato con ``copy_context``).
+
+Riga prodotta::
+
+    {"ts": "2025-01-01T12:00:00.123", "level": "INFO", "logger": "jarvis.server",
+     "msg": "Conversazione resettata.", "request_id": "9f1c…", "user_id": "u1"}
+"""
+import re
+import sys
+import json
+import uuid
+import queue
+import atexit
+import logging
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+user_id_var    = contextvars.ContextVar("user_id", default=None)
+
+_listener = None
+_UNSAFE_ID = re.compile(r"[^A-Za-z0-9._-]")
+MAX_REQUEST_ID_LEN = 64
+
+def bind(request_id=None, user_id=None):
+    """Imposta gli id di correlazione del contesto corrente (None lascia invariato)."""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if user_id is not None:
+        user_id_var.set(user_id)
+
+def start_request(request_id=None):
+    """
+    Nuovo contesto di richiesta: id generato se assente, utente azzerato. Ritorna l'id.
+    Un id esterno (header ``X-Request-ID``) viene ridotto a ``[A-Za-z0-9._-]``
+    e a MAX_REQUEST_ID_LEN caratteri prima di finire nei log e nella risposta.
+    """
+    if request_id:
+        request_id = _UNSAFE_ID.sub("", request_id)[:MAX_REQUEST_ID_LEN]
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    user_id_var.set(None)
+    return request_id
+
+def current_ids():
+    """``(request_id, user_id)`` del contesto corrente, per riportarli in un altro contesto."""
+    return request_id_var.get(), user_id_var.get()
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Completa il record nel thread chiamante (messaggio formattato, traceback,
+    id di correlazione) e lo accoda; il JSON viene prodotto dal listener.
+    """
+    def prepare(self, record):
+        record.msg        = record.getMessage()
+        record.args       = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = request_id_var.get()
+        if getattr(record, "user_id", None) is None:
+            record.user_id = user_id_var.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record; i campi passati con ``extra=`` vengono inclusi."""
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "request_id", "user_id"}
+
+    def format(self, record):
+        out = {"ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+               "level": record.levelname,
+               "logger": record.name,
+               "msg": record.getMessage()}
+        if getattr(record, "request_id", None):
+            out["request_id"] = record.request_id
+        if getattr(record, "user_id", None):
+            out["user_id"] = record.user_id
+        for key, value in vars(record).items():
+            if key not in self._RESERVED:
+                out[key] = value
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", stream=None, name="jarvis"):
+    """
+    Configura il logger ``name`` (e i figli, es. ``jarvis.server``) con
+    scrittura JSON in background su ``stream`` (default stdout). Idempotente.
+    """
+    global _listener
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if _listener is not None:
+        return logger
+    q       = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    _listener = QueueListener(q, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logger.addHandler(_ContextQueueHandler(q))
+    logger.propagate = False
+    return logger
@@ -0,0 +1,217 @@
+# components/turn_store.py
+"""
+Log dei turni di conversazione append-only.
+
+Ogni utente ha un file ``{user_id}.jsonl`` con un record per riga:
+``{"type": "session", "session_id": n}`` a ogni reset e
+``{"type": "turn", "entry": {...}}`` per ogni turno. Le scritture avvengono
+in un thread dedicato con fsync a lotti; session id, numero di turni e
+timestamp dell'ultimo turno restano in cache, quindi il costo per turno è
+costante e non dipende dalla lunghezza dello storico.
+
+Session id e contatore dei turni sono in cache nel processo: con più
+worker (gunicorn -w N) che servono lo stesso utente ognuno prosegue la
+propria numerazione e i turn id possono ripetersi. Con più worker
+instradare ogni utente a un solo processo, oppure trattare
+``(timestamp, turn_id)`` come chiave.
+
+Un eventuale ``{user_id}.json`` nel vecchio formato annidato fa da base:
+l'exporter ricostruisce il JSON ``{"user_id", "session_id", "sessions"}``
+letto da ``analysis/score_RQ.py`` in una cartella separata, senza toccare
+i log: si può eseguire anche a server avviato.
+
+Export:  python -m components.turn_store export [--base-dir analysis/conversations]
+         [--out-dir analysis/conversations_export]
+"""
+import os
+import time
+import glob
+import json
+import queue
+import atexit
+import argparse
+import threading
+import logging
+from datetime import datetime
+from components.expiring_map import ExpiringMap
+
+logger = logging.getLogger("jarvis.turn_store")
+
+TS_FORMAT = "%Y-%m-%dT%H-%M-%S"
+
+class TurnStore:
+    def __init__(self, base_dir="analysis/conversations", flush_interval_sec=0.5, idle_ttl_sec=3600, max_users=None,
+                 on_write=None):
+        self.base_dir       = base_dir
+        self.flush_interval = flush_interval_sec
+        self.on_write       = on_write     # on_write(secondi): durata di write + fsync di ogni file nel writer
+        # { user_id: {"exists", "session_id", "turns", "last_ts"} }; una voce scaduta viene ricostruita dai file
+        self._state         = ExpiringMap("turn_store", idle_ttl_sec, max_users, refresh_on_access=True)
+        self._lock          = threading.Lock()
+        self._queue         = queue.Queue()
+        self._pending       = {}           # { user_id: record accodati non ancora scritti }
+        self._written       = threading.Condition()
+        os.makedirs(base_dir, exist_ok=True)
+        threading.Thread(target=self._writer_loop, name="turn-store", daemon=True).start()
+        atexit.register(self.flush)
+
+    # --- API ---
+    def bump_session(self, user_id):
+        """Apre una nuova sessione (reset) e ne ritorna l'id."""
+        with self._lock:
+            st = self._load(user_id)
+            st["session_id"] = st["session_id"] + 1 if st["exists"] else 1
+            st.update(exists=True, turns=0, last_ts=None)
+            session_id = st["session_id"]
+        self._enqueue(user_id, {"type": "session", "session_id": session_id})
+        return session_id
+
+    def begin_turn(self, user_id, now_dt=None):
+        """
+        Riserva il prossimo turno e ritorna i campi di testa dell'entry:
+        ``timestamp``, ``session_id``, ``turn_id``, ``delta_prev_ms``.
+        """
+        now_dt = now_dt or datetime.now()
+        with self._lock:
+            st = self._load(user_id)
+            delta_prev_ms = None
+            if st["last_ts"]:
+                last_dt = datetime.strptime(st["last_ts"], TS_FORMAT)
+                delta_prev_ms = int((now_dt - last_dt).total_seconds() * 1000)
+            now_str = now_dt.strftime(TS_FORMAT)
+            st.update(exists=True, turns=st["turns"] + 1, last_ts=now_str)
+            return {"timestamp": now_str, "session_id": st["session_id"],
+                    "turn_id": st["turns"], "delta_prev_ms": delta_prev_ms}
+
+    def append(self, user_id, entry):
+        """Accoda il turno completo per la scrittura in background."""
+        self._enqueue(user_id, {"type": "turn", "entry": entry})
+
+    def flush(self):
+        """Blocca finché tutti i record accodati sono stati scritti e sincronizzati."""
+        self._queue.join()
+
+    def pending(self):
+        """Record in coda non ancora scritti."""
+        return self._queue.qsize()
+
+    def export(self, user_id):
+        """Storico completo nel formato annidato ``{"user_id", "session_id", "sessions"}``."""
+        hist = self._read_legacy(user_id) or {"user_id": user_id, "session_id": 1, "sessions": [[]]}
+        for rec in self._read_records(user_id):
+            if rec["type"] == "session":
+                hist["session_id"] = rec["session_id"]
+                idx = hist["session_id"] - 1
+            else:
+                idx = rec["entry"].get("session_id", hist.get("session_id", 1)) - 1
+            while len(hist["sessions"]) <= idx:
+                hist["sessions"].append([])
+            if rec["type"] == "turn":
+                hist["sessions"][idx].append(rec["entry"])
+        return hist
+
+    def users(self):
+        paths = glob.glob(os.path.join(self.base_dir, "*.jsonl")) + glob.glob(os.path.join(self.base_dir, "*.json"))
+        return sorted({os.path.splitext(os.path.basename(p))[0] for p in paths})
+
+    # --- interni ---
+    def _path(self, user_id, ext):
+        return os.path.join(self.base_dir, f"{user_id}.{ext}")
+
+    def _load(self, user_id):
+        """
+        Stato in cache; al primo accesso (o dopo eviction/scadenza) viene
+        ricostruito dai file, dopo aver atteso la scrittura dei record ancora
+        in coda per l'utente: altrimenti i turni accodati non verrebbero
+        contati e i turn id si ripeterebbero.
+        """
+        st = self._state.get(user_id)
+        if st is None:
+            with self._written:
+                self._written.wait_for(lambda: not self._pending.get(user_id))
+            hist  = self.export(user_id)
+            known = os.path.exists(self._path(user_id, "json")) or os.path.exists(self._path(user_id, "jsonl"))
+            idx   = hist["session_id"] - 1
+            sess  = hist["sessions"][idx] if idx < len(hist["sessions"]) else []
+            st = self._state[user_id] = {"exists": known, "session_id": hist["session_id"],
+                                         "turns": len(sess), "last_ts": sess[-1]["timestamp"] if sess else None}
+        return st
+
+    def _read_legacy(self, user_id):
+        try:
+            with open(self._path(user_id, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _read_records(self, user_id):
+        try:
+            with open(self._path(user_id, "jsonl"), "r", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _enqueue(self, user_id, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._written:
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        self._queue.put((user_id, line))
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while True:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+                    if len(batch) >= 256:
+                        break
+            except queue.Empty:
+                pass
+            self._write_batch(batch)
+            with self._written:
+                for user_id, _ in batch:
+                    self._pending[user_id] -= 1
+                    if not self._pending[user_id]:
+                        del self._pending[user_id]
+                self._written.notify_all()
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_batch(self, batch):
+        by_user = {}
+        for user_id, line in batch:
+            by_user.setdefault(user_id, []).append(line)
+        for user_id, lines in by_user.items():
+            start = time.perf_counter()
+            try:
+                with open(self._path(user_id, "jsonl"), "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self.on_write:
+                    self.on_write(time.perf_counter() - start)
+            except OSError as e:
+                logger.error("Errore scrittura per %s: %s", user_id, e)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Esporta i log JSONL nel formato JSON annidato di score_RQ.py")
+    ap.add_argument("command", choices=["export"])
+    ap.add_argument("--base-dir", default="analysis/conversations")
+    ap.add_argument("--out-dir", default="analysis/conversations_export",
+                    help="cartella di destinazione, diversa da --base-dir (i log non vengono modificati)")
+    args = ap.parse_args()
+
+    if os.path.abspath(args.out_dir) == os.path.abspath(args.base_dir):
+        # un .json accanto al .jsonl farebbe da base al prossimo export e duplicherebbe i turni
+        ap.error("--out-dir deve essere diversa da --base-dir")
+    store = TurnStore(args.base_dir)
+    os.makedirs(args.out_dir, exist_ok=True)
+    for user_id in store.users():
+        hist = store.export(user_id)
+        with open(os.path.join(args.out_dir, f"{user_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(hist, f, indent=2, ensure_ascii=False)
+        print(f"[TurnStore] Esportato {user_id}")
+
+if __name__ == "__main__":
+    main()
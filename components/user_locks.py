@@ -0,0 +1,59 @@
+# components/user_locks.py
+import zlib
+import threading
+from contextlib import contextmanager
+
+class StripedLocks:
+    """
+    Lock per utente a strisce: ``stripes`` RLock fissi, l'utente viene
+    assegnato a una striscia tramite hash stabile dell'id. Utenti diversi
+    procedono in parallelo (salvo collisioni di striscia), le operazioni
+    dello stesso utente sono serializzate. Rientrante: un thread che tiene
+    già il lock dell'utente può chiamare componenti che lo riacquisiscono.
+
+        with locks(user_id):
+            ...
+    """
+    def __init__(self, stripes=64):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, user_id):
+        return self._locks[zlib.crc32(str(user_id).encode()) % len(self._locks)]
+
+    def __call__(self, user_id):
+        return self.lock_for(user_id)
+
+
+class UserLocks:
+    """
+    Un RLock dedicato per utente, creato al primo uso e rimosso quando
+    nessun thread lo tiene né lo attende (conteggio dei riferimenti). Per
+    le sezioni lunghe, come un turno LLM tenuto per tutto lo streaming:
+    con StripedLocks una collisione di striscia farebbe attendere per
+    secondi utenti estranei, qui utenti diversi non si bloccano mai.
+
+        with locks(user_id):
+            ...
+    """
+    def __init__(self):
+        self._locks = {}     # { user_id: [RLock, riferimenti] }
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def __call__(self, user_id):
+        with self._guard:
+            entry = self._locks.get(user_id)
+            if entry is None:
+                entry = self._locks[user_id] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[user_id]
+
+    def __len__(self):
+        return len(self._locks)
@@ -1,226 +1,502 @@
-import os, json, time, math
+import os, json, time, math, logging
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
-from collections import defaultdict
 
 # ─── Componenti locali ──────────────────────────────────────────
 from components.audio_processor     import AudioProcessor
-from components.audio_accumulator   import AudioAccumulator
-from components.emotion_recognizer  import EmotionRecognizer
+from components.audio_accumulator   import AudioAccumulator, SharedAudioAccumulator
 from components.chat_agent          import ChatAgent
 from components.ollama_chat_agent   import OllamaChatAgent
 from components.conversation_manager import ConversationManager
 from components.orchestrator        import Orchestrator
 from components.emotion_memory      import EmotionMemory
+from components.http_transport      import HttpTransport
+from components.emotion_jobs        import EmotionJobQueue
+from components.emotion_batcher     import EmotionBatcher
+from components.emotion_cache       import EmotionCache
+from components.response_cache      import ResponseCache
+from components.readiness           import Readiness
+from components.turn_store          import TurnStore
+from components.user_locks          import StripedLocks, UserLocks
+from components.state_backend       import create_backend
+from components.expiring_map        import ExpiringMap, registry_stats
+from components.metrics             import Registry
+from components.structured_log      import setup_logging, start_request, bind, current_ids
 
 # ─── Config ─────────────────────────────────────────────────────
 load_dotenv()
 OPENAI_API_KEY      = os.getenv("OPENAI_API_KEY")
 ENABLE_EMO_ENDPOINT = True    # True → abilita endpoint emozioni
-USE_LOCAL_MODEL     = False   # True → Ollama, False → OpenAI
+USE_LOCAL_MODEL     = os.getenv("USE_LOCAL_MODEL", "0").lower() in ("1", "true")   # True → Ollama, False → OpenAI
+OLLAMA_HOST         = os.getenv("OLLAMA_HOST", "http://localhost:11434")        # OpenAI: OPENAI_BASE_URL (letto dal client)
+OLLAMA_KEEP_ALIVE   = "30m"   # modello (e KV cache del prefisso) residente in Ollama tra un turno e l'altro
 EMO_TTL_SEC         = 90      # “freschezza” emozioni
 ACCUM_THRESHOLD_SEC = 25      # audio tot. prima di inferire
+ACCUM_DTYPE         = "int16" # campioni nei buffer utente: "int16" | "float32"
+ACCUM_MAX_TOTAL_MB  = 512     # tetto di memoria per i buffer di tutti gli utenti
+EMO_STREAMING       = False   # True → inferenza su finestre scorrevoli invece che ogni 25 s
+EMO_WINDOW_SEC      = 8       # lunghezza finestra (modalità streaming)
+EMO_HOP_SEC         = 4       # audio nuovo tra due inferenze (limita il costo CPU)
+EMO_SMOOTHING_ALPHA = 0.5     # peso della nuova finestra nella media mobile esponenziale
+FFMPEG_PRESPAWN     = 2       # processi ffmpeg pre-avviati (uno per chunk) per i formati non decodificabili in-process
+FFMPEG_TIMEOUT_SEC  = 30      # tetto di ogni decodifica ffmpeg: oltre, processo terminato e chunk scartato
+LAZY_STARTUP        = True    # True → il server si avvia subito, modello e warm-up in background (/ready)
+EMO_MODEL_DIR       = os.getenv("EMO_MODEL_DIR")  # snapshot locale del modello (nessun accesso all'hub)
+EMO_INFERENCE_ADDR  = os.getenv("EMO_INFERENCE_ADDR")  # "host:port" → modello nel processo components.inference_server
+EMO_INFERENCE_KEY   = os.getenv("EMO_INFERENCE_KEY", "jarvis")
+EMO_INFERENCE_WAIT_SEC = None  # attesa massima del processo di inferenza all'avvio (ping con backoff), None → senza limite
+LLM_WARMUP_CALL     = False   # True → anche una chiamata LLM di warm-up (OpenAI: 1 token a pagamento)
+EMO_BACKEND         = "eager" # "eager" | "int8" | "bf16" | "onnx" (vedi benchmarks/check_backend_drift.py)
+EMO_INTRA_OP_THREADS = None   # thread intra-op di PyTorch/ONNX Runtime (None → default)
+EMO_INTER_OP_THREADS = None
+EMO_LENGTH_MODE     = "padded" # "padded" (30 s Whisper) | "trimmed" | "bucketed" (vedi benchmarks/bench_encoder_length.py)
+EMO_CACHE_ENABLED   = True    # cache dei risultati per buffer PCM identici (retry, replay)
+EMO_CACHE_MAX       = 1024    # voci in memoria (LRU)
+EMO_CACHE_TTL_SEC   = 3600
+EMO_CACHE_DIR       = None    # es. "emo_cache/" → livello persistente su disco
+EMO_CACHE_DISK_MAX  = 10_000  # file massimi su disco (rimossi i più vecchi), scaduti tolti a ogni sweep
+ASYNC_EMO_INFERENCE = True    # True → inferenza in background, /upload_audio ritorna un job_id
+EMO_WORKERS         = 2       # worker del pool di inferenza
+EMO_JOB_MAX_WAIT_SEC = 30     # tetto di ?wait= su /emotion_job (thread del server occupato durante l'attesa)
+ENABLE_EMO_BATCHING = True    # True → micro-batching delle clip di utenti diversi
+EMO_BATCH_MAX       = 8       # clip massime per forward pass
+EMO_BATCH_WAIT_MS   = 50      # finestra di raccolta del batch
+EMO_PROMPT_VERBOSITY = "compact" # "none" | "top1" | "compact" | "full" (vedi benchmarks/bench_prompt_tokens.py)
+EMO_PROMPT_TOP_K    = 2       # emozioni nel prompt in modalità "compact"
+CONTEXT_TOKEN_BUDGET = 3000    # token massimi di storico per richiesta (None → storico completo)
+CONTEXT_KEEP_TURNS  = 4       # scambi recenti mai riassunti
+CONTEXT_DROP_STEP   = 4       # scambi esclusi insieme oltre il budget: prefisso del prompt stabile per più turni
+CONTEXT_SUMMARIZE   = True    # True → gli scambi più vecchi vengono riassunti in background, False → solo scartati
+RESPONSE_CACHE_ENABLED = False # True → risposte LLM riusate per turni identici (stesso storico, testo e bucket emotivo)
+RESPONSE_CACHE_MAX  = 512
+RESPONSE_CACHE_TTL_SEC = 3600
+RESPONSE_CACHE_SCENARIO_ONLY = True  # solo turni con uno scenario [CONTEXT] … [END CONTEXT]
+CONVERSATIONS_DIR   = os.getenv("CONVERSATIONS_DIR", "analysis/conversations")   # log JSONL per utente (export: python -m components.turn_store export)
+STATE_BACKEND_URL   = os.getenv("STATE_BACKEND_URL")  # None → in-process; "manager://host:port" | "redis://host:port/db" → stato condiviso tra nodi
+AUDIO_IDLE_TTL_SEC  = 600     # buffer audio abbandonati (in-process e nel backend condiviso)
+USER_STATE_TTL_SEC  = 3600    # storico, metriche e stato dei turni di un utente inattivo
+USER_STATE_MAX_USERS = 10_000  # tetto LRU delle mappe per utente in-process
+RESET_COUNTER_TTL_SEC = 7 * 24 * 3600
+USER_LOCK_STRIPES   = 64      # lock a strisce delle sezioni brevi; il turno LLM usa un lock dedicato per utente
+LOG_LEVEL           = os.getenv("LOG_LEVEL", "INFO")   # DEBUG → anche prompt, risposte e stato del buffer
+HTTP_POOL_SIZE      = 10      # connessioni keep-alive verso il backend LLM
+HTTP_CONNECT_TIMEOUT_SEC = 5
+HTTP_READ_TIMEOUT_SEC    = 60
 
 # ─── Metriche runtime ──────────────────────────────────────────
-module_latencies = {}          # user_id → {"wav":..,"emo":..}
-audio_stats      = {}          # user_id → {"chunk_duration_ms":..}
-reset_counter    = defaultdict(int)  # user_id → count
+# stato per utente: letture/scritture sotto user_locks(user_id)
+# mappe con TTL e tetto LRU: gauge in /state_stats
+module_latencies = ExpiringMap("module_latencies", USER_STATE_TTL_SEC, USER_STATE_MAX_USERS,
+                               refresh_on_access=True)       # user_id → {"wav":..,"emo":..}
+audio_stats      = ExpiringMap("audio_stats", USER_STATE_TTL_SEC, USER_STATE_MAX_USERS)    # user_id → {"chunk_duration_ms":..}
+reset_counter    = ExpiringMap("reset_counter", RESET_COUNTER_TTL_SEC, USER_STATE_MAX_USERS)  # user_id → count
+user_locks       = StripedLocks(USER_LOCK_STRIPES)   # sezioni critiche brevi su stato e buffer
+turn_locks       = UserLocks()                       # un turno chat (o reset) per utente alla volta, lock dedicato
 
-# ─── Helpers log ────────────────────────────────────────────────
-def log(msg, user_id="system"):
-    ts = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-    print(f"[{ts}] [{user_id}] {msg}")
+# ─── Log strutturato (JSON in background, vedi components/structured_log.py) ─
+setup_logging(LOG_LEVEL)
+logger = logging.getLogger("jarvis.server")
 
 # ─── Instanzia moduli ───────────────────────────────────────────
-log("Avvio server...")
+logger.info("Avvio server...")
 app               = Flask(__name__)
-audio_proc        = AudioProcessor()
-accum             = AudioAccumulator(threshold_sec=ACCUM_THRESHOLD_SEC)
-emo_rec           = EmotionRecognizer() if ENABLE_EMO_ENDPOINT else None
-chat_agent        = OllamaChatAgent() if USE_LOCAL_MODEL else ChatAgent(api_key=OPENAI_API_KEY)
-conv_mgr          = ConversationManager()
-emo_mem           = EmotionMemory(ttl_sec=EMO_TTL_SEC)
-orchestrator      = Orchestrator(chat_agent, conv_mgr, emo_mem)
+audio_proc        = AudioProcessor(ffmpeg_prespawn=FFMPEG_PRESPAWN, ffmpeg_timeout_sec=FFMPEG_TIMEOUT_SEC)
+state_backend     = create_backend(STATE_BACKEND_URL, max_users=USER_STATE_MAX_USERS)
+accum_kwargs      = dict(threshold_sec=ACCUM_THRESHOLD_SEC, dtype=ACCUM_DTYPE, max_total_mb=ACCUM_MAX_TOTAL_MB,
+                         window_sec=EMO_WINDOW_SEC if EMO_STREAMING else None,
+                         hop_sec=EMO_HOP_SEC, locks=user_locks, idle_ttl_sec=AUDIO_IDLE_TTL_SEC,
+                         max_users=USER_STATE_MAX_USERS)
+# in-process: buffer preallocati; con un backend condiviso i buffer stanno nel backend
+accum             = (SharedAudioAccumulator(state_backend, **accum_kwargs)
+                     if STATE_BACKEND_URL else AudioAccumulator(**accum_kwargs))
+transport         = HttpTransport(pool_size=HTTP_POOL_SIZE,
+                                  connect_timeout=HTTP_CONNECT_TIMEOUT_SEC,
+                                  read_timeout=HTTP_READ_TIMEOUT_SEC)
+chat_agent        = (OllamaChatAgent(host=OLLAMA_HOST, transport=transport, keep_alive=OLLAMA_KEEP_ALIVE) if USE_LOCAL_MODEL
+                     else ChatAgent(api_key=OPENAI_API_KEY, transport=transport))
+# istanza separata per i riassunti: non sovrascrive i metadata del turno in corso
+summary_agent     = (OllamaChatAgent(host=OLLAMA_HOST, transport=transport, temperature=0.2, keep_alive=OLLAMA_KEEP_ALIVE)
+                     if USE_LOCAL_MODEL
+                     else ChatAgent(api_key=OPENAI_API_KEY, temperature=0.2, transport=transport))
 
-log("Componenti inizializzati con successo.")
+def summarize_history(previous_summary, messages):
+    """Riassunto progressivo degli scambi più vecchi, usato da ConversationManager."""
+    exchanges = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = [
+        {"role": "system", "content": "Riassumi la conversazione in italiano in massimo 100 parole, "
+                                      "mantenendo fatti, richieste dell'utente e stato emotivo rilevante."},
+        {"role": "user", "content": f"Riassunto precedente: {previous_summary or '(nessuno)'}\n\n"
+                                    f"Nuovi scambi:\n{exchanges}"},
+    ]
+    text = summary_agent.get_response(prompt)
+    if not summary_agent.get_last_metadata().get("llm_latency_ms") or text.startswith(("Errore:", "[Ollama]")):
+        raise RuntimeError(text)
+    return text.strip()
+
+conv_mgr          = ConversationManager(max_context_tokens=CONTEXT_TOKEN_BUDGET,
+                                        summarizer=summarize_history if CONTEXT_SUMMARIZE else None,
+                                        keep_recent_turns=CONTEXT_KEEP_TURNS, drop_step_turns=CONTEXT_DROP_STEP,
+                                        locks=user_locks, backend=state_backend, idle_ttl_sec=USER_STATE_TTL_SEC,
+                                        max_users=USER_STATE_MAX_USERS)
+emo_mem           = EmotionMemory(ttl_sec=EMO_TTL_SEC,
+                                  smoothing_alpha=EMO_SMOOTHING_ALPHA if EMO_STREAMING else None,
+                                  locks=user_locks, backend=state_backend)
+response_cache    = (ResponseCache(max_entries=RESPONSE_CACHE_MAX, ttl_sec=RESPONSE_CACHE_TTL_SEC,
+                                   scenario_only=RESPONSE_CACHE_SCENARIO_ONLY)
+                     if RESPONSE_CACHE_ENABLED else None)
+orchestrator      = Orchestrator(chat_agent, conv_mgr, emo_mem, response_cache=response_cache,
+                                 emotion_verbosity=EMO_PROMPT_VERBOSITY, emotion_top_k=EMO_PROMPT_TOP_K)
+readiness         = Readiness()
+turn_store        = TurnStore(CONVERSATIONS_DIR, idle_ttl_sec=USER_STATE_TTL_SEC, max_users=USER_STATE_MAX_USERS)
+emo_rec = emo_cache = emo_batcher = emo_jobs = None   # popolati da load_emotion_stack()
+
+# ─── Metriche Prometheus (/metrics) ─────────────────────────────
+metrics        = Registry(prefix="jarvis_")
+stage_seconds  = metrics.histogram("stage_duration_seconds", "Durata per fase della pipeline", ["stage"])
+turn_store.on_write = lambda seconds: stage_seconds.observe(seconds, stage="log_write")   # write + fsync nel writer
+requests_total = metrics.counter("http_requests_total", "Richieste HTTP per endpoint e codice di stato", ["endpoint", "status"])
+errors_total   = metrics.counter("errors_total", "Errori per endpoint (5xx ed errori a metà stream)", ["endpoint"])
+upload_results = metrics.counter("upload_results_total", "Esito di /upload_audio", ["status"])
+cache_lookups  = metrics.counter("cache_lookups_total", "Lookup nelle cache emozioni e risposte", ["cache", "result"])
+metrics.gauge("emotion_jobs_pending", "Inferenze emozioni in corso", lambda: emo_jobs.pending() if emo_jobs else None)
+metrics.gauge("emotion_batcher_queue", "Clip in attesa di un batch", lambda: emo_batcher.stats()["pending"] if emo_batcher else None)
+metrics.gauge("turn_store_queue", "Record del log turni non ancora scritti", lambda: turn_store.pending())
+metrics.gauge("state_map_entries", "Voci per mappa di stato per utente",
+              lambda: {name: s["entries"] for name, s in registry_stats().items()}, ["map"])
+metrics.gauge("state_map_bytes", "Byte stimati per mappa di stato per utente",
+              lambda: {name: s["approx_bytes"] for name, s in registry_stats().items()}, ["map"])
+
+def load_emotion_stack():
+    """Carica il modello emozioni (import di torch incluso), lo scalda e crea cache/batcher/job queue."""
+    global emo_rec, emo_cache, emo_batcher, emo_jobs
+    if EMO_INFERENCE_ADDR:
+        # modello condiviso fra i worker: l'audio passa via shared memory, il batching lo fa il server
+        from components.inference_server import RemoteEmotionRecognizer
+        rec = RemoteEmotionRecognizer(EMO_INFERENCE_ADDR, authkey=EMO_INFERENCE_KEY.encode())
+        rec.warm_up(max_wait_sec=EMO_INFERENCE_WAIT_SEC)     # attende il processo di inferenza se parte dopo
+    else:
+        from components.emotion_recognizer import EmotionRecognizer   # import lento: torch + transformers
+        rec = EmotionRecognizer(backend=EMO_BACKEND, intra_op_threads=EMO_INTRA_OP_THREADS,
+                                inter_op_threads=EMO_INTER_OP_THREADS, length_mode=EMO_LENGTH_MODE,
+                                local_dir=EMO_MODEL_DIR)
+        rec.warm_up()
+    emo_cache   = (EmotionCache(rec.cache_signature(), max_entries=EMO_CACHE_MAX,
+                                ttl_sec=EMO_CACHE_TTL_SEC, disk_dir=EMO_CACHE_DIR,
+                                disk_max_entries=EMO_CACHE_DISK_MAX)
+                   if EMO_CACHE_ENABLED else None)
+    emo_batcher = (EmotionBatcher(rec, max_batch=EMO_BATCH_MAX, max_wait_ms=EMO_BATCH_WAIT_MS)
+                   if ASYNC_EMO_INFERENCE and ENABLE_EMO_BATCHING and not EMO_INFERENCE_ADDR else None)
+    # con il batcher servono almeno EMO_BATCH_MAX worker in attesa per riempire un batch
+    emo_jobs    = (EmotionJobQueue(emo_batcher or rec, on_done=lambda *a: on_emotions_inferred(*a),
+                                   workers=max(EMO_WORKERS, EMO_BATCH_MAX) if emo_batcher else EMO_WORKERS)
+                   if ASYNC_EMO_INFERENCE else None)
+    emo_rec = rec
+    logger.info("Modello emozioni caricato e pre-riscaldato.")
+
+def warm_up_llm():
+    chat_agent.warm_up(call=LLM_WARMUP_CALL)
+    logger.info("Connessione al backend LLM pre-riscaldata.")
+
+if LAZY_STARTUP:
+    if ENABLE_EMO_ENDPOINT:
+        readiness.start("emotion_model", load_emotion_stack)
+    readiness.start("llm", warm_up_llm)
+else:
+    if ENABLE_EMO_ENDPOINT:
+        load_emotion_stack()
+    warm_up_llm()
+
+logger.info("Componenti inizializzati con successo.")
 
 # ════════════════════════ ENDPOINTS ════════════════════════════
+@app.route("/ready", methods=["GET"])
+def ready():
+    """200 quando modello emozioni e backend LLM sono caricati e pre-riscaldati, altrimenti 503."""
+    is_ready = readiness.is_ready() if LAZY_STARTUP else True
+    return jsonify({"ready": is_ready, "components": readiness.snapshot()}), 200 if is_ready else 503
+
 @app.route("/upload_audio", methods=["POST"])
 def upload_audio():
-    log("Richiesta POST ricevuta su /upload_audio", user_id=request.form.get("user_id", "default_user"))
+    user_id  = request.form.get("user_id", "default_user")
+    bind(user_id=user_id)
+    logger.debug("Richiesta POST ricevuta su /upload_audio")
 
-    if not emo_rec:
-        log("Riconoscimento emozioni disabilitato", user_id=request.form.get("user_id", "default_user"))
+    if not ENABLE_EMO_ENDPOINT:
+        logger.warning("Riconoscimento emozioni disabilitato")
         return jsonify({"error": "Riconoscimento emozioni disabilitato"}), 400
+    if not emo_rec:
+        logger.warning("Modello emozioni non ancora pronto")
+        return jsonify({"error": "Modello emozioni in caricamento"}), 503
     if "audio" not in request.files:
-        log("Manca il file audio", user_id=request.form.get("user_id", "default_user"))
+        logger.warning("Manca il file audio")
         return jsonify({"error": "Manca il file audio"}), 400
 
-    user_id  = request.form.get("user_id", "default_user")
-    tmp_path = "temp_audio.wav"
-    request.files["audio"].save(tmp_path)
-    log("Audio chunk ricevuto.", user_id)
+    upload   = request.files["audio"]
+    data     = upload.read()
+    logger.debug("Audio chunk ricevuto (%d byte).", len(data))
 
     try:
         t_start = time.time()
-        wav_path  = audio_proc.convert_to_wav(tmp_path) or tmp_path
+        chunk_arr = audio_proc.decode_bytes(data, 30, suffix=os.path.splitext(upload.filename or "")[1])
         wav_ms = (time.time()-t_start)*1000
-        log(f"Audio convertito in WAV. Percorso: {wav_path}", user_id)
-
-        chunk_arr = audio_proc.load_audio(wav_path, 30)
-        dur = len(chunk_arr) / 16_000
-        log(f"Aggiungo {dur:.2f}s al buffer.", user_id)
+        stage_seconds.observe_ms(wav_ms, stage="upload_decode")
+        if chunk_arr is None or len(chunk_arr) == 0:
+            logger.warning("Chunk audio non decodificabile")
+            return jsonify({"error": "Chunk audio non decodificabile"}), 400
+        logger.debug("Audio decodificato in memoria (%.1f ms), aggiungo %.2fs al buffer.", wav_ms, len(chunk_arr) / 16_000)
 
-        accum.add_chunk(user_id, chunk_arr)
-        total_dur = accum.threshold * (sum(len(b) for b in accum._buffers[user_id]) / (accum.threshold * 16_000))
-        log(f"Durata buffer: {total_dur:.2f}/{ACCUM_THRESHOLD_SEC}s.", user_id)
+        # aggiunta, controllo soglia e prelievo del buffer sono atomici per utente (attesa sul lock inclusa nella metrica)
+        with stage_seconds.timer(stage="accumulator"), user_locks(user_id):
+            module_latencies.setdefault(user_id, {})["wav"] = wav_ms
+            accum.add_chunk(user_id, chunk_arr)
+            if logger.isEnabledFor(logging.DEBUG):     # buffered_seconds costa un round trip col backend condiviso
+                logger.debug("Durata buffer: %.2f/%ss.", accum.buffered_seconds(user_id), ACCUM_THRESHOLD_SEC)
 
-        if not accum.should_infer(user_id):
-            log("Buffering non completato, attesa...", user_id)
-            return jsonify({"status": "buffering"})
+            if not accum.should_infer(user_id):
+                logger.debug("Buffering non completato, attesa...")
+                upload_results.inc(status="buffering")
+                return jsonify({"status": "buffering"})
+            if EMO_STREAMING and emo_jobs and emo_jobs.has_pending(user_id):
+                logger.debug("Finestra precedente ancora in inferenza, salto questo hop.")
+                upload_results.inc(status="buffering")
+                return jsonify({"status": "buffering"})
+            full_arr = accum.pop_concat(user_id)
 
         # inferenza
-        full_arr = accum.pop_concat(user_id)
-        log(f"Inizio inferenza emozioni su {len(full_arr)/16_000:.2f}s audio…", user_id)
-        t_emo_start = time.time()
-        emotions = emo_rec.predict(full_arr)
-        emo_ms = (time.time()-t_emo_start)*1000
-        chunk_ms = len(full_arr)/16_000*1000
-        probs_float = {e: p for e, p in emotions}
-        top_emotion = max(probs_float, key=probs_float.get)
-        entropy     = -sum(p * math.log2(p) for p in probs_float.values())
-        emo_dict = {
-            "probs": probs_float,
-            "top_emotion": top_emotion,
-            "entropy": entropy,
-            "emo_timestamp": datetime.utcnow().isoformat(),
-            "chunk_duration_ms": chunk_ms
-        }
-        log(f"Emozioni inferite → {emo_dict}", user_id)
-        emo_mem.update(user_id, emo_dict)
+        cached   = emo_cache.get(emo_cache.key(full_arr)) if emo_cache else None
+        if emo_cache:
+            cache_lookups.inc(cache="emotion", result="hit" if cached else "miss")
+        if cached:
+            logger.debug("Emozioni trovate in cache, inferenza saltata.")
+            emo_dict = store_emotions(user_id, cached, full_arr, 0.0)
+            upload_results.inc(status="inferred")
+            return jsonify({"status": "inferred", "emotions": emo_dict, "cached": True})
 
-        audio_stats[user_id] = {"chunk_duration_ms": chunk_ms}
-        module_latencies[user_id] = {"wav": wav_ms, "emo": emo_ms}
+        logger.debug("Inizio inferenza emozioni su %.2fs audio…", len(full_arr) / 16_000)
+        if ASYNC_EMO_INFERENCE:
+            job_id = emo_jobs.submit(user_id, full_arr)
+            logger.debug("Inferenza accodata (job %s).", job_id)
+            upload_results.inc(status="inferring")
+            return jsonify({"status": "inferring", "job_id": job_id})
 
+        t_emo_start = time.time()
+        emotions = emo_rec.predict(full_arr)
+        emo_dict = on_emotions_inferred(user_id, emotions, full_arr, (time.time()-t_emo_start)*1000)
+        upload_results.inc(status="inferred")
         return jsonify({"status": "inferred", "emotions": emo_dict})
+    except MemoryError as e:
+        logger.warning("Buffer audio non allocabile: %s", e)
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        log(f"Errore durante l'elaborazione audio: {e}", user_id)
+        logger.exception("Errore durante l'elaborazione audio: %s", e)
         return jsonify({"error": str(e)}), 500
-    finally:
-        os.remove(tmp_path)
-        log(f"File temporaneo rimosso: {tmp_path}", user_id)
+
+@app.route("/emotion_job/<job_id>", methods=["GET"])
+def emotion_job(job_id):
+    """Stato di un job di inferenza; ``?wait=<s>`` attende la fine fino a s secondi (max EMO_JOB_MAX_WAIT_SEC)."""
+    if not emo_jobs:
+        return jsonify({"error": "Inferenza asincrona disabilitata"}), 400
+    wait = request.args.get("wait", type=float)
+    job  = (emo_jobs.wait(job_id, timeout=min(wait, EMO_JOB_MAX_WAIT_SEC)) if wait and wait > 0
+            else emo_jobs.get(job_id))
+    if not job:
+        return jsonify({"error": "Job sconosciuto o scaduto"}), 404
+    return jsonify(job)
+
+def summarize_emotions(emotions):
+    """Probabilità per label, top emotion ed entropia da una lista (label, prob)."""
+    probs_float = {e: p for e, p in emotions}
+    return {
+        "probs": probs_float,
+        "top_emotion": max(probs_float, key=probs_float.get),
+        "entropy": -sum(p * math.log2(p) for p in probs_float.values())
+    }
+
+def on_emotions_inferred(user_id, emotions, audio_array, emo_ms):
+    """Callback di fine inferenza: salva il riepilogo in cache e in EmotionMemory."""
+    summary = summarize_emotions(emotions)
+    stage_seconds.observe_ms(emo_ms, stage="emotion_inference")
+    if emo_cache:
+        emo_cache.put(emo_cache.key(audio_array), summary)
+    return store_emotions(user_id, summary, audio_array, emo_ms)
+
+def store_emotions(user_id, summary, audio_array, emo_ms):
+    """Costruisce il dizionario emozioni, lo salva in EmotionMemory e aggiorna le metriche."""
+    chunk_ms = len(audio_array)/16_000*1000
+    emo_dict = dict(summary,
+                    emo_timestamp=datetime.utcnow().isoformat(),
+                    chunk_duration_ms=chunk_ms)
+    with user_locks(user_id):
+        emo_dict = emo_mem.update(user_id, emo_dict)
+        audio_stats[user_id] = {"chunk_duration_ms": chunk_ms}
+        module_latencies.setdefault(user_id, {})["emo"] = emo_ms
+    logger.info("Emozioni inferite → %s (%.0f ms)", emo_dict.get("top_emotion"), emo_ms, extra={"user_id": user_id})
+    logger.debug("Emozioni complete: %s", emo_dict, extra={"user_id": user_id})
+    return emo_dict
+
+@app.route("/emotion_stats", methods=["GET"])
+def emotion_stats():
+    """Statistiche del micro-batching (dimensione batch, attesa, latenza) e della cache risultati."""
+    return jsonify({"batcher": emo_batcher.stats() if emo_batcher else None,
+                    "cache":   emo_cache.stats() if emo_cache else None})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Istogrammi per fase, contatori e gauge in formato testo Prometheus."""
+    return Response(metrics.render(), content_type=Registry.CONTENT_TYPE)
+
+@app.before_request
+def correlate_request():
+    """Id di correlazione della richiesta (header ``X-Request-ID`` se presente), riportato nei log."""
+    start_request(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def count_request(response):
+    request_id, _ = current_ids()
+    if request_id:
+        response.headers["X-Request-ID"] = request_id
+    endpoint = request.endpoint or "unmatched"
+    requests_total.inc(endpoint=endpoint, status=str(response.status_code))
+    if response.status_code >= 500:
+        errors_total.inc(endpoint=endpoint)
+    return response
+
+@app.route("/state_stats", methods=["GET"])
+def state_stats():
+    """Voci, byte stimati, scadute ed espulse di ogni mappa di stato per utente del processo."""
+    return jsonify(registry_stats())
+
+@app.route("/response_cache", methods=["GET"])
+def response_cache_stats():
+    return jsonify(response_cache.stats() if response_cache else None)
+
+@app.route("/response_cache/invalidate", methods=["POST"])
+def response_cache_invalidate():
+    """Invalida le risposte di uno scenario: ``{"scenario": "<testo [CONTEXT] … [END CONTEXT]> o id"}``."""
+    if not response_cache:
+        return jsonify({"error": "Response cache disabilitata"}), 400
+    scenario = (request.get_json(silent=True) or {}).get("scenario")
+    if not scenario:
+        return jsonify({"error": "scenario mancante"}), 400
+    return jsonify({"removed": response_cache.invalidate_scenario(scenario)})
 
 @app.route("/chat_message", methods=["POST"])
 def chat_message():
-    log("Richiesta POST ricevuta su /chat_message", user_id=request.get_json().get("user_id", "default_user"))
-
     data    = request.get_json(silent=True) or {}
     user_id = data.get("user_id", "default_user")
     text    = data.get("text", "").strip()
+    bind(user_id=user_id)
+    logger.debug("Richiesta POST ricevuta su /chat_message")
 
     words = len(text.split())
     chars = len(text)
 
     if not text:
-        log("Campo 'text' mancante nella richiesta", user_id)
+        logger.warning("Campo 'text' mancante nella richiesta")
         return jsonify({"error": "Campo 'text' mancante"}), 400
 
-    log(f"Prompt ricevuto: «{text}»", user_id)
+    logger.debug("Prompt ricevuto: «%s»", text)
+    if data.get("stream"):
+        return Response(stream_with_context(_stream_chat(user_id, text, words, chars, current_ids())),
+                        mimetype="application/x-ndjson")
     try:
-        response_text, llm_meta = orchestrator.generate_response(user_id, text)
-        lat = module_latencies.get(user_id, {}).copy()
-        lat["llm"] = llm_meta.get("llm_latency_ms")
-        log(f"Risposta LLM generata: «{response_text[:80]}…»", user_id)
-        save_turn(user_id, text, response_text, llm_meta, words, chars, lat)
+        with turn_locks(user_id):
+            response_text, llm_meta = orchestrator.generate_response(user_id, text)
+            lat = latency_snapshot(user_id)
+            lat["llm"] = llm_meta.get("llm_latency_ms")
+            lat["llm_ttft"] = llm_meta.get("ttft_ms")
+            observe_llm(llm_meta)
+            logger.debug("Risposta LLM generata: «%.80s…»", response_text)
+            save_turn(user_id, text, response_text, llm_meta, words, chars, lat)
         return jsonify({"user_id": user_id, "response": response_text})
     except Exception as e:
-        log(f"Errore durante la generazione della risposta LLM: {e}", user_id)
+        logger.exception("Errore durante la generazione della risposta LLM: %s", e)
         return jsonify({"error": str(e)}), 500
 
+def observe_llm(llm_meta):
+    """Metriche di un turno: costruzione del prompt, chiamata LLM (solo se eseguita) e response cache."""
+    stage_seconds.observe_ms(llm_meta.get("prompt_build_ms"), stage="prompt_build")
+    if llm_meta.get("cache_hit") is not None:
+        cache_lookups.inc(cache="response", result="hit" if llm_meta["cache_hit"] else "miss")
+    if not llm_meta.get("cache_hit"):
+        stage_seconds.observe_ms(llm_meta.get("llm_latency_ms"), stage="llm")
+        stage_seconds.observe_ms(llm_meta.get("ttft_ms"), stage="llm_ttft")
+
+def _stream_chat(user_id, text, words, chars, ids):
+    """
+    Corpo NDJSON di /chat_message in modalità streaming: una riga
+    ``{"token": ...}`` per token, poi ``{"done": true, "response": ...}``.
+    ``ids`` riporta gli id di correlazione della richiesta nel generatore.
+    """
+    bind(*ids)
+    try:
+        with turn_locks(user_id):
+            stream = orchestrator.generate_stream(user_id, text)
+            while True:
+                try:
+                    token = next(stream)
+                except StopIteration as stop:
+                    response_text, llm_meta = stop.value
+                    break
+                yield json.dumps({"token": token}, ensure_ascii=False) + "\n"
+            lat = latency_snapshot(user_id)
+            lat["llm"] = llm_meta.get("llm_latency_ms")
+            lat["llm_ttft"] = llm_meta.get("ttft_ms")
+            observe_llm(llm_meta)
+            logger.debug("Risposta LLM (stream) generata: «%.80s…»", response_text)
+            save_turn(user_id, text, response_text, llm_meta, words, chars, lat)
+        yield json.dumps({"done": True, "user_id": user_id, "response": response_text}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        logger.exception("Errore durante lo streaming della risposta LLM: %s", e)
+        errors_total.inc(endpoint="chat_message")
+        yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
 @app.route("/reset_conversation", methods=["POST"])
 def reset_conversation():
-    log("Richiesta POST ricevuta su /reset_conversation", user_id=request.form.get("user_id", "default_user"))
     user_id = request.form.get("user_id", "default_user")
-    conv_mgr.reset(user_id)
-    emo_mem.reset(user_id)
-    accum.pop_concat(user_id)
-    bump_session_file(user_id)
-    reset_counter[user_id] += 1
-    log("Conversazione resettata.", user_id)
+    bind(user_id=user_id)
+    logger.debug("Richiesta POST ricevuta su /reset_conversation")
+    # attende l'eventuale turno chat in corso, poi azzera tutto lo stato dell'utente in un colpo
+    with turn_locks(user_id), user_locks(user_id):
+        conv_mgr.reset(user_id)
+        emo_mem.reset(user_id)
+        accum.reset(user_id)
+        bump_session_file(user_id)
+        reset_counter[user_id] = reset_counter.get(user_id, 0) + 1
+    logger.info("Conversazione resettata.")
     return jsonify({"message": "Conversazione resettata."})
 
-# ─── Persistenza JSON ───────────────────────────────────────────
+# ─── Persistenza JSONL ──────────────────────────────────────────
 def bump_session_file(user_id):
-    log(f"Verifica file di sessione per {user_id}...", user_id)
-    filename = f"analysis/conversations/{user_id}.json"
-    os.makedirs("conversations", exist_ok=True)
-    if os.path.exists(filename):
-        with open(filename, "r+", encoding="utf-8") as f:
-            hist = json.load(f)
-            hist["session_id"] = hist.get("session_id", 0) + 1
-            # Assicuriamo che esista un array per la nuova sessione
-            while len(hist.get("sessions", [])) < hist["session_id"]:
-                hist["sessions"].append([])
-            f.seek(0)
-            json.dump(hist, f, indent=2, ensure_ascii=False)
-            f.truncate()
-        log(f"Sessione aggiornata per {user_id}", user_id)
-    else:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump({"user_id": user_id, "session_id": 1, "sessions": [[]]}, f, indent=2, ensure_ascii=False)
-        log(f"Nuovo file di sessione creato per {user_id}", user_id)
+    session_id = turn_store.bump_session(user_id)
+    logger.info("Sessione %s avviata.", session_id)
 
-def save_turn(user_id, text, bot_response, llm_meta, words, chars, latencies):
-    filename = f"analysis/conversations/{user_id}.json"
-    now_dt   = datetime.now()
-    now_str  = now_dt.strftime("%Y-%m-%dT%H-%M-%S")
+def latency_snapshot(user_id):
+    with user_locks(user_id):
+        return dict(module_latencies.get(user_id, {}))
 
-    if os.path.exists(filename):
-        with open(filename, "r", encoding="utf-8") as f:
-            hist = json.load(f)
-    else:
-        hist = {"user_id": user_id, "session_id": 1, "sessions": [[]]}
-
-    idx = hist.get("session_id", 1) - 1
-    while len(hist["sessions"]) <= idx:
-        hist["sessions"].append([])
-
-    last_ts = None
-    if os.path.exists(filename):
-        with open(filename, "r", encoding="utf-8") as f:
-            tmp_hist = json.load(f)
-        sess_idx = tmp_hist.get("session_id", 1) - 1
-        if sess_idx < len(tmp_hist.get("sessions", [])) and tmp_hist["sessions"][sess_idx]:
-            last_ts = tmp_hist["sessions"][sess_idx][-1]["timestamp"]
-    delta_prev_ms = None
-    if last_ts:
-        last_dt = datetime.strptime(last_ts, "%Y-%m-%dT%H-%M-%S")
-        delta_prev_ms = int((now_dt - last_dt).total_seconds() * 1000)
-
-    turn_id = len(hist["sessions"][idx]) + 1
-
-    entry = {
-        "timestamp": now_str,
-        "session_id": hist.get("session_id", 1),
-        "turn_id": turn_id,
-        "delta_prev_ms": delta_prev_ms,
-        "transcription": text,
-        "words": words,
-        "chars": chars,
-        "emotions": emo_mem.get_recent(user_id) or "Non rilevate",
-        "llm": llm_meta,
-        "latencies_ms": latencies,
-        "reset_count": reset_counter.get(user_id, 0),
-        "llm_response": bot_response
-    }
-
-    hist["sessions"][idx].append(entry)
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(hist, f, indent=2, ensure_ascii=False)
-    log(f"Turno salvato per {user_id}", user_id)
+def save_turn(user_id, text, bot_response, llm_meta, words, chars, latencies):
+    # solo accodamento: la scrittura su disco è misurata dal writer come "log_write"
+    with stage_seconds.timer(stage="log_enqueue"):
+        entry = turn_store.begin_turn(user_id)
+        with user_locks(user_id):
+            emotions    = emo_mem.get_recent(user_id)
+            reset_count = reset_counter.get(user_id, 0)
+        entry.update({
+            "transcription": text,
+            "words": words,
+            "chars": chars,
+            "emotions": emotions or "Non rilevate",
+            "llm": llm_meta,
+            "latencies_ms": latencies,
+            "reset_count": reset_count,
+            "llm_response": bot_response
+        })
+        turn_store.append(user_id, entry)
+    logger.debug("Turno salvato.")
 
 # ────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
-    log("Server in avvio…")
+    logger.info("Server in avvio…")
     app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file